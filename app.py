@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, make_response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, make_response, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
@@ -8,18 +8,23 @@ import os
 import json
 from datetime import datetime, timedelta
 import uuid
+import copy
 import hashlib
 import secrets
 import smtplib
 import re
+import base64
+import codecs
+import csv
+import gzip
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from functools import wraps
 from flask_login import current_user
 import random
-from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
 import socket  # Added for socket.timeout and socket.gaierror
 import logging
 
@@ -27,6 +32,8 @@ import logging
 try:
     from mongo_users import (
         find_user_by_id as mu_find_user_by_id,
+        find_session_user as mu_find_session_user,
+        on_user_changed as mu_on_user_changed,
         find_user_by_email_or_username as mu_find_user_by_email_or_username,
         create_user as mu_create_user,
         verify_password as mu_verify_password,
@@ -39,6 +46,22 @@ except (ImportError, RuntimeError) as e:
     MONGO_AVAILABLE = False
     users_col = None
 
+from pricing import (apply_delta, apply_pricing, aggregate_lines, aggregates_delta, empty_aggregates,
+                     needs_pricing, summary_from_aggregates)
+from blanket_pricing import BlanketPriceMatrix
+from password_hashing import (PasswordHashBusy, check_password, hash_password, stats as password_hash_stats,
+                              verify_and_rehash)
+from sqlite_carts import SqliteCartStore
+from json_users import JsonUserStore
+from company_directory import CompanyDirectory, sort_key as company_sort_key
+from company_search import CompanySearchIndex
+from company_import import (DEFAULT_CHUNK_SIZE as DEFAULT_IMPORT_CHUNK_SIZE, company_keys, detect_format,
+                            ensure_company_key_indexes, import_companies, read_records as read_company_records)
+from otp_tokens import (OTP_EXPIRED, OTP_MISSING, OTP_OK, PURPOSE_PASSWORD_RESET, PURPOSE_REGISTER,
+                        init_otp_tokens, issue_otp, verify_otp)
+from single_flight import SingleFlight
+from ttl_cache import TTLCache, all_stats as cache_stats, register as register_cache
+
 # Load environment variables
 load_dotenv()
 
@@ -88,9 +111,10 @@ def company_required(view_func):
         
         if company_id:
             # Lazy import to avoid circular dependencies
-            from app import get_company_name_by_id, get_company_email_by_id  # type: ignore
-            company_name = get_company_name_by_id(company_id) or ''
-            company_email = get_company_email_by_id(company_id) or ''
+            from app import get_company  # type: ignore
+            company = get_company(company_id) or {}
+            company_name = company.get('name', '')
+            company_email = company.get('email', '')
             app.logger.info("[DEBUG] Found company details - name: %s, email: %s", company_name, company_email)
             
             if company_name or company_email:
@@ -208,7 +232,7 @@ if MONGO_URI and USE_MONGO:
         print("Attempting to connect to MongoDB...")
         
         # Updated MongoDB connection with SSL options
-        from pymongo import MongoClient
+        from pymongo import MongoClient, ReturnDocument
 
         from pymongo.errors import ConnectionFailure, ConfigurationError, ServerSelectionTimeoutError
         
@@ -280,18 +304,11 @@ if MONGO_URI and USE_MONGO:
             from mongo_users import init_mongo_connection
             users_col = init_mongo_connection(mongo_client, mongo_db)
             print("✅ mongo_users initialized successfully")
+            init_otp_tokens(mongo_db)
             
-            # Print database stats
+            # No collection listing or user counts here: every worker runs this
+            # at boot and it must not scale with the size of the database
             print(f"Using database: {mongo_db.name}")
-            collections = mongo_db.list_collection_names()
-            print(f"Collections: {collections}")
-            
-            if users_col is not None:
-                try:
-                    user_count = users_col.count_documents({})
-                    print(f"Users count: {user_count}")
-                except Exception as e:
-                    print(f"⚠️ Could not count users: {str(e)}")
             
             MONGO_AVAILABLE = True
             
@@ -330,7 +347,7 @@ EMAIL_FROM_NAME = os.getenv('EMAIL_FROM_NAME')
 # Frontend URL for email links
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:3000')
 
-# Persistent file paths (Render users can attach a Disk at /var/data or set USERS_FILE_PATH/CART_FILE_PATH)
+# Persistent file paths (Render users can attach a Disk at /var/data or set USERS_FILE_PATH/CART_DB_PATH)
 def _resolve_data_dir():
     # Determine writable directory for persistence
     preferred = os.getenv('DATA_DIR', '/var/data')
@@ -348,7 +365,12 @@ def _resolve_data_dir():
 
 DATA_DIR = _resolve_data_dir()
 USERS_FILE = os.getenv('USERS_FILE_PATH', os.path.join(DATA_DIR, 'users.json'))
-CART_FILE = os.getenv('CART_FILE_PATH', os.path.join(DATA_DIR, 'cart.json'))
+CART_DB_PATH = os.getenv('CART_DB_PATH', os.path.join(DATA_DIR, 'carts.sqlite3'))
+
+# JSON-mode users: indexed in memory, changes appended to USERS_FILE.journal
+json_user_store = JsonUserStore(
+    USERS_FILE, compact_every=int(os.getenv('USERS_JOURNAL_COMPACT_EVERY', 500))
+)
 
 # User class
 class User(UserMixin):
@@ -378,10 +400,10 @@ class User(UserMixin):
         }
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return check_password(self.password_hash, password)
 
     def generate_auth_token(self, expires_in=JWT_EXPIRATION):
         return jwt.encode(
@@ -401,64 +423,40 @@ class User(UserMixin):
 # ---------------------------------------------------------------------------
 # JSON persistence helpers
 # ---------------------------------------------------------------------------
-# Existing private helpers (_load_users_json / _save_users_json) are used by
-# the rest of the code via these thin wrappers so the earlier calls to
-# load_users()/save_users() continue to work without refactor.
+# Users are looked up one at a time through the store indexes (see load_user
+# and find_json_user); save_users() below writes to whichever store is active.
+
+def user_from_record(user_id, user_data):
+    """Build a User from a JSON store record."""
+    expiry = user_data.get('reset_token_expiry')
+    if isinstance(expiry, str):
+        expiry = datetime.fromisoformat(expiry)
+    return User(
+        id=user_id,
+        email=user_data['email'],
+        username=user_data.get('username', user_data['email'].split('@')[0]),
+        password_hash=user_data['password_hash'],
+        is_verified=user_data.get('is_verified', False),
+        otp_verified=user_data.get('otp_verified', False),
+        cart=user_data.get('cart', []),
+        reset_token=user_data.get('reset_token'),
+        reset_token_expiry=expiry,
+        company_id=user_data.get('company_id')
+    )
 
-def _load_users_json():
-    """Load users from JSON file."""
+def find_json_user(identifier, email_only=False):
+    """Look up a JSON-mode user by email (or username) via the store indexes."""
+    if email_only:
+        found = json_user_store.find_by_email(identifier)
+    else:
+        found = json_user_store.find_by_identifier(identifier)
+    if not found:
+        return None
     try:
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(USERS_FILE), exist_ok=True)
-        
-        # Try to read the file
-        try:
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                content = f.read()
-                if not content.strip():
-                    content = '{}'
-                users_data = json.loads(content)
-        except (FileNotFoundError, json.JSONDecodeError):
-            # If file doesn't exist or is invalid JSON, create a new empty file
-            with open(USERS_FILE, 'w', encoding='utf-8') as f:
-                f.write('{}')
-            users_data = {}
-            
-        users = {}
-        for user_id, user_data in users_data.items():
-            try:
-                # Ensure all required fields exist
-                if not all(key in user_data for key in ['email', 'username', 'password_hash']):
-                    print(f"Skipping invalid user data: missing required fields")
-                    continue
-                
-                users[user_id] = User(
-                    id=user_id,
-                    email=user_data['email'],
-                    username=user_data['username'],
-                    password_hash=user_data['password_hash'],
-                    is_verified=user_data.get('is_verified', False),
-                    otp_verified=user_data.get('otp_verified', False),
-                    cart=user_data.get('cart', []),
-                    reset_token=user_data.get('reset_token'),
-                    reset_token_expiry=datetime.fromisoformat(user_data.get('reset_token_expiry')) if user_data.get('reset_token_expiry') else None,
-                    company_id=user_data.get('company_id')
-                )
-            except Exception as e:
-                print(f"Error loading user {user_id}: {e}")
-                continue
-        return users
-    except Exception as e:
-        print(f"Error loading users: {e}")
-        try:
-            # Create a fresh empty file with proper encoding
-            os.makedirs(os.path.dirname(USERS_FILE), exist_ok=True)
-            with open(USERS_FILE, 'w', encoding='utf-8') as f:
-                f.write('{}')
-            return {}  # Return empty dict after creating new file
-        except Exception as e:
-            print(f"Error creating users file: {e}")
-        return {}
+        return user_from_record(*found)
+    except (KeyError, ValueError) as e:
+        print(f"Error loading user {found[0]}: {e}")
+        return None
 
 # ... (rest of the code remains the same)
 
@@ -489,110 +487,39 @@ def load_user(user_id):
             return None
     
     # Fall back to JSON users
-    users = _load_users_json()
-    user_data = users.get(user_id) if hasattr(users, 'get') else None
+    user_data = json_user_store.get(user_id)
     if user_data:
-        return User(
-            id=user_id,
-            email=user_data['email'],
-            username=user_data.get('username', user_data['email'].split('@')[0]),
-            password_hash=user_data['password_hash'],
-            is_verified=user_data.get('is_verified', False),
-            otp_verified=user_data.get('otp_verified', False),
-            cart=user_data.get('cart', []),
-            reset_token=user_data.get('reset_token'),
-            reset_token_expiry=user_data.get('reset_token_expiry'),
-            company_id=user_data.get('company_id')
-        )
+        return user_from_record(str(user_id), user_data)
     return None
 
-def save_users(users_dict=None):
-    """Legacy wrapper around _save_users_json."""
+def save_users(users_dict):
+    """Save the given users ({id: User or record}) to MongoDB or the JSON store."""
+    if USE_MONGO:
+        return _save_users_mongo(users_dict)
     return _save_users_json(users_dict)
 
-def _save_users_json(users_dict=None):
-    """Save users to JSON file. If no argument is provided, saves the global users dictionary."""
+def _save_users_json(users_dict):
+    """Save the given users ({id: User or record}) to the JSON store.
+
+    Only users whose record changed are written, as journal appends.
+    """
     try:
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(USERS_FILE), exist_ok=True)
-        
-        # Get the users data to save
-        if users_dict is None:
-            users_dict = users
-            
-        # Create a temporary file
-        temp_file = USERS_FILE + '.tmp'
-        
-        # Convert users to dictionary format
-        user_data = {user_id: user.to_dict() for user_id, user in users_dict.items()}
-        
-        # Write to temporary file
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            json.dump(user_data, f, indent=2)
-        
-        # Replace original file with temporary file atomically
-        try:
-            os.replace(temp_file, USERS_FILE)
-        except FileNotFoundError:
-            # If file doesn't exist, just rename the temp file
-            os.rename(temp_file, USERS_FILE)
-        
-        # Verify the file was saved correctly
-        try:
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                saved_data = json.load(f)
-                if len(saved_data) != len(user_data):
-                    raise Exception("File save verification failed")
-        except Exception as e:
-            print(f"Error verifying saved file: {e}")
-            return False
-        
+        for user_id, user in users_dict.items():
+            json_user_store.put(user_id, user.to_dict() if isinstance(user, User) else user)
         return True
     except Exception as e:
         print(f"Error saving users: {e}")
-        try:
-            # Clean up temp file if it exists
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
-        except Exception as cleanup_error:
-            print(f"Error cleaning up temp file: {cleanup_error}")
         return False
 
-# ----- Mongo wrappers overriding JSON if USE_MONGO -----
-if USE_MONGO:
-    def load_users():
-        users_local = {}
-        try:
-            for doc in users_col.find():
-                users_local[doc['_id']] = User(
-                    id=doc['_id'],
-                    email=doc.get('email'),
-                    username=doc.get('username'),
-                    password_hash=doc.get('password_hash'),
-                    is_verified=doc.get('is_verified', False),
-                    otp_verified=doc.get('otp_verified', False)
-                )
-        except Exception as e:
-            print(f"Error loading users from MongoDB: {e}")
-        return users_local
-
-    def save_users(users_dict=None):
-        try:
-            if users_dict is None:
-                users_dict = users
-            for uid, user in users_dict.items():
-                users_col.update_one({'_id': uid}, {'$set': user.to_dict()}, upsert=True)
-            return True
-        except Exception as e:
-            print(f"Error saving users to MongoDB: {e}")
-            return False
-
-    users = load_users() # Initialize users from MongoDB
-else:
-    # Fallback to JSON versions defined above
-    load_users = _load_users_json
-    save_users = _save_users_json
-    users = load_users() # Initialize users from JSON
+def _save_users_mongo(users_dict):
+    try:
+        for uid, user in users_dict.items():
+            users_col.update_one({'_id': uid}, {'$set': user.to_dict()}, upsert=True)
+            invalidate_cached_user(uid)
+        return True
+    except Exception as e:
+        print(f"Error saving users to MongoDB: {e}")
+        return False
 
 # Add logging for debugging
 
@@ -666,13 +593,70 @@ app.logger.info("Flask app initialized")
 
 # Initialize cart store
 # -------------------- Cart storage abstractions --------------------
+# Number of times a cart write is retried when another request changed the
+# cart (or the same line) between our read and our write
+CART_LINE_RETRIES = 3
+
+
+class CartVersionConflict(Exception):
+    """A conditional cart write found the cart (or the line it edits) changed since it was read."""
+
+
+def _with_version(doc):
+    """Running totals from a cart document, tagged with the document's version."""
+    if doc is None or doc.get('totals') is None:
+        return None
+    aggregates = dict(doc['totals'])
+    aggregates['version'] = doc.get('version', 0)
+    return aggregates
+
+
 class MongoCartStore:
-    """MongoDB-backed cart store with one cart document per user."""
+    """MongoDB-backed cart store with one cart document per user.
+
+    Every write increments the document's ``version``; the aggregates returned
+    by reads and writes carry it so clients can make conditional writes.
+
+    Reads go through an optional :class:`TTLCache` holding each user's products
+    and running totals.  Every write through this class refreshes or drops the
+    cached entry, so within one process a user always reads their own writes;
+    other worker processes see them within the cache TTL.
+    """
 
-    def __init__(self, db):
+    def __init__(self, db, cache=None):
         self.col = db.get_collection('carts')
+        self.cache = cache
+        try:
+            self.col.create_index([("user_id", 1), ("products.fingerprint", 1)], name="user_line_fingerprint")
+        except Exception as e:
+            app.logger.warning("[DEBUG] Could not create cart fingerprint index: %s", e)
         app.logger.info("[DEBUG] Initialized MongoCartStore with collection: %s", self.col.name)
 
+    # -- Read-through cache --------------------------------------------------
+
+    def _remember(self, user_id, products, aggregates):
+        if self.cache is None:
+            return
+        self.cache.set(('totals', user_id), copy.deepcopy(aggregates))
+        if products is None:
+            self.cache.invalidate(('products', user_id))
+        else:
+            self.cache.set(('products', user_id), copy.deepcopy(products))
+
+    def _refresh(self, user_id, aggregates, change):
+        """Write-through after a per-line write: apply ``change`` to the cached products."""
+        if self.cache is None:
+            return
+        products = self.cache.peek(('products', user_id))
+        if products is not None:
+            products = change(copy.deepcopy(products))
+        self._remember(user_id, products, aggregates)
+
+    def forget(self, user_id):
+        if self.cache is not None:
+            self.cache.invalidate(('products', user_id))
+            self.cache.invalidate(('totals', user_id))
+
     def _doc(self, user_id):
         doc = self.col.find_one({"user_id": user_id})
         app.logger.debug(
@@ -695,7 +679,76 @@ class MongoCartStore:
             app.logger.debug("[DEBUG] Sample product data: %s", str(products[0])[:200])
         return products
 
-    def save_cart(self, user_id, products):
+    def get_cart_with_totals(self, user_id):
+        """Return ``(products, aggregates)`` for a user's cart.
+
+        Carts written before running totals existed are priced and have their
+        aggregates backfilled once here.
+        """
+        if self.cache is not None:
+            products = self.cache.get(('products', user_id))
+            aggregates = self.cache.peek(('totals', user_id))
+            if products is not None and aggregates is not None:
+                return copy.deepcopy(products), copy.deepcopy(aggregates)
+
+        for _ in range(CART_LINE_RETRIES):
+            doc = self._doc(user_id)
+            products = doc.get('products', [])
+            aggregates = _with_version(doc)
+            stale = [p for p in products if needs_pricing(p)]
+            unmarked = [p for p in products if 'fingerprint' not in p]
+            if not (stale or unmarked or (aggregates is None and products)):
+                break
+            for product in unmarked:
+                product['fingerprint'] = line_fingerprint(product)
+            apply_pricing(stale)
+            totals = aggregate_lines(products)
+            version = doc.get('version') or 0
+            # Only if nothing was written since the read; otherwise read again
+            result = self.col.update_one(
+                {"user_id": user_id, "version": {"$in": [0, None]} if version == 0 else version},
+                {"$set": {"products": products, "totals": totals}, "$inc": {"version": 1}}
+            )
+            if result.matched_count:
+                aggregates = _with_version({"totals": totals, "version": version + 1})
+                app.logger.info("[DEBUG] Backfilled cart totals for user %s", user_id)
+                break
+        else:
+            # Kept losing to concurrent writes; serve what was read without caching it
+            return products, aggregates
+        if aggregates is None:
+            # No cart yet (or an empty legacy one): cache zero totals rather
+            # than None, which the cache cannot tell apart from a miss
+            aggregates = {**empty_aggregates(), 'version': doc.get('version') or 0}
+        self._remember(user_id, products, aggregates)
+        return products, aggregates
+
+    def get_totals(self, user_id):
+        """Return the running aggregates without loading the products."""
+        if self.cache is not None:
+            aggregates = self.cache.get(('totals', user_id))
+            if aggregates is not None:
+                return copy.deepcopy(aggregates)
+        doc = self.col.find_one({"user_id": user_id}, {"totals": 1, "version": 1, "_id": 0})
+        if doc is None or 'totals' not in doc:
+            # No cart, or one saved before running totals existed; this also
+            # caches the totals (zero for a missing cart)
+            return self.get_cart_with_totals(user_id)[1]
+        aggregates = _with_version(doc)
+        if self.cache is not None:
+            self.cache.set(('totals', user_id), copy.deepcopy(aggregates))
+        return aggregates
+
+    def get_line_count(self, user_id):
+        aggregates = self.get_totals(user_id)
+        return (aggregates or {}).get('line_count', 0)
+
+    def save_cart(self, user_id, products, expected_version=None):
+        """Persist the products array and rebuild the running totals from it.
+
+        Returns the new aggregates, or None if ``expected_version`` is given
+        and the cart has moved on since.
+        """
         app.logger.debug(
             "[DEBUG] save_cart(user_id=%s) - Saving %d products",
             user_id,
@@ -703,82 +756,214 @@ class MongoCartStore:
         )
         if products:
             app.logger.debug("[DEBUG] Sample product being saved: %s", str(products[0])[:200])
-            
-        result = self.col.update_one(
-            {"user_id": user_id},
-            {
-                "$set": {
-                    "products": products,
-                    "updated_at": datetime.utcnow(),
-                    "user_id": user_id  # Ensure user_id is set
-                }
+
+        update = {
+            "$set": {
+                "products": products,
+                "updated_at": datetime.utcnow(),
+                "user_id": user_id,  # Ensure user_id is set
+                "totals": aggregate_lines(products)
             },
-            upsert=True
-        )
-        app.logger.debug(
-            "[DEBUG] Cart save result - Matched: %d, Modified: %d, Upserted ID: %s",
-            result.matched_count,
-            result.modified_count,
-            getattr(result, 'upserted_id', 'N/A')
+            "$inc": {"version": 1}
+        }
+
+        if expected_version is not None:
+            aggregates = self._save_if_version(user_id, update, expected_version)
+            if aggregates is None:
+                self.forget(user_id)
+                return None
+        else:
+            doc = self.col.find_one_and_update(
+                {"user_id": user_id},
+                update,
+                projection={"totals": 1, "version": 1, "_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            aggregates = _with_version(doc)
+        self._remember(user_id, products, aggregates)
+        return aggregates
+
+    def _save_if_version(self, user_id, update, expected_version):
+        # The bumped version no longer matches the filter, so take the
+        # pre-image and derive the new version from it
+        query = {"user_id": user_id, "version": {"$in": [0, None]} if expected_version == 0 else expected_version}
+        doc = self.col.find_one_and_update(
+            query,
+            update,
+            projection={"totals": 1, "version": 1, "_id": 0},
+            return_document=ReturnDocument.BEFORE
         )
-        return True
+        if doc is None:
+            if expected_version != 0 or self.col.count_documents({"user_id": user_id}, limit=1):
+                return None
+            # First write to a cart that does not exist yet
+            doc = {"version": 0}
+            self.col.update_one({"user_id": user_id}, update, upsert=True)
+        aggregates = dict(update["$set"]["totals"])
+        aggregates['version'] = doc.get('version', 0) + 1
+        return aggregates
 
     def clear_cart(self, user_id):
         app.logger.info("[DEBUG] Clearing cart for user: %s", user_id)
         return self.save_cart(user_id, [])
 
+    # -- Per-line operations -------------------------------------------------
+    # Each write below is a single find_one_and_update that touches one array
+    # element and adjusts the running totals in the same statement.  Writes
+    # that replace or remove a line match on the line exactly as the caller
+    # read it, so a concurrent change from another tab makes them return None
+    # instead of silently overwriting it.
+
+    def _line_filter(self, user_id, line, expected_version=None):
+        query = {
+            "user_id": user_id,
+            "totals": {"$exists": True},
+            "products": {"$elemMatch": {"id": line.get('id'), "calculations": line.get('calculations')}}
+        }
+        if expected_version is not None:
+            # Carts written before versioning count as version 0
+            query["version"] = {"$in": [0, None]} if expected_version == 0 else expected_version
+        return query
+
+    def _update_totals(self, query, update, upsert=False):
+        doc = self.col.find_one_and_update(
+            query,
+            update,
+            projection={"totals": 1, "version": 1, "_id": 0},
+            upsert=upsert,
+            return_document=ReturnDocument.AFTER
+        )
+        return _with_version(doc)
+
+    def find_duplicate(self, user_id, fingerprint):
+        """Index of the first line with ``fingerprint``, or -1 if there is none."""
+        if fingerprint is None:
+            return -1
+        products = self.cache.peek(('products', user_id)) if self.cache is not None else None
+        if products is None:
+            doc = self.col.find_one(
+                {"user_id": user_id, "$or": [
+                    {"products.fingerprint": fingerprint},
+                    {"products": {"$elemMatch": {"fingerprint": {"$exists": False}}}}
+                ]},
+                {"products.fingerprint": 1, "_id": 0}
+            )
+            if doc is None:
+                return -1
+            products = doc.get('products', [])
+            if any('fingerprint' not in p for p in products):
+                # Older cart: stamp fingerprints on it first
+                products = self.get_cart_with_totals(user_id)[0]
+        for idx, product in enumerate(products):
+            if product.get('fingerprint') == fingerprint:
+                return idx
+        return -1
+
+    def get_line(self, user_id, item_id):
+        """Return one priced cart line by ``id``, or None if it is not in the cart."""
+        query = {"user_id": user_id, "products.id": item_id}
+        projection = {"products": {"$elemMatch": {"id": item_id}}, "totals.line_count": 1, "_id": 0}
+        doc = self.col.find_one(query, projection)
+        if doc is None:
+            return None
+        line = (doc.get('products') or [None])[0]
+        if 'totals' not in doc or needs_pricing(line) or 'fingerprint' not in line:
+            # Older cart: backfill it once, then read the line again
+            self.get_cart_with_totals(user_id)
+            doc = self.col.find_one(query, projection) or {}
+            line = (doc.get('products') or [None])[0]
+        return line
+
+    def add_line(self, user_id, product):
+        """Append a priced line; returns the new aggregates."""
+        update = {
+            "$push": {"products": product},
+            "$inc": {**aggregates_delta(added=[product]), "version": 1},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
+        aggregates = self._update_totals({"user_id": user_id, "totals": {"$exists": True}}, update)
+        if aggregates is None:
+            # New cart, or one saved before running totals existed
+            self.get_cart_with_totals(user_id)
+            aggregates = self._update_totals({"user_id": user_id}, update, upsert=True)
+        self._refresh(user_id, aggregates, lambda products: products + [copy.deepcopy(product)])
+        return aggregates
+
+    def _update_line(self, user_id, line, update, delta, expected_version=None):
+        # The rewritten line no longer matches the filter, so take the
+        # pre-image and apply the same increments to it
+        update["$inc"] = {**delta, "version": 1}
+        update.setdefault("$set", {})["updated_at"] = datetime.utcnow()
+        doc = self.col.find_one_and_update(
+            self._line_filter(user_id, line, expected_version),
+            update,
+            projection={"totals": 1, "version": 1, "_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        if doc is None:
+            return None
+        aggregates = apply_delta(_with_version(doc), delta)
+        aggregates['version'] += 1
+        return aggregates
+
+    def remove_line(self, user_id, line, expected_version=None):
+        """Pull ``line`` from the cart; returns the new aggregates or None if it changed."""
+        aggregates = self._update_line(
+            user_id, line,
+            {"$pull": {"products": {"id": line.get('id')}}},
+            aggregates_delta(removed=[line]),
+            expected_version
+        )
+        if aggregates is None:
+            self.forget(user_id)
+        else:
+            self._refresh(user_id, aggregates,
+                          lambda products: [p for p in products if p.get('id') != line.get('id')])
+        return aggregates
+
+    def replace_line(self, user_id, previous, line, expected_version=None):
+        """Swap ``previous`` for the repriced ``line``; returns aggregates or None if it changed.
+
+        With ``expected_version`` the write also requires the cart to still be
+        at that version.
+        """
+        aggregates = self._update_line(
+            user_id, previous,
+            {"$set": {"products.$": line}},
+            aggregates_delta([previous], [line]),
+            expected_version
+        )
+        if aggregates is None:
+            self.forget(user_id)
+        else:
+            self._refresh(user_id, aggregates,
+                          lambda products: [copy.deepcopy(line) if p.get('id') == line.get('id') else p
+                                            for p in products])
+        return aggregates
 
-# Fallback JSON/in-memory version ----------------------------------
-class CartStore:
-    _instance = None
-    
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance.cart = cls._load_cart()
-        return cls._instance
-    
-    @staticmethod
-    def _load_cart():
-        try:
-            if os.path.exists(CART_FILE):
-                with open(CART_FILE, 'r') as f:
-                    return json.load(f)
-            return {"products": []}
-        except Exception as e:
-            print(f"Error loading cart: {e}")
-            return {"products": []}
-    
-    @staticmethod
-    def _save_cart(cart):
-        try:
-            os.makedirs(os.path.dirname(CART_FILE), exist_ok=True)
-            with open(CART_FILE, 'w') as f:
-                json.dump(cart, f, indent=2)
-            return True
-        except Exception as e:
-            print(f"Error saving cart: {e}")
-            return False
-    
-    def get_cart(self):
-        return self.cart
-    
-    def save_cart(self, cart):
-        self.cart = cart
-        return self._save_cart(cart)
 
 # Choose the appropriate cart store implementation
 if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None:
     print("Using MongoCartStore for cart persistence")
-    cart_store = MongoCartStore(mongo_db)
+    cart_cache = register_cache(TTLCache(
+        maxsize=int(os.getenv('CART_CACHE_SIZE', 2048)),
+        ttl=float(os.getenv('CART_CACHE_TTL', 30)),
+        name='carts'
+    ))
+    cart_store = MongoCartStore(mongo_db, cache=cart_cache)
 else:
-    print("Using local JSON CartStore for cart persistence")
-    cart_store = CartStore()
+    print(f"Using SQLite cart store at {CART_DB_PATH}")
+    try:
+        cart_store = SqliteCartStore(CART_DB_PATH)
+    except Exception as e:
+        print(f"Could not open SQLite cart store: {e}")
+        cart_store = None
 
 # -------------------- Cart helper wrappers --------------------
 
 def get_user_cart():
-    """Return a dict with a products list for the current user using MongoDB."""
+    """Return a dict with a products list for the current user from the cart store."""
     try:
         app.logger.info(f"[DEBUG] get_user_cart() called for user: {getattr(current_user, 'id', 'no-user')}")
         
@@ -786,70 +971,28 @@ def get_user_cart():
             app.logger.warning("[DEBUG] No current_user.id, returning empty cart")
             return {"products": []}
             
-        if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None:
-            app.logger.info("[DEBUG] Using MongoDB for cart storage")
-            app.logger.info(f"[DEBUG] MongoDB status - MONGO_AVAILABLE: {MONGO_AVAILABLE}, USE_MONGO: {USE_MONGO}, mongo_db: {'available' if mongo_db is not None else 'None'}")
+        if cart_store is not None:
+            app.logger.info(f"[DEBUG] Using {type(cart_store).__name__} for cart storage")
             
             try:
-                products = cart_store.get_cart(current_user.id)
-                app.logger.info(f"[DEBUG] Retrieved {len(products) if products else 0} products from MongoDB")
+                products, aggregates = cart_store.get_cart_with_totals(current_user.id)
+                app.logger.info(f"[DEBUG] Retrieved {len(products) if products else 0} products from the cart store")
                 if products:
-                    app.logger.debug(f"[DEBUG] Sample product from MongoDB: {str(products[0])[:200]}...")
+                    app.logger.debug(f"[DEBUG] Sample product from the cart store: {str(products[0])[:200]}...")
             except Exception as e:
-                app.logger.error(f"[DEBUG] Error fetching cart from MongoDB: {str(e)}")
-                products = []
-            # Ensure all products have the correct structure
-            for product in products:
-                if 'calculations' not in product:
-                    # If calculations are missing, recalculate them
-                    if product.get('type') == 'blanket':
-                        base_price = float(product.get('base_price', 0))
-                        bar_price = float(product.get('bar_price', 0))
-                        quantity = int(product.get('quantity', 1))
-                        discount_percent = float(product.get('discount_percent', 0))
-                        gst_percent = float(product.get('gst_percent', 18))
-                        
-                        price_per_unit = base_price + bar_price
-                        subtotal = price_per_unit * quantity
-                        discount_amount = subtotal * (discount_percent / 100)
-                        discounted_subtotal = subtotal - discount_amount
-                        gst_amount = (discounted_subtotal * gst_percent) / 100
-                        final_total = discounted_subtotal + gst_amount
-                        
-                        product['calculations'] = {
-                            'price_per_unit': round(price_per_unit, 2),
-                            'subtotal': round(subtotal, 2),
-                            'discount_amount': round(discount_amount, 2),
-                            'discounted_subtotal': round(discounted_subtotal, 2),
-                            'gst_amount': round(gst_amount, 2),
-                            'final_total': round(final_total, 2)
-                        }
-                    elif product.get('type') == 'mpack':
-                        price = float(product.get('unit_price', 0))
-                        quantity = int(product.get('quantity', 1))
-                        discount_percent = float(product.get('discount_percent', 0))
-                        gst_percent = float(product.get('gst_percent', 12))
-                        
-                        discount_amount = (price * discount_percent / 100)
-                        price_after_discount = price - discount_amount
-                        gst_amount = (price_after_discount * gst_percent / 100)
-                        final_unit_price = price_after_discount + gst_amount
-                        final_total = final_unit_price * quantity
-                        
-                        product['calculations'] = {
-                            'unit_price': round(price, 2),
-                            'discount_amount': round(discount_amount, 2),
-                            'price_after_discount': round(price_after_discount, 2),
-                            'gst_amount': round(gst_amount, 2),
-                            'final_unit_price': round(final_unit_price, 2),
-                            'final_total': round(final_total, 2)
-                        }
-            
-            return {"products": products or []}
+                app.logger.error(f"[DEBUG] Error fetching cart from the cart store: {str(e)}")
+                products, aggregates = [], None
+            # Totals are maintained on write; reads only format them
+            summary = summary_from_aggregates(aggregates)
+            return {
+                "products": products or [],
+                "totals": summary['totals'],
+                "gst_breakdown": summary['gst_breakdown'],
+                "version": (aggregates or {}).get('version', 0)
+            }
             
-        # If we get here, MongoDB is not available
-        app.logger.warning("[DEBUG] MongoDB is not available for cart storage")
-        app.logger.warning(f"[DEBUG] MONGO_AVAILABLE: {MONGO_AVAILABLE}, USE_MONGO: {USE_MONGO}, mongo_db: {'available' if 'mongo_db' in globals() and mongo_db is not None else 'None'}")
+        # If we get here, no cart store could be opened
+        app.logger.warning("[DEBUG] No cart store is available")
         return {"products": []}
         
     except Exception as e:
@@ -858,79 +1001,166 @@ def get_user_cart():
         traceback.print_exc()
         return {"products": []}
 
-def save_user_cart(cart_dict):
-    """Persist cart for current user using MongoDB."""
+def cart_lines_enabled():
+    return cart_store is not None
+
+
+def requested_cart_version(data):
+    """The cart ``version`` a client says it last read, or None if it sent none."""
     try:
-        if not hasattr(current_user, 'id'):
-            print("Cannot save cart: No user ID available")
-            return
-            
-        if not isinstance(cart_dict, dict) or 'products' not in cart_dict:
-            print("Invalid cart format")
-            return
-            
-        if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None:
-            cart_store.save_cart(current_user.id, cart_dict['products'])
-        else:
-            print("MongoDB is not available for cart storage")
-            
-    except Exception as e:
-        print(f"Error in save_user_cart: {e}")
-        import traceback
-        traceback.print_exc()
+        return int(data['version']) if data.get('version') not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def cart_conflict_response():
+    """409 carrying the current cart so the client can re-render and retry."""
+    return jsonify({
+        'success': False,
+        'conflict': True,
+        'message': 'Your cart was changed in another window. It has been refreshed; please try again.',
+        'cart': get_user_cart()
+    }), 409
+
+
+def cart_etag(state):
+    """ETag for a cart read: the cart version, scoped to the current user.
+
+    ``state`` is anything carrying the cart ``version`` (stored aggregates or
+    the dict returned by get_user_cart).
+    """
+    user_key = hashlib.sha1(str(current_user.id).encode('utf-8')).hexdigest()[:12]
+    return f"cart-{user_key}-{(state or {}).get('version', 0)}"
+
+
+def cart_not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cart_line_count():
+    """Number of lines in the current user's cart, read from the running totals."""
+    if not cart_lines_enabled():
+        return 0
+    return cart_store.get_line_count(current_user.id)
+
+
+def add_cart_line(product):
+    """Append a priced line to the current user's cart; returns the aggregates."""
+    if not cart_lines_enabled():
+        print("No cart store is available")
+        return None
+    product['fingerprint'] = line_fingerprint(product)
+    return cart_store.add_line(current_user.id, product)
 
-# Initialize users dictionary (only for JSON fallback)
-if USE_MONGO:
-    users = {}
-else:
-    # Removed this line - it's causing the error
-    # users = load_users()
-    pass
+
+def find_duplicate_line(product):
+    """Index of an existing cart line identical to ``product``, or -1."""
+    if not cart_lines_enabled():
+        return -1
+    return cart_store.find_duplicate(current_user.id, line_fingerprint(product))
+
+
+def update_cart_line(item_id, mutate, expected_version=None):
+    """Apply ``mutate`` to one cart line, reprice it and write it back.
+
+    Returns ``(line, aggregates)``, or ``(None, None)`` if the line is not in
+    the cart.  The write only succeeds if the line is unchanged since it was
+    read here and, when the client sent the ``expected_version`` it edited
+    against, if the cart is still at that version; otherwise
+    :class:`CartVersionConflict` is raised so a stale tab cannot overwrite
+    newer edits.  Without a version the edit is retried against the fresh
+    line (last writer wins).
+    """
+    if not cart_lines_enabled():
+        return None, None
+    for _ in range(CART_LINE_RETRIES):
+        previous = cart_store.get_line(current_user.id, item_id)
+        if previous is None:
+            return None, None
+        line = copy.deepcopy(previous)
+        mutate(line)
+        line['fingerprint'] = line_fingerprint(line)
+        apply_pricing([line])
+        aggregates = cart_store.replace_line(current_user.id, previous, line, expected_version)
+        if aggregates is not None:
+            return line, aggregates
+        if expected_version is not None:
+            raise CartVersionConflict(item_id)
+    raise RuntimeError(f'Cart line {item_id} kept changing while it was being updated')
+
+
+def remove_cart_line(item_id, expected_version=None):
+    """Remove one line from the cart; returns the aggregates or None if it is missing.
+
+    Raises :class:`CartVersionConflict` if ``expected_version`` is stale.
+    """
+    if not cart_lines_enabled():
+        return None
+    for _ in range(CART_LINE_RETRIES):
+        line = cart_store.get_line(current_user.id, item_id)
+        if line is None:
+            return None
+        aggregates = cart_store.remove_line(current_user.id, line, expected_version)
+        if aggregates is not None:
+            return aggregates
+        if expected_version is not None:
+            raise CartVersionConflict(item_id)
+    raise RuntimeError(f'Cart line {item_id} kept changing while it was being removed')
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Session users by id, so authenticated requests don't hit the users collection
+user_cache = register_cache(TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', 4096)),
+    ttl=float(os.getenv('USER_CACHE_TTL', 300)),
+    name='users'
+))
+
+
+def invalidate_cached_user(user_id):
+    """Drop a user from the loader cache after their document changes."""
+    if user_id is not None:
+        user_cache.invalidate(str(user_id))
+
+
+if MONGO_AVAILABLE:
+    mu_on_user_changed(invalidate_cached_user)
+
 @login_manager.user_loader
 def load_user(user_id):
     if MONGO_AVAILABLE and USE_MONGO:
         try:
-            print(f'Loading user from MongoDB with ID: {user_id}')
-            doc = mu_find_user_by_id(user_id)
-            if not doc:
-                print(f'User not found in MongoDB with ID: {user_id}')
-                return None
-                
-            user = User(
-                id=str(doc['_id']),  # Convert ObjectId to string
+            doc = user_cache.get(str(user_id))
+            if doc is None:
+                doc = mu_find_session_user(user_id)
+                if not doc:
+                    app.logger.info(f'User not found in MongoDB with ID: {user_id}')
+                    return None
+                # Only cache under the canonical id so invalidation by _id reaches it
+                if doc['_id'] == str(user_id):
+                    user_cache.set(doc['_id'], doc)
+
+            return User(
+                id=doc['_id'],
                 email=doc['email'],
                 username=doc['username'],
-                password_hash=doc['password_hash'],
+                password_hash=None,
                 is_verified=doc.get('is_verified', False),
                 otp_verified=doc.get('otp_verified', False),
                 company_id=doc.get('company_id')
             )
-            print(f'Successfully loaded user: {user.email} (ID: {user.id})')
-            return user
         except Exception as e:
             print(f"Error loading user {user_id}: {e}")
             return None
     else:
-        print('MongoDB not available, falling back to JSON users')
-        user_data = users.get(user_id) if hasattr(users, 'get') else None
+        user_data = json_user_store.get(user_id)
         if user_data:
-            return User(
-                id=user_id,
-                email=user_data['email'],
-                username=user_data.get('username', user_data['email'].split('@')[0]),
-                password_hash=user_data['password_hash'],
-                is_verified=user_data.get('is_verified', False),
-                otp_verified=user_data.get('otp_verified', False),
-                cart=user_data.get('cart', []),
-                reset_token=user_data.get('reset_token'),
-                reset_token_expiry=user_data.get('reset_token_expiry'),
-                company_id=user_data.get('company_id')
-            )
+            return user_from_record(str(user_id), user_data)
         return None
 
 @app.route('/cart')
@@ -950,31 +1180,12 @@ def cart():
         # Ensure products list exists
         cart_data.setdefault("products", [])
         
-        # Calculate cart totals using the actual total field from each product
-        total = 0
+        # Totals were computed by the pricing engine in get_user_cart()
         if cart_data.get('products'):
-            total = sum(
-                float(p.get('calculations', {}).get('final_total', 0))
-                for p in cart_data['products']
-            )
-            
-            # If no calculations exist, fall back to total field
-            if not total:
-                total = sum(
-                    float(p.get('total', 0))
-                    for p in cart_data['products']
-                )
-            
-            # Calculate discount amount if needed
-            discount_amount = sum(
-                float(p.get('calculations', {}).get('discount_amount', 0))
-                for p in cart_data['products']
-            )
-            
-            # Add calculated totals to the cart data
+            totals = cart_data.get('totals', {})
             cart_data['calculations'] = {
-                'discount_amount': round(discount_amount, 2),
-                'total': round(total, 2)
+                'discount_amount': totals.get('total_discount', 0),
+                'total': totals.get('total', 0)
             }
         
         # Get company info with proper fallbacks
@@ -985,7 +1196,7 @@ def cart():
             selected_company.get('name') or 
             session.get('company_name') or 
             (hasattr(current_user, 'company_name') and current_user.company_name) or
-            (current_user.company_id and get_company_name_by_id(current_user.company_id)) or 
+            (current_user.company_id and (get_company(current_user.company_id) or {}).get('name')) or 
             'Your Company'
         )
         
@@ -994,7 +1205,7 @@ def cart():
             selected_company.get('email') or 
             session.get('company_email') or
             (hasattr(current_user, 'company_email') and current_user.company_email) or
-            (current_user.company_id and get_company_email_by_id(current_user.company_id)) or 
+            (current_user.company_id and (get_company(current_user.company_id) or {}).get('email')) or 
             ''
         )
         
@@ -1054,14 +1265,10 @@ def clear_cart():
     try:
         if current_user.is_authenticated:
             # For logged-in users, clear the cart from the database
-            if USE_MONGO and MONGO_AVAILABLE and mongo_db is not None:
-                mongo_db.carts.update_one(
-                    {'user_id': str(current_user.id)},
-                    {'$set': {'products': []}},
-                    upsert=True
-                )
+            if cart_lines_enabled():
+                cart_store.clear_cart(current_user.id)
             else:
-                # Fallback to session for non-MongoDB
+                # Fallback to session when no cart store is available
                 session['cart'] = {'products': []}
         else:
             # For non-logged-in users, clear the session cart
@@ -1073,6 +1280,117 @@ def clear_cart():
         print(f"Error clearing cart: {e}")
         return jsonify({'error': 'Failed to clear cart', 'message': str(e)})
 
+# -------------------- Blanket price matrix --------------------
+# Built once at startup so blanket prices never need per-request JSON parsing
+
+BLANKET_CATALOG_DIR = os.path.join(app.root_path, 'static', 'products', 'blankets')
+
+try:
+    blanket_prices = BlanketPriceMatrix.from_catalog(BLANKET_CATALOG_DIR)
+    app.logger.info("Built blanket price matrix for %d products", len(blanket_prices.products))
+except Exception as e:
+    app.logger.error("Could not build blanket price matrix: %s", e)
+    blanket_prices = None
+
+# -------------------- Cart line construction --------------------
+
+BLANKET_REQUIRED_FIELDS = ['type', 'name', 'machine', 'length', 'width', 'unit', 'quantity', 'base_price', 'bar_price', 'gst_percent']
+
+def missing_line_fields(data):
+    """Return the required fields absent from an add_to_cart style line spec."""
+    if data.get('type') == 'blanket':
+        return [field for field in BLANKET_REQUIRED_FIELDS if data.get(field) is None]
+    return []
+
+# Fields that make two cart lines "the same product" for the duplicate check
+LINE_IDENTITY_FIELDS = {
+    'blanket': ('length', 'width', 'thickness', 'bar_type'),
+    'mpack': ('machine', 'thickness', 'size', 'underpacking_type'),
+}
+
+# Dimensions are compared to the nearest 0.01
+FINGERPRINT_DIMENSIONS = ('length', 'width')
+
+def line_fingerprint(line):
+    """Canonical hash of a line's identity fields, or None for untracked types."""
+    fields = LINE_IDENTITY_FIELDS.get(line.get('type'))
+    if fields is None:
+        return None
+    parts = [line.get('type')]
+    for field in fields:
+        value = line.get(field)
+        if field in FINGERPRINT_DIMENSIONS:
+            try:
+                value = f"{float(value or 0):.2f}"
+            except (TypeError, ValueError):
+                pass
+        parts.append('' if value is None else str(value))
+    return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+def build_cart_line(data):
+    """Build an (unpriced) cart line from an add_to_cart style line spec.
+
+    The caller is expected to run the result through apply_pricing().
+    """
+    if data.get('type') == 'blanket':
+        base_price = float(data.get('base_price', 0))
+        
+        # Get dimensions and other details
+        length = float(data.get('length', 0))
+        width = float(data.get('width', 0))
+        unit = data.get('unit', 'mm')
+        
+        # Convert area to square meters if needed
+        area_sq_m = length * width
+        if unit == 'mm':
+            area_sq_m = (length / 1000) * (width / 1000)
+        elif unit == 'in':
+            area_sq_m = (length * 0.0254) * (width * 0.0254)
+        
+        # Re-derive catalog prices server-side instead of trusting the client
+        bar_price = float(data.get('bar_price', 0))
+        quote = blanket_prices.quote(length, width, unit, name=data.get('name'),
+                                     bar_type=data.get('bar_type')) if blanket_prices else None
+        if quote:
+            base_price = quote['base_price']
+            if quote['bar_price'] is not None:
+                bar_price = quote['bar_price']
+        
+        return {
+            'type': 'blanket',
+            'name': data.get('name', 'Custom Blanket'),
+            'machine': data.get('machine', 'Unknown Machine'),
+            'thickness': data.get('thickness', ''),
+            'length': length,
+            'width': width,
+            'unit': unit,
+            'bar_type': data.get('bar_type', 'None'),
+            'bar_price': bar_price,
+            'quantity': int(data.get('quantity', 1)),
+            'base_price': base_price,
+            'discount_percent': float(data.get('discount_percent', 0)),
+            'gst_percent': float(data.get('gst_percent', 18)),
+            'calculations': {
+                'areaSqM': round(area_sq_m, 4),
+                'ratePerSqMt': round(base_price / area_sq_m, 2) if area_sq_m > 0 else 0
+            }
+        }
+
+    # Other product types (mpack, etc.)
+    return {
+        'type': data.get('type'),
+        'name': data.get('name'),
+        'unit_price': float(data.get('unit_price', 0)),
+        'quantity': int(data.get('quantity', 1)),
+        'discount_percent': float(data.get('discount_percent', 0)),
+        'gst_percent': float(data.get('gst_percent', 12)),  # 12% GST for MPack
+        # Include MPack specific details
+        'machine': data.get('machine', ''),
+        'thickness': data.get('thickness', ''),
+        'size': data.get('size', ''),
+        'underpacking_type': data.get('underpacking_type', '')
+    }
+
 @app.route('/add_to_cart', methods=['POST'])
 @login_required
 @company_required
@@ -1086,152 +1404,26 @@ def add_to_cart():
                 'error': 'No data provided'
             }), 400
 
-        # Validate required fields for blanket
-        required_fields = ['type', 'name', 'machine', 'length', 'width', 'unit', 'quantity', 'base_price', 'bar_price', 'gst_percent']
-        if data.get('type') == 'blanket' and not all(data.get(field) is not None for field in required_fields):
+        missing = missing_line_fields(data)
+        if missing:
             return jsonify({
                 'success': False,
-                'error': f'Missing required fields: {required_fields}'
+                'error': f'Missing required fields: {BLANKET_REQUIRED_FIELDS}'
             }), 400
 
-        # Calculate prices based on product type
-        if data.get('type') == 'blanket':
-            # Get all required fields with proper defaults
-            base_price = float(data.get('base_price', 0))
-            bar_price = float(data.get('bar_price', 0))
-            quantity = int(data.get('quantity', 1))
-            discount_percent = float(data.get('discount_percent', 0))
-            gst_percent = float(data.get('gst_percent', 18))
-            
-            # Calculate prices
-            unit_price = base_price + bar_price
-            subtotal = unit_price * quantity
-            discount_amount = subtotal * (discount_percent / 100)
-            discounted_subtotal = subtotal - discount_amount
-            gst_amount = (discounted_subtotal * gst_percent) / 100
-            final_total = discounted_subtotal + gst_amount
-            
-            # Get dimensions and other details
-            length = float(data.get('length', 0))
-            width = float(data.get('width', 0))
-            unit = data.get('unit', 'mm')
-            
-            # Convert area to square meters if needed
-            area_sq_m = length * width
-            if unit == 'mm':
-                area_sq_m = (length / 1000) * (width / 1000)
-            elif unit == 'in':
-                area_sq_m = (length * 0.0254) * (width * 0.0254)
-            
-            # Create product with all details
-            import uuid
-            product = {
-                'id': str(uuid.uuid4()),  # Add unique ID
-                'type': 'blanket',
-                'name': data.get('name', 'Custom Blanket'),
-                'machine': data.get('machine', 'Unknown Machine'),
-                'thickness': data.get('thickness', ''),
-                'length': length,
-                'width': width,
-                'unit': unit,
-                'bar_type': data.get('bar_type', 'None'),
-                'bar_price': bar_price,
-                'quantity': quantity,
-                'base_price': base_price,
-                'discount_percent': discount_percent,
-                'gst_percent': gst_percent,
-                'unit_price': round(unit_price, 2),
-                'total_price': round(final_total, 2),
-                'calculations': {
-                    'areaSqM': round(area_sq_m, 4),
-                    'ratePerSqMt': round(base_price / area_sq_m, 2) if area_sq_m > 0 else 0,
-                    'basePrice': round(base_price, 2),
-                    'pricePerUnit': round(unit_price, 2),
-                    'subtotal': round(subtotal, 2),
-                    'discount_percent': discount_percent,
-                    'discount_amount': round(discount_amount, 2),
-                    'discounted_subtotal': round(discounted_subtotal, 2),
-                    'gst_percent': gst_percent,
-                    'gst_amount': round(gst_amount, 2),
-                    'final_price': round(final_total, 2)
-                },
-                'added_at': datetime.utcnow().isoformat()
-            }
-        else:
-            # Handle other product types (mpack, etc.)
-            import uuid
-            product = {
-                'id': str(uuid.uuid4()),  # Add unique ID
-                'type': data.get('type'),
-                'name': data.get('name'),
-                'unit_price': float(data.get('unit_price', 0)),
-                'quantity': int(data.get('quantity', 1)),
-                'discount_percent': float(data.get('discount_percent', 0)),
-                'gst_percent': float(data.get('gst_percent', 12)),  # 12% GST for MPack
-                # Include MPack specific details
-                'machine': data.get('machine', ''),
-                'thickness': data.get('thickness', ''),
-                'size': data.get('size', ''),
-                'underpacking_type': data.get('underpacking_type', ''),  # Add underpacking type
-                'added_at': datetime.utcnow().isoformat()  # Add timestamp for sorting
-            }
-            
-            # Calculate prices for other product types if needed
-            if product['type'] == 'mpack':
-                price = product['unit_price']
-                quantity = product['quantity']
-                discount_percent = product['discount_percent']
-                gst_percent = product['gst_percent']
-                
-                # Calculate prices
-                discount_amount = (price * discount_percent / 100)
-                price_after_discount = price - discount_amount
-                gst_amount = (price_after_discount * gst_percent / 100)
-                final_unit_price = price_after_discount + gst_amount
-                final_total = final_unit_price * quantity
-                
-                # Set all price fields
-                product['unit_price'] = round(price, 2)
-                product['discount_amount'] = round(discount_amount, 2)
-                product['price_after_discount'] = round(price_after_discount, 2)
-                product['gst_amount'] = round(gst_amount, 2)
-                product['final_unit_price'] = round(final_unit_price, 2)
-                product['total_price'] = round(final_total, 2)
-                
-                # Store calculations
-                product['calculations'] = {
-                    'unit_price': product['unit_price'],
-                    'discount_amount': product['discount_amount'],
-                    'price_after_discount': product['price_after_discount'],
-                    'gst_amount': product['gst_amount'],
-                    'final_unit_price': product['final_unit_price'],
-                    'final_total': product['total_price'],
-                    'machine': product.get('machine', ''),
-                    'thickness': product.get('thickness', ''),
-                    'size': product.get('size', '')
-                }
+        product = build_cart_line(data)
+        product['id'] = str(uuid.uuid4())  # Add unique ID
+        product['added_at'] = datetime.utcnow().isoformat()  # Add timestamp for sorting
+        apply_pricing([product])
         
-        # Get existing cart or create new one
         try:
-            cart = get_user_cart()
-            if not isinstance(cart, dict):
-                cart = {'products': []}
-            if 'products' not in cart:
-                cart['products'] = []
-            
             # Check if this is an update to an existing item
             item_id = data.get('item_id')
             if item_id:
-                # Find and update the existing item
-                item_updated = False
-                for idx, item in enumerate(cart['products']):
-                    if str(item.get('_id', '')) == str(item_id) or str(item.get('id', '')) == str(item_id):
-                        # Update all fields from the new product data
-                        cart['products'][idx].update(product)
-                        item_updated = True
-                        break
-                
-                if not item_updated:
+                # Update all fields of the existing line from the new product data
+                fields = {k: v for k, v in product.items() if k != 'id'}
+                line, aggregates = update_cart_line(item_id, lambda item: item.update(fields))
+                if line is None:
                     return jsonify({
                         'success': False,
                         'error': 'Item not found in cart',
@@ -1240,29 +1432,7 @@ def add_to_cart():
             else:
                 # Check for duplicate products with same dimensions if force_add is not True
                 if not data.get('force_add'):
-                    duplicate_index = -1
-                    product_type = product.get('type')
-                    
-                    if product_type == 'blanket':
-                        for idx, item in enumerate(cart['products']):
-                            if (item.get('type') == 'blanket' and 
-                                abs(float(item.get('length', 0)) - float(product.get('length', 0))) < 0.01 and 
-                                abs(float(item.get('width', 0)) - float(product.get('width', 0))) < 0.01 and 
-                                item.get('thickness') == product.get('thickness') and
-                                item.get('bar_type') == product.get('bar_type')):
-                                duplicate_index = idx
-                                break
-                    
-                    # Check for duplicate MPacks with same specifications
-                    elif product_type == 'mpack':
-                        for idx, item in enumerate(cart['products']):
-                            if (item.get('type') == 'mpack' and 
-                                item.get('machine') == product.get('machine') and
-                                item.get('thickness') == product.get('thickness') and
-                                item.get('size') == product.get('size') and
-                                item.get('underpacking_type') == product.get('underpacking_type')):
-                                duplicate_index = idx
-                                break
+                    duplicate_index = find_duplicate_line(product)
                     
                     if duplicate_index >= 0:
                         # Return info about duplicate product
@@ -1274,20 +1444,17 @@ def add_to_cart():
                         })
                 
                 # If no duplicate found and not an update, add the product to cart
-                cart['products'].append(product)
-            
-            # Save updated cart
-            save_user_cart(cart)
+                aggregates = add_cart_line(product)
             
-            # Get updated cart count
-            updated_cart = get_user_cart()
-            cart_count = len(updated_cart.get('products', [])) if updated_cart and isinstance(updated_cart, dict) else 0
+            # The write returns the running totals, so no re-read is needed
+            cart_count = (aggregates or {}).get('line_count', 0)
             
             return jsonify({
                 'success': True,
                 'is_duplicate': False,
                 'message': 'Product added to cart successfully',
-                'cart_count': cart_count
+                'cart_count': cart_count,
+                'version': (aggregates or {}).get('version')
             })
         except Exception as e:
             app.logger.error(f"Error saving cart: {str(e)}")
@@ -1303,13 +1470,127 @@ def add_to_cart():
         }), 500
         return jsonify({'error': str(e), 'trace': traceback.format_exc()}), 500
 
+# Lines priced per apply_pricing() call by /api/price/batch
+PRICE_BATCH_CHUNK_SIZE = int(os.getenv('PRICE_BATCH_CHUNK_SIZE', 1000))
+
+def _decode_ndjson_line(raw):
+    try:
+        return json.loads(raw)
+    except ValueError as e:
+        return ValueError(f'Invalid JSON: {e}')
+
+def _iter_price_batch_specs():
+    """Yield line specs from a JSON array (or {"lines": [...]}) or NDJSON body.
+
+    An NDJSON line that does not decode is yielded as a ValueError so that
+    only that line fails; the lines after it are still read.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines'):
+        # Read in blocks; iterating request.stream directly reads a byte at a time
+        buffer = b''
+        while True:
+            block = request.stream.read(64 * 1024)
+            if not block:
+                break
+            buffer += block
+            *lines, buffer = buffer.split(b'\n')
+            for raw in lines:
+                if raw.strip():
+                    yield _decode_ndjson_line(raw)
+        if buffer.strip():
+            yield _decode_ndjson_line(buffer)
+        return
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('lines')
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array of line specs or NDJSON')
+    yield from data
+
+@app.route('/api/price/batch', methods=['POST'])
+@login_required
+def api_price_batch():
+    """Price many add_to_cart style line specs without touching the cart.
+
+    The response is NDJSON: one ``{"index", "line"}`` (or ``{"index", "error"}``)
+    object per input spec, followed by a ``{"summary": ...}`` object.  Lines are
+    priced in chunks of PRICE_BATCH_CHUNK_SIZE so large price lists stream back
+    without being held in memory.
+    """
+    specs = _iter_price_batch_specs()
+
+    # Surface a malformed body as a 400 before the streamed response starts
+    try:
+        first = next(specs, None)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    def generate():
+        priced = 0
+        errors = 0
+        chunk = []
+
+        def flush():
+            nonlocal priced
+            apply_pricing([line for _, line in chunk])
+            out = ''.join(
+                json.dumps({'index': index, 'line': line}) + '\n'
+                for index, line in chunk
+            )
+            priced += len(chunk)
+            chunk.clear()
+            return out
+
+        index = 0
+        pending = [] if first is None else [first]
+        while True:
+            try:
+                spec = pending.pop() if pending else next(specs)
+            except StopIteration:
+                break
+
+            try:
+                if isinstance(spec, ValueError):
+                    # NDJSON line that did not decode
+                    raise spec
+                if not isinstance(spec, dict):
+                    raise ValueError('Line spec must be an object')
+                missing = missing_line_fields(spec)
+                if missing:
+                    raise ValueError(f'Missing required fields: {missing}')
+                validate_line_numbers(spec, index)
+                chunk.append((index, build_cart_line(spec)))
+            except (TypeError, ValueError, OverflowError) as e:
+                errors += 1
+                yield json.dumps({'index': index, 'error': str(e)}) + '\n'
+            index += 1
+
+            if len(chunk) >= PRICE_BATCH_CHUNK_SIZE:
+                yield flush()
+
+        if chunk:
+            yield flush()
+        yield json.dumps({'summary': {'priced': priced, 'errors': errors}}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/get_cart')
 @login_required
 def get_cart():
     """Return the current user's cart as JSON."""
     try:
+        if cart_lines_enabled():
+            # Answer unchanged polls from the (cached) running totals alone
+            etag = cart_etag(cart_store.get_totals(current_user.id))
+            if etag in request.if_none_match:
+                return cart_not_modified(etag)
         cart = get_user_cart()
-        return jsonify(cart)
+        response = jsonify(cart)
+        if 'version' in cart:
+            response.set_etag(cart_etag(cart))
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     except Exception as e:
         print(f"Error get_cart: {e}")
         return jsonify({'error': 'Failed to get cart', 'products': []}), 500
@@ -1325,28 +1606,24 @@ def remove_from_cart():
         return jsonify({'error': 'Missing item_id'}), 400
 
     try:
-        cart = get_user_cart()
-        products = cart.get('products', [])
-        
-        # Find the item by ID
-        initial_count = len(products)
-        products = [p for p in products if p.get('id') != item_id]
-        
-        if len(products) < initial_count:
+        aggregates = remove_cart_line(item_id, requested_cart_version(data))
+        if aggregates is not None:
             # Item was found and removed
-            save_user_cart({'products': products})
             return jsonify({
                 'success': True,
-                'cart_count': len(products),
+                'cart_count': aggregates.get('line_count', 0),
+                'version': aggregates.get('version'),
                 'message': 'Item removed from cart'
             })
             
         return jsonify({
             'success': False,
             'error': 'Item not found in cart',
-            'cart_count': len(products)
+            'cart_count': cart_line_count()
         }), 404
         
+    except CartVersionConflict:
+        return cart_conflict_response()
     except Exception as e:
         app.logger.error(f'Error in remove_from_cart: {e}')
         return jsonify({
@@ -1377,83 +1654,27 @@ def update_cart_item():
             'message': 'Please provide a valid item ID'
         }), 400
     
-    # Get the current cart
-    cart = get_user_cart()
-    products = cart.get('products', [])
-    
-    # Find the item to update
-    item_index = next((i for i, item in enumerate(products) 
-                      if str(item.get('id')) == str(item_id) or 
-                         str(item.get('_id')) == str(item_id)), None)
+    def apply_form_fields(item):
+        # Update fields from the form data
+        for key in ['quantity', 'length', 'width', 'thickness', 'size', 'machine', 'bar_type', 
+                   'discount_percent', 'gst_percent', 'unit_price', 'base_price', 'bar_price', 'name', 'type']:
+            if key in data:
+                item[key] = data[key]
     
-    if item_index is None:
+    # Update and reprice just this line
+    try:
+        item, aggregates = update_cart_line(str(item_id), apply_form_fields,
+                                            requested_cart_version(data))
+    except CartVersionConflict:
+        return cart_conflict_response()
+    if item is None:
         return jsonify({
             'success': False,
             'error': 'Item not found in cart',
             'message': 'The item you are trying to update was not found in your cart'
         }), 404
     
-    # Update the item with new data
-    item = products[item_index]
-    
-    # Update fields from the form data
-    for key in ['quantity', 'length', 'width', 'thickness', 'size', 'machine', 'bar_type', 
-               'discount_percent', 'gst_percent', 'unit_price', 'base_price', 'bar_price', 'name', 'type']:
-        if key in data:
-            item[key] = data[key]
-    
-    # Recalculate any calculated fields
-    if 'quantity' in data or 'unit_price' in data or 'discount_percent' in data or 'gst_percent' in data:
-        quantity = item.get('quantity', 1)
-        discount_percent = float(item.get('discount_percent', 0))
-        gst_percent = float(item.get('gst_percent', 18))  # Default to 18% GST if not specified
-        
-        # Handle blanket vs other product types differently
-        if item.get('type') == 'blanket':
-            # For blankets: keep base_price and bar_price separate for display
-            base_price = float(item.get('base_price', 0)) or float(item.get('unit_price', 0))
-            bar_price = float(item.get('bar_price', 0))
-            
-            # Calculate unit price (base + bar)
-            unit_price = base_price + bar_price
-            
-            # Calculate subtotal (unit_price * quantity)
-            subtotal = unit_price * quantity
-            
-            # Update the stored values
-            item['base_price'] = base_price
-            item['bar_price'] = bar_price
-            item['unit_price'] = unit_price
-        else:
-            # For other products (mpack, etc.)
-            unit_price = float(item.get('unit_price', 0))
-            subtotal = unit_price * quantity
-        
-        # Calculate discount and final amounts
-        discount_amount = (subtotal * discount_percent) / 100
-        discounted_subtotal = subtotal - discount_amount
-        gst_amount = (discounted_subtotal * gst_percent) / 100
-        final_total = discounted_subtotal + gst_amount
-        
-        # Update calculations
-        item['calculations'] = {
-            'unit_price': unit_price,
-            'quantity': quantity,
-            'subtotal': subtotal,
-            'discount_percent': discount_percent,
-            'discount_amount': discount_amount,
-            'discounted_subtotal': discounted_subtotal,
-            'gst_percent': gst_percent,
-            'gst_amount': gst_amount,
-            'final_total': final_total
-        }
-        
-        # Update the item's total_price field
-        item['total_price'] = final_total
-    
-    # Save the updated cart
-    cart['products'][item_index] = item
-    save_user_cart(cart)
+    cart = get_user_cart()
     
     return jsonify({
         'success': True,
@@ -1496,68 +1717,29 @@ def update_cart_quantity():
                 'message': 'Item ID is required'
             }), 400
         
-        # Get current cart
-        cart = get_user_cart()
-        products = cart.get('products', [])
-        
-        # Find the item by ID
-        item_updated = False
-        updated_item = None
-        
-        for item in products:
-            if str(item.get('id')) == str(item_id):
-                # Update the quantity
-                item['quantity'] = quantity
-                
-                # Recalculate prices if needed (for blankets)
-                if item.get('type') == 'blanket':
-                    # Recalculate blanket prices
-                    base_price = item.get('base_price', 0)
-                    bar_price = item.get('bar_price', 0)
-                    discount_percent = item.get('discount_percent', 0)
-                    gst_percent = item.get('gst_percent', 18)
-                    
-                    # Recalculate all values
-                    price_per_unit = base_price + bar_price
-                    subtotal = price_per_unit * quantity
-                    discount_amount = subtotal * (discount_percent / 100)
-                    discounted_subtotal = subtotal - discount_amount
-                    gst_amount = (discounted_subtotal * gst_percent) / 100
-                    final_total = discounted_subtotal + gst_amount
-                    
-                    # Update all price fields
-                    item.update({
-                        'unit_price': round(price_per_unit, 2),
-                        'total_price': round(final_total, 2),
-                        'calculations': {
-                            **item.get('calculations', {}),
-                            'subtotal': round(subtotal, 2),
-                            'discount_amount': round(discount_amount, 2),
-                            'discounted_subtotal': round(discounted_subtotal, 2),
-                            'gst_amount': round(gst_amount, 2),
-                            'final_price': round(final_total, 2)
-                        }
-                    })
-                
-                updated_item = item
-                item_updated = True
-                break
+        # Update the quantity and reprice just this line
+        try:
+            updated_item, aggregates = update_cart_line(
+                str(item_id), lambda item: item.update(quantity=quantity),
+                requested_cart_version(data)
+            )
+        except CartVersionConflict:
+            return cart_conflict_response()
+        cart_count = aggregates['line_count'] if aggregates else cart_line_count()
         
-        if item_updated:
-            # Save the updated cart
-            save_user_cart({'products': products})
-            
+        if updated_item is not None:
             return jsonify({
                 'success': True,
                 'message': 'Cart quantity updated',
-                'cart_count': len(products),
+                'cart_count': cart_count,
+                'version': aggregates['version'],
                 'updated_item': updated_item
             })
         else:
             return jsonify({
                 'success': False,
                 'message': 'Item not found in cart',
-                'cart_count': len(products)
+                'cart_count': cart_count
             }), 404
     except Exception as e:
         app.logger.error(f'Error updating cart quantity: {str(e)}')
@@ -1596,91 +1778,29 @@ def update_cart_discount():
                 'message': 'Item ID is required'
             }), 400
         
-        # Get current cart
-        cart = get_user_cart()
-        products = cart.get('products', [])
-        
-        # Find the item by ID
-        item_updated = False
-        updated_item = None
-        
-        for item in products:
-            if str(item.get('id')) == str(item_id):
-                # Update the discount percentage
-                item['discount_percent'] = discount_percent
-                
-                # Recalculate prices based on product type
-                if item.get('type') == 'blanket':
-                    # Recalculate blanket prices
-                    base_price = item.get('base_price', 0)
-                    bar_price = item.get('bar_price', 0)
-                    quantity = item.get('quantity', 1)
-                    gst_percent = item.get('gst_percent', 18)
-                    
-                    price_per_unit = base_price + bar_price
-                    subtotal = price_per_unit * quantity
-                    discount_amount = subtotal * (discount_percent / 100)
-                    discounted_subtotal = subtotal - discount_amount
-                    gst_amount = (discounted_subtotal * gst_percent) / 100
-                    final_total = discounted_subtotal + gst_amount
-                    
-                    # Update all price fields
-                    item.update({
-                        'unit_price': round(price_per_unit, 2),
-                        'total_price': round(final_total, 2),
-                        'calculations': {
-                            **item.get('calculations', {}),
-                            'subtotal': round(subtotal, 2),
-                            'discount_amount': round(discount_amount, 2),
-                            'discounted_subtotal': round(discounted_subtotal, 2),
-                            'gst_amount': round(gst_amount, 2),
-                            'final_price': round(final_total, 2)
-                        }
-                    })
-                else:
-                    # For mpacks and other product types
-                    unit_price = item.get('unit_price', 0)
-                    quantity = item.get('quantity', 1)
-                    gst_percent = item.get('gst_percent', 18)
-                    
-                    subtotal = unit_price * quantity
-                    discount_amount = subtotal * (discount_percent / 100)
-                    discounted_subtotal = subtotal - discount_amount
-                    gst_amount = (discounted_subtotal * gst_percent) / 100
-                    final_total = discounted_subtotal + gst_amount
-                    
-                    # Update all price fields
-                    item.update({
-                        'total_price': round(final_total, 2),
-                        'calculations': {
-                            **item.get('calculations', {}),
-                            'subtotal': round(subtotal, 2),
-                            'discount_amount': round(discount_amount, 2),
-                            'discounted_subtotal': round(discounted_subtotal, 2),
-                            'gst_amount': round(gst_amount, 2),
-                            'final_price': round(final_total, 2)
-                        }
-                    })
-                
-                updated_item = item
-                item_updated = True
-                break
+        # Update the discount percentage and reprice just this line
+        try:
+            updated_item, aggregates = update_cart_line(
+                str(item_id), lambda item: item.update(discount_percent=discount_percent),
+                requested_cart_version(data)
+            )
+        except CartVersionConflict:
+            return cart_conflict_response()
+        cart_count = aggregates['line_count'] if aggregates else cart_line_count()
         
-        if item_updated:
-            # Save the updated cart
-            save_user_cart({'products': products})
-            
+        if updated_item is not None:
             return jsonify({
                 'success': True,
                 'message': 'Cart discount updated',
-                'cart_count': len(products),
+                'cart_count': cart_count,
+                'version': aggregates['version'],
                 'updated_item': updated_item
             })
         else:
             return jsonify({
                 'success': False,
                 'message': 'Item not found in cart',
-                'cart_count': len(products)
+                'cart_count': cart_count
             }), 404
     except Exception as e:
         app.logger.error(f'Error updating cart discount: {str(e)}')
@@ -1691,6 +1811,179 @@ def update_cart_discount():
         }), 500
 
 
+# -------------------- Batched cart mutations --------------------
+
+CART_BATCH_MAX_OPS = int(os.getenv('CART_BATCH_MAX_OPS', 500))
+
+class CartBatchError(ValueError):
+    """An operation in a /cart/batch request could not be applied."""
+
+    def __init__(self, index, message, **extra):
+        super().__init__(message)
+        self.index = index
+        self.extra = extra
+
+def _batch_number(op, index, field, cast, low, high):
+    try:
+        value = float(op[field])
+    except (KeyError, TypeError, ValueError):
+        raise CartBatchError(index, f'{field} is required and must be a number')
+    # Rejects NaN as well as out-of-range values
+    if not low <= value <= high:
+        raise CartBatchError(index, f'{field} must be between {low} and {high}')
+    if cast is int and not value.is_integer():
+        raise CartBatchError(index, f'{field} must be a whole number')
+    return cast(value)
+
+# Numeric fields shared by the add spec and the set_* ops, with their ranges
+CART_BATCH_FIELDS = {
+    'quantity': (int, 1, 10 ** 6),
+    'discount_percent': (float, 0, 100),
+    'gst_percent': (float, 0, 100),
+}
+
+def validate_line_numbers(spec, index):
+    """Range-check the CART_BATCH_FIELDS present in a line spec, in place.
+
+    Shared by /cart/batch adds and /api/price/batch so both accept the same
+    quantities and percentages; raises :class:`CartBatchError`.
+    """
+    for field, (cast, low, high) in CART_BATCH_FIELDS.items():
+        if spec.get(field) is not None:
+            spec[field] = _batch_number(spec, index, field, cast, low, high)
+
+def apply_cart_batch(products, ops):
+    """Apply ``ops`` to ``products`` in order, in memory.
+
+    Returns the list of touched lines; raises :class:`CartBatchError` on the
+    first invalid operation, leaving the caller free to discard the result.
+    """
+    by_id = {str(p.get('id')): p for p in products}
+    fingerprints = {p.get('fingerprint') for p in products}
+    touched = {}
+
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict):
+            raise CartBatchError(index, 'Each operation must be an object')
+        kind = op.get('op')
+
+        if kind == 'add':
+            spec = op.get('line')
+            if not isinstance(spec, dict):
+                raise CartBatchError(index, 'line must be an object')
+            missing = missing_line_fields(spec)
+            if missing:
+                raise CartBatchError(index, f'Missing required fields: {missing}')
+            validate_line_numbers(spec, index)
+            try:
+                line = build_cart_line(spec)
+            except (TypeError, ValueError, OverflowError) as e:
+                raise CartBatchError(index, f'Invalid line: {e}')
+            line['id'] = str(uuid.uuid4())
+            line['added_at'] = datetime.utcnow().isoformat()
+            line['fingerprint'] = line_fingerprint(line)
+            if line['fingerprint'] is not None and line['fingerprint'] in fingerprints and not op.get('force_add'):
+                raise CartBatchError(index, 'A product with the same dimensions already exists in your cart.',
+                                     is_duplicate=True)
+            products.append(line)
+            by_id[line['id']] = line
+            fingerprints.add(line['fingerprint'])
+            touched[line['id']] = line
+            continue
+
+        item_id = str(op.get('item_id') or '')
+        line = by_id.get(item_id)
+        if line is None:
+            raise CartBatchError(index, f'Item {item_id or "(none)"} not found in cart')
+
+        if kind == 'remove':
+            products.remove(line)
+            del by_id[item_id]
+            touched.pop(item_id, None)
+            fingerprints = {p.get('fingerprint') for p in products}
+            continue
+        field = {'set_qty': 'quantity', 'set_discount': 'discount_percent', 'set_gst': 'gst_percent'}.get(kind)
+        if field is None:
+            raise CartBatchError(index, f'Unknown operation: {kind!r}')
+        line[field] = _batch_number(op, index, field, *CART_BATCH_FIELDS[field])
+        touched[item_id] = line
+
+    # Reprice everything that changed in one pass
+    apply_pricing(list(touched.values()))
+    return list(touched.values())
+
+@app.route('/cart/batch', methods=['POST'])
+@login_required
+def cart_batch():
+    """Apply an ordered list of cart operations and persist them in one write.
+
+    Body: ``{"ops": [{"op": "set_qty", "item_id": ..., "quantity": 3}, ...],
+    "version": <optional cart version>}``.  Supported ops are ``add`` (with a
+    ``line`` spec as accepted by /add_to_cart), ``remove``, ``set_qty``,
+    ``set_discount`` and ``set_gst``.  Either every operation is applied or
+    none is.
+    """
+    data = request.get_json(silent=True) or {}
+    ops = data.get('ops')
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'success': False, 'error': 'ops must be a non-empty list'}), 400
+    if len(ops) > CART_BATCH_MAX_OPS:
+        return jsonify({'success': False, 'error': f'At most {CART_BATCH_MAX_OPS} operations per request'}), 400
+    if not cart_lines_enabled():
+        return jsonify({'success': False, 'error': 'Cart storage is not available'}), 503
+
+    expected_version = requested_cart_version(data)
+    try:
+        for _ in range(CART_LINE_RETRIES):
+            products, aggregates = cart_store.get_cart_with_totals(current_user.id)
+            version = (aggregates or {}).get('version', 0)
+            if expected_version is not None and version != expected_version:
+                return cart_conflict_response()
+            try:
+                touched = apply_cart_batch(products, ops)
+            except CartBatchError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e),
+                    'op_index': e.index,
+                    **e.extra
+                }), 400
+            # Conditional on the version we read; a concurrent write means the
+            # ops are replayed against the fresh cart (or 409 if the client
+            # pinned a version)
+            aggregates = cart_store.save_cart(current_user.id, products, expected_version=version)
+            if aggregates is not None:
+                break
+            if expected_version is not None:
+                return cart_conflict_response()
+        else:
+            raise RuntimeError('Cart kept changing while the batch was being applied')
+    except Exception as e:
+        app.logger.error(f'Error applying cart batch: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Failed to update cart',
+            'details': str(e)
+        }), 500
+
+    summary = summary_from_aggregates(aggregates)
+    return jsonify({
+        'success': True,
+        'cart_count': aggregates.get('line_count', 0),
+        'version': aggregates.get('version'),
+        'totals': summary['totals'],
+        'gst_breakdown': summary['gst_breakdown'],
+        'updated_items': touched
+    })
+
+
+@app.route('/api/cache/stats')
+@login_required
+def api_cache_stats():
+    """Hit/miss counters for the in-process caches, company directory, password hashing pool and coalesced loads."""
+    return jsonify({'success': True, 'caches': cache_stats(), 'company_directory': company_directory.stats(),
+                    'password_hashing': password_hash_stats(), 'single_flight': backend_loads.stats()})
+
 @app.route('/get_cart_count')
 def get_cart_count():
     """Return the number of products currently in the user's cart."""
@@ -1698,108 +1991,145 @@ def get_cart_count():
         if not current_user.is_authenticated:
             return jsonify({'count': 0})
             
+        if cart_lines_enabled():
+            aggregates = cart_store.get_totals(current_user.id) or {}
+            etag = cart_etag(aggregates)
+            if etag in request.if_none_match:
+                return cart_not_modified(etag)
+            response = jsonify({'count': aggregates.get('line_count', 0)})
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
         cart = get_user_cart()
         return jsonify({'count': len(cart.get('products', []))})
     except Exception as e:
         print(f"Error in get_cart_count: {e}")
         return jsonify({'count': 0})
 
+COMPANIES_FILE = os.path.join(app.root_path, 'static', 'data', 'companies.json')
+
+def _map_company(company):
+    """Directory entry for a company document, or None if it has no name."""
+    company_id = company.get('_id', company.get('id'))
+    if isinstance(company_id, dict):  # Extended JSON export: {"$oid": ...}
+        company_id = company_id.get('$oid')
+    name = company.get('Company Name')
+    if not name:
+        app.logger.warning(f"Skipping company with missing name: {company_id}")
+        return None
+    email = company.get('EmailID', '')
+    return {
+        'id': str(company_id),
+        'name': name,
+        # Ensure email is a string and properly formatted
+        'email': str(email).strip() if email else ''
+    }
+
 def load_companies_data():
-    """Load companies data from MongoDB or fall back to JSON file."""
-    global mongo_db, USE_MONGO
-    
-    try:
-        # Log MongoDB status
-        app.logger.info(f"Loading companies - MongoDB status: Available={MONGO_AVAILABLE}, Using={USE_MONGO}, Connected={'Yes' if mongo_db is not None else 'No'}")
-        
-        if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None:
-            try:
-                # Test the connection first
-                mongo_db.command('ping')
-                
-                # Get companies from MongoDB with only the fields we need
-                projection = {
-                    '_id': 1,
-                    'Company Name': 1,
-                    'EmailID': 1,
-                    'created_at': 1,
-                    'created_by': 1
-                }
-                
-                # Find all companies and sort by name for consistent ordering
-                companies_cursor = mongo_db.companies.find({}, projection).sort('Company Name', 1)
-                companies = list(companies_cursor)
-                
-                mapped_companies = []
-                for company in companies:
-                    try:
-                        company_id = str(company.pop('_id'))
-                        
-                        # Get company data (we only store one set of fields now)
-                        name = company.get('Company Name')
-                        email = company.get('EmailID', '')
-                        
-                        # Skip if we don't have a valid name
-                        if not name:
-                            app.logger.warning(f"Skipping company with missing name: {company_id}")
-                            continue
-                            
-                        # Ensure email is a string and properly formatted
-                        email = str(email).strip() if email else ''
-                        
-                        mapped_companies.append({
-                            'id': company_id,
-                            'name': name,
-                            'email': email,
-                            'created_at': company.get('created_at'),
-                            'created_by': company.get('created_by')
-                        })
-                        
-                    except Exception as e:
-                        app.logger.error(f"Error processing company {company.get('_id')}: {str(e)}")
-                        continue
-                        
-                app.logger.info(f"Successfully loaded {len(mapped_companies)} companies from MongoDB")
-                return mapped_companies
-                
-            except Exception as db_error:
-                app.logger.error(f"MongoDB error in load_companies_data: {str(db_error)}")
-                # Fall through to JSON fallback
-                USE_MONGO = False
-                
-        # Fall back to JSON file if MongoDB is not available or there was an error
-        companies_file = os.path.join(app.root_path, 'static', 'data', 'companies.json')
-        app.logger.info(f"Falling back to loading companies from: {companies_file}")
+    """Load companies data from MongoDB, or from the JSON file when MongoDB is not in use.
+
+    This is the company directory's loader; request handlers should read
+    company_directory instead of calling it.
+    """
+    if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None:
+        try:
+            # Only fields in the companies_directory index, so the scan is covered
+            projection = {
+                '_id': 1,
+                'Company Name': 1,
+                'EmailID': 1
+            }
+            
+            # Find all companies in directory order, read straight off the index
+            companies_cursor = mongo_db.companies.find({}, projection).sort([('Company Name', 1), ('_id', 1)])
+            mapped_companies = [c for c in map(_map_company, companies_cursor) if c]
+            app.logger.info(f"Successfully loaded {len(mapped_companies)} companies from MongoDB")
+            return mapped_companies
+        except Exception as db_error:
+            # No JSON fallback here: the export is stale, and the directory keeps
+            # serving its last good snapshot until MongoDB answers again
+            app.logger.error(f"MongoDB error in load_companies_data: {str(db_error)}")
+            raise
+
+    try:
+        # JSON file when MongoDB is not in use
+        app.logger.info(f"Loading companies from: {COMPANIES_FILE}")
         
-        if os.path.exists(companies_file):
+        if os.path.exists(COMPANIES_FILE):
             try:
-                with open(companies_file, 'r', encoding='utf-8') as f:
+                with open(COMPANIES_FILE, 'r', encoding='utf-8-sig') as f:
                     companies_data = json.load(f)
-                    companies = companies_data.get('companies', [])
-                    app.logger.info(f"Loaded {len(companies)} companies from JSON file")
-                    return companies
+                # Either a mongoexport-style list or {"companies": [...]}
+                if isinstance(companies_data, dict):
+                    companies_data = companies_data.get('companies', [])
+                companies = [c for c in map(_map_company, companies_data) if c]
+                companies.sort(key=lambda c: c['name'])
+                app.logger.info(f"Loaded {len(companies)} companies from JSON file")
+                return companies
             except Exception as e:
                 app.logger.error(f"Error reading companies JSON file: {str(e)}")
         
-        app.logger.warning("No companies data found in MongoDB or JSON file")
+        app.logger.warning("No companies data found in the JSON file")
         return []
         
     except Exception as e:
         app.logger.error(f"Unexpected error in load_companies_data: {str(e)}", exc_info=True)
         return []
 
+def _companies_signature():
+    """Cheap change token for the company source: count plus newest write."""
+    if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None:
+        latest = mongo_db.companies.find_one({}, {'updated_at': 1}, sort=[('updated_at', -1)])
+        return mongo_db.companies.estimated_document_count(), (latest or {}).get('updated_at')
+    try:
+        return os.stat(COMPANIES_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _watch_companies(on_change):
+    """Call on_change after each burst of company writes (needs a replica set)."""
+    with mongo_db.companies.watch() as stream:
+        for _ in stream:
+            # Coalesce bursts such as bulk imports into one refresh
+            while stream.try_next() is not None:
+                pass
+            on_change()
+
+if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None:
+    try:
+        # Lets the poll fallback read max(updated_at) from the index
+        mongo_db.companies.create_index('updated_at')
+        # Covers the directory load: sorted by name and id, projecting only these fields
+        mongo_db.companies.create_index([('Company Name', 1), ('_id', 1), ('EmailID', 1)],
+                                        name='companies_directory')
+        # Duplicate detection for api_add_company and imports
+        ensure_company_key_indexes(mongo_db.companies)
+    except Exception as e:
+        print(f"⚠️ Could not create companies indexes: {e}")
+
+# Concurrent misses for the same data (company directory, machines, catalog
+# files) share one backend load instead of each running their own
+backend_loads = SingleFlight(name='backend_loads')
+
+company_directory = CompanyDirectory(
+    load=load_companies_data,
+    serialize=lambda companies: app.json.dumps(companies).encode('utf-8'),
+    signature=_companies_signature,
+    watch=_watch_companies if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None else None,
+    poll_interval=float(os.getenv('COMPANY_REFRESH_INTERVAL', 30)),
+    single_flight=backend_loads
+)
+
+# Typeahead index, kept in step with every directory snapshot
+company_search = CompanySearchIndex()
+company_directory.on_refresh(lambda snapshot: company_search.sync(snapshot.companies))
+
 @app.route('/')
 @app.route('/index')
 @login_required
 def index():
     try:
-        companies = load_companies_data()
-        
-        # Ensure companies is a list before passing to template
-        if not isinstance(companies, list):
-            companies = []
-            
-        return render_template('index.html', companies=companies)
+        return render_template('index.html', companies=company_directory.companies())
         
     except Exception as e:
         app.logger.error(f"Error in index route: {str(e)}")
@@ -1907,15 +2237,14 @@ def select_company():
                     }}
                 )
                 app.logger.info(f"MongoDB update result: {result.matched_count} documents modified")
+                invalidate_cached_user(current_user.id)
             else:
                 # Fallback to JSON storage
-                users = _load_users_json()
-                user_id_str = str(current_user.id)
-                if user_id_str in users:
-                    users[user_id_str]['company_id'] = company_id
-                    users[user_id_str]['company_name'] = company_name
-                    users[user_id_str]['company_email'] = company_email
-                    _save_users_json(users)
+                json_user_store.update(str(current_user.id), {
+                    'company_id': company_id,
+                    'company_name': company_name,
+                    'company_email': company_email
+                })
             
             # Update session
             session['company_id'] = company_id
@@ -1987,27 +2316,126 @@ def forgot_password_redirect():
 
 # API Routes
 
+# Company list pagination
+COMPANY_FIELDS = ('id', 'name', 'email')
+COMPANY_PAGE_SIZE = 50
+COMPANY_PAGE_MAX = 500
+GZIP_MIN_BYTES = 1024
+
+
+def _encode_company_cursor(company):
+    """Opaque cursor pointing just after ``company`` in directory order."""
+    raw = json.dumps(company_sort_key(company), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_company_cursor(cursor):
+    """Inverse of _encode_company_cursor; None for the first page, ValueError if malformed."""
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not (isinstance(key, list) and len(key) == 2 and all(isinstance(part, str) for part in key)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+def _json_bytes_response(body, etag, gzipped=None):
+    """Serve JSON bytes with an ETag (304 on a match), gzip-compressed when the client accepts it.
+
+    ``gzipped`` may return a precomputed compressed body.
+    """
+    compress = len(body) >= GZIP_MIN_BYTES and 'gzip' in request.accept_encodings
+    if compress:
+        # Each encoding is a different representation, so it gets its own tag
+        etag = f'{etag}-gz'
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        if compress:
+            body = gzipped() if gzipped else gzip.compress(body, 6)
+        response = Response(body, mimetype='application/json')
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
 # Company Management
 @app.route('/api/companies', methods=['GET'])
 @app.route('/get_companies', methods=['GET'])  # Add this line to support both endpoints
 @login_required
 def api_get_companies():
-    """Get all companies from the database"""
+    """Companies from the in-memory company directory.
+
+    Without parameters this is the whole directory as one array.  With
+    ``limit`` (and the ``next_cursor`` of the previous page as ``cursor``) it
+    returns ``{"companies": [...], "next_cursor": ...}`` in name order.
+    ``fields=id,name`` trims each company to the listed fields.
+    """
     try:
-        companies = load_companies_data()  # Use the helper function directly
-        if not companies:
+        snapshot = company_directory.snapshot()
+        if not snapshot.companies:
             return jsonify({'error': 'No companies found'}), 404
-            
-        # Convert to list of dicts if it's a dict
-        if isinstance(companies, dict):
-            companies = [{'id': k, 'name': v.get('name'), 'email': v.get('email')} 
-                        for k, v in companies.items()]
-            
-        return jsonify(companies)
+
+        fields = [f for f in request.args.get('fields', '').split(',') if f]
+        if any(f not in COMPANY_FIELDS for f in fields):
+            return jsonify({'error': f"fields must be a subset of {','.join(COMPANY_FIELDS)}"}), 400
+        paged = 'limit' in request.args or 'cursor' in request.args
+        if not paged and not fields:
+            # Serialized when the snapshot was built, compressed once on first use
+            return _json_bytes_response(snapshot.json_bytes, snapshot.etag, snapshot.gzip_bytes)
+
+        companies = snapshot.companies
+        next_cursor = None
+        if paged:
+            try:
+                limit = min(max(int(request.args.get('limit', COMPANY_PAGE_SIZE)), 1), COMPANY_PAGE_MAX)
+                after = _decode_company_cursor(request.args.get('cursor'))
+            except ValueError:
+                return jsonify({'error': 'Invalid limit or cursor'}), 400
+            companies = snapshot.page(after, limit)
+            if companies and company_sort_key(companies[-1]) != snapshot.keys[-1]:
+                next_cursor = _encode_company_cursor(companies[-1])
+        if fields:
+            companies = [{f: c.get(f) for f in fields} for c in companies]
+        body = {'companies': companies, 'next_cursor': next_cursor} if paged else companies
+        variant = hashlib.sha1(request.query_string).hexdigest()[:8]
+        return _json_bytes_response(app.json.dumps(body).encode('utf-8'), f'{snapshot.etag}-{variant}')
     except Exception as e:
         app.logger.error(f"Error getting companies: {str(e)}")
         return jsonify({'error': 'Failed to load companies'}), 500
 
+# Machines list, reloaded at most once per MACHINES_CACHE_TTL
+machines_cache = register_cache(TTLCache(
+    maxsize=1,
+    ttl=float(os.getenv('MACHINES_CACHE_TTL', 60)),
+    name='machines'
+))
+
+
+def _load_machines():
+    """Read the machine list from MongoDB as [{"id": ..., "name": ...}, …]."""
+    # Preferred structure – one master document with `machines` array
+    master_doc = mongo_db.machine.find_one({'machines': {'$exists': True}})
+    if master_doc and isinstance(master_doc.get('machines'), list):
+        return master_doc.get('machines', [])
+
+    # Fallback: each machine as its own document
+    cursor = mongo_db.machine.find({}, {'_id': 0, 'id': 1, 'name': 1})
+    machines = []
+    for doc in cursor:
+        # Some datasets might store ObjectIds or missing incremental id.
+        # Ensure we always provide an `id` (string) and `name`.
+        m_id = str(doc.get('id', doc.get('_id')))
+        m_name = doc.get('name')
+        if m_name:
+            machines.append({'id': m_id, 'name': m_name})
+    return machines
+
 # Machines list endpoint
 @app.route('/api/machines', methods=['GET'])
 @login_required
@@ -2023,22 +2451,13 @@ def api_get_machines():
         return jsonify([])
 
     try:
-        # Preferred structure – one master document with `machines` array
-        master_doc = mongo_db.machine.find_one({'machines': {'$exists': True}})
-        if master_doc and isinstance(master_doc.get('machines'), list):
-            return jsonify(master_doc.get('machines', []))
-
-        # Fallback: each machine as its own document
-        cursor = mongo_db.machine.find({}, {'_id': 0, 'id': 1, 'name': 1})
-        machines = []
-        for doc in cursor:
-            # Some datasets might store ObjectIds or missing incremental id.
-            # Ensure we always provide an `id` (string) and `name`.
-            m_id = str(doc.get('id', doc.get('_id')))
-            m_name = doc.get('name')
-            if m_name:
-                machines.append({'id': m_id, 'name': m_name})
-
+        machines = machines_cache.get('machines')
+        if machines is None:
+            # The generation is read before the load starts, so a list that
+            # api_add_machine invalidated mid-load is served once but not cached
+            generation, machines = backend_loads.do(
+                'machines', lambda: (machines_cache.generation, _load_machines()))
+            machines_cache.set('machines', machines, generation=generation)
         return jsonify(machines)
     except Exception as e:
         app.logger.error(f"Error fetching machines: {str(e)}")
@@ -2069,15 +2488,34 @@ def api_update_session():
 
 # ---------------------- Static JSON Data Endpoints ----------------------
 
+# Parsed catalog files by path; they only change on deploy
+static_json_cache = register_cache(TTLCache(
+    maxsize=32,
+    ttl=float(os.getenv('STATIC_JSON_CACHE_TTL', 300)),
+    name='static_json'
+))
+
+
+def _read_json_file(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_static_json(file_path):
+    """Parsed contents of a catalog JSON file, parsed once per cache expiry."""
+    data = static_json_cache.get(file_path)
+    if data is None:
+        data = backend_loads.do(('static_json', file_path), lambda: _read_json_file(file_path))
+        static_json_cache.set(file_path, data)
+    return data
+
 @app.route('/blanket_categories')
 @login_required
 def api_blanket_categories():
     """Serve blanket categories JSON to frontend."""
     try:
         file_path = os.path.join(app.root_path, 'static', 'products', 'blankets', 'blanket_categories.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return jsonify(data)
+        return jsonify(load_static_json(file_path))
     except FileNotFoundError:
         app.logger.error("blanket_categories.json not found at %s", file_path)
         return jsonify({'error': 'Blanket categories data not found'}), 404
@@ -2091,9 +2529,7 @@ def api_blanket_data():
     """Serve blankets data JSON to frontend."""
     try:
         file_path = os.path.join(app.root_path, 'static', 'products', 'blankets', 'blankets.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return jsonify(data)
+        return jsonify(load_static_json(file_path))
     except FileNotFoundError:
         app.logger.error("blankets.json not found at %s", file_path)
         return jsonify({'error': 'Blankets data not found'}), 404
@@ -2110,9 +2546,7 @@ def api_thickness_data():
         primary_path = os.path.join(app.root_path, 'static', 'products', 'blankets', 'thickness.json')
         fallback_path = os.path.join(app.root_path, 'static', 'data', 'thickness.json')
         file_path = primary_path if os.path.exists(primary_path) else fallback_path
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return jsonify(data)
+        return jsonify(load_static_json(file_path))
     except FileNotFoundError:
         app.logger.error("thickness.json not found at %s", file_path)
         return jsonify({'error': 'Thickness data not found'}), 404
@@ -2126,9 +2560,7 @@ def api_bar_data():
     """Serve bar data JSON to frontend."""
     try:
         file_path = os.path.join(app.root_path, 'static', 'products', 'blankets', 'bar.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return jsonify(data)
+        return jsonify(load_static_json(file_path))
     except FileNotFoundError:
         app.logger.error("bar.json not found at %s", file_path)
         return jsonify({'error': 'Bar data not found'}), 404
@@ -2136,47 +2568,51 @@ def api_bar_data():
         app.logger.error("Error reading bar.json: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/blankets/price')
+@login_required
+def api_blanket_price():
+    """Price a blanket from the precomputed matrix.
+
+    Query parameters: ``length``, ``width``, ``unit`` (mm, m or in), either
+    ``product_id`` or ``name``, optional ``bar`` and ``basis`` (sqm or sqyd).
+    """
+    if blanket_prices is None:
+        return jsonify({'error': 'Blanket price data not available'}), 503
+
+    try:
+        length = float(request.args.get('length', 0))
+        width = float(request.args.get('width', 0))
+    except ValueError:
+        return jsonify({'error': 'length and width must be numbers'}), 400
+
+    quote = blanket_prices.quote(
+        length, width,
+        unit=request.args.get('unit', 'mm'),
+        product_id=request.args.get('product_id'),
+        name=request.args.get('name'),
+        bar_type=request.args.get('bar'),
+        basis=request.args.get('basis', 'sqm')
+    )
+    if quote is None:
+        return jsonify({'error': 'Unknown blanket, unit or rate basis'}), 404
+    return jsonify(quote)
+
 # Company Search Endpoint
 @app.route('/api/companies/search', methods=['GET'])
 @login_required
 def search_companies():
-    """Search for companies by name"""
-    query = request.args.get('q', '').lower().strip()
+    """Typeahead search over company names and emails"""
+    query = request.args.get('q', '').strip()
     if not query or len(query) < 2:
         return jsonify([])
-    
     try:
-        # Search in MongoDB if available
-        if MONGO_AVAILABLE and USE_MONGO:
-            # Search in both name and address fields
-            regex_pattern = f'.*{re.escape(query)}.*'
-            companies = list(mongo_db.companies.find({
-                '$or': [
-                    {'name': {'$regex': regex_pattern, '$options': 'i'}},
-                    {'address': {'$regex': regex_pattern, '$options': 'i'}}
-                ]
-            }).limit(10))
-            
-            # Convert ObjectId to string for JSON serialization
-            for company in companies:
-                company['id'] = str(company.pop('_id'))
-        else:
-            # Fallback to JSON file if needed
-            companies_file = os.path.join('data', 'companies.json')
-            if os.path.exists(companies_file):
-                with open(companies_file, 'r') as f:
-                    all_companies = json.load(f)
-                
-                # Simple case-insensitive search
-                companies = [
-                    {**c, 'id': c['id']} for c in all_companies 
-                    if query in c.get('name', '').lower() or 
-                       query in c.get('address', '').lower()
-                ][:10]
-            else:
-                companies = []
-        
-        return jsonify(companies)
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+
+    try:
+        company_directory.snapshot()  # Builds the index on first use
+        return jsonify(company_search.search(query, limit))
     except Exception as e:
         app.logger.error(f"Error searching companies: {str(e)}")
         return jsonify({'error': 'Failed to search companies'}), 500
@@ -2245,22 +2681,20 @@ def update_user_company():
                 else:
                     # If a document exists but was not matched (unlikely), update company_id
                     users_col.update_one({'_id': current_user.id}, {'$set': {'company_id': company_id_casted}})
+            invalidate_cached_user(current_user.id)
             # No error even if modified_count == 0 (company already set)
         else:
-            # Update in JSON file
-            users = load_users()
-            if str(current_user.id) not in users:
+            # Update in JSON store
+            if not json_user_store.update(str(current_user.id), {'company_id': company_id}):
                 return jsonify({'status': 'error', 'message': 'User not found'}), 404
-                
-            users[str(current_user.id)]['company_id'] = company_id
-            save_users()
         
         # Update session
         session['company_id'] = company_id
         
         # Get company details for response
-        company_name = get_company_name_by_id(company_id)
-        company_email = get_company_email_by_id(company_id)
+        company = get_company(company_id) or {}
+        company_name = company.get('name', '')
+        company_email = company.get('email', '')
         
         # Update session with company details
         session['company_name'] = company_name
@@ -2280,29 +2714,6 @@ def update_user_company():
         app.logger.error(f"Error updating user company: {str(e)}")
         return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
 
-def load_users():
-    """Load users from JSON file"""
-    try:
-        users_file = os.path.join(os.path.dirname(__file__), 'data', 'users.json')
-        if os.path.exists(users_file):
-            with open(users_file, 'r') as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        app.logger.error(f"Error loading users: {str(e)}")
-        return {}
-
-def save_users(users):
-    """Save users to JSON file"""
-    try:
-        users_dir = os.path.join(os.path.dirname(__file__), 'data')
-        os.makedirs(users_dir, exist_ok=True)
-        users_file = os.path.join(users_dir, 'users.json')
-        with open(users_file, 'w') as f:
-            json.dump(users, f, indent=2)
-    except Exception as e:
-        app.logger.error(f"Error saving users: {str(e)}")
-
 @app.route('/update_company', methods=['POST'])
 @app.route('/api/user/update-company', methods=['POST'])
 @login_required
@@ -2374,18 +2785,18 @@ def update_company():
                         })
                         users_col.insert_one(update_data)
                         result = type('obj', (object,), {'matched_count': 1})  # Mock result object
+            invalidate_cached_user(current_user.id)
         else:
-            # Update in JSON file
-            users = load_users()
+            # Update in JSON store
             user_id = str(current_user.id)
-            if user_id not in users:
-                users[user_id] = {}
-                
-            users[user_id]['company_id'] = company_id
-            users[user_id]['company_name'] = company_name
-            users[user_id]['company_email'] = company_email
-            users[user_id]['updated_at'] = datetime.utcnow().isoformat()
-            save_users(users)
+            changes = {
+                'company_id': company_id,
+                'company_name': company_name,
+                'company_email': company_email,
+                'updated_at': datetime.utcnow().isoformat()
+            }
+            if not json_user_store.update(user_id, changes):
+                json_user_store.put(user_id, changes)
         
         # Update session with company information
         session['company_id'] = company_id
@@ -2467,58 +2878,28 @@ def api_add_company():
         return jsonify({'success': False, 'message': 'Name and email are required.'}), 400
 
     try:
-        # Use the global mongo_db connection
-        global mongo_db, USE_MONGO
-        
-        # Log MongoDB connection status
-        app.logger.info(f"MongoDB status - Available: {MONGO_AVAILABLE}, Using: {USE_MONGO}, Connection: {'Yes' if mongo_db is not None else 'No'}")
-        
-        # Check MongoDB connection
         if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None:
+            # The unique name_key/email_key indexes reject duplicates, so this
+            # single insert is the whole check and concurrent adds cannot race
+            now = datetime.utcnow()
+            company_data = {
+                'Company Name': name,
+                'EmailID': email,
+                'created_at': now,
+                'updated_at': now,
+                'created_by': str(current_user.id),
+                **company_keys(name, email)
+            }
+            app.logger.info(f"Inserting company data: {company_data}")
             try:
-                # Test the connection
-                mongo_db.command('ping')
-                app.logger.info("Successfully pinged MongoDB")
-            except Exception as e:
-                app.logger.error(f"MongoDB ping failed: {str(e)}")
-                USE_MONGO = False
-                mongo_db = None
-
-        # Check for existing company with same name or email
-        if mongo_db is not None:
-            try:
-                # Check for existing company in MongoDB (case-insensitive)
-                existing_company = mongo_db.companies.find_one({
-                    '$or': [
-                        {'Company Name': {'$regex': f'^{name}$', '$options': 'i'}},
-                        {'EmailID': {'$regex': f'^{email}$', '$options': 'i'}}
-                    ]
-                })
-                
-                if existing_company:
-                    return jsonify({
-                        'success': False, 
-                        'message': 'A company with this name or email already exists.'
-                    }), 400
-                    
-                # Insert new company with consistent field names (only one set of fields)
-                company_data = {
-                    'Company Name': name.strip(),
-                    'EmailID': email.lower().strip(),
-                    'created_at': datetime.utcnow(),
-                    'created_by': str(current_user.id)
-                }
-                app.logger.info(f"Inserting company data: {company_data}")
                 result = mongo_db.companies.insert_one(company_data)
-                company_id = str(result.inserted_id)
-                app.logger.info(f"Successfully inserted company into MongoDB with ID: {company_id}")
-                
-            except Exception as db_error:
-                app.logger.error(f"Database error in api_add_company: {str(db_error)}", exc_info=True)
-                # Fall through to JSON fallback
-                app.logger.info("Falling back to JSON storage due to database error")
-                mongo_db = None  # Force fallback to JSON
-                raise db_error
+            except DuplicateKeyError:
+                return jsonify({
+                    'success': False,
+                    'message': 'A company with this name or email already exists.'
+                }), 400
+            company_id = str(result.inserted_id)
+            app.logger.info(f"Successfully inserted company into MongoDB with ID: {company_id}")
         else:
             # JSON fallback implementation
             companies_file = os.path.join(app.root_path, 'static', 'data', 'company_emails.json')
@@ -2530,9 +2911,10 @@ def api_add_company():
                 with open(companies_file, 'r', encoding='utf-8') as f:
                     companies = json.load(f) or []
             
-            # Check for duplicates
-            if any(company.get('Company Name') == name or company.get('EmailID') == email 
-                  for company in companies):
+            # Check for duplicates, normalized the same way as the MongoDB keys
+            keys = company_keys(name, email)
+            if any(company_keys(company.get('Company Name'), company.get('EmailID')).get(field) == value
+                   for company in companies for field, value in keys.items()):
                 return jsonify({
                     'success': False, 
                     'message': 'A company with this name or email already exists.'
@@ -2554,6 +2936,8 @@ def api_add_company():
 
         # Log the successful addition
         app.logger.info(f"Company added successfully - Name: {name}, Email: {email}")
+        company_directory.refresh()
+        invalidate_cached_company(company_id)
         
         # Try to send notification email (non-blocking)
         try:
@@ -2588,9 +2972,7 @@ def api_add_company():
         error_message = str(e)
         
         # Provide more specific error messages for common issues
-        if "duplicate key error" in error_message.lower():
-            error_message = "A company with this name or email already exists."
-        elif "timed out" in error_message.lower() or "connection" in error_message.lower():
+        if "timed out" in error_message.lower() or "connection" in error_message.lower():
             error_message = "Could not connect to the database. Please try again later."
             
         return jsonify({
@@ -2598,6 +2980,66 @@ def api_add_company():
             'message': f'Failed to add company: {error_message}'
         }), 500
 
+@app.route('/api/companies/import', methods=['POST'])
+@login_required
+def api_import_companies():
+    """Bulk import companies from an uploaded CSV, JSON or JSON Lines file.
+
+    Send the file as the ``file`` form field, or as the raw request body with
+    ``?format=csv|json|jsonl``.  Rows whose name or email is already taken are
+    skipped and counted as duplicates.
+    """
+    if not (MONGO_AVAILABLE and USE_MONGO and mongo_db is not None):
+        return jsonify({'success': False, 'message': 'Bulk import requires MongoDB.'}), 503
+
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, filename = upload.stream, upload.filename
+    else:
+        stream, filename = request.stream, ''
+    fmt = request.args.get('format') or detect_format(filename, default='')
+    if not fmt:
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'json'
+    try:
+        chunk_size = min(max(int(request.args.get('chunk_size', DEFAULT_IMPORT_CHUNK_SIZE)), 1), 10000)
+        records = read_company_records(codecs.getreader('utf-8-sig')(stream), fmt)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    chunks = []
+
+    def on_chunk(report):
+        chunks.append(report)
+        app.logger.info(f"Company import chunk {report['chunk']}: {report['inserted']}/{report['read']} inserted, "
+                        f"{report['duplicates']} duplicates ({report['rows_per_second']} rows/s)")
+
+    try:
+        summary = import_companies(mongo_db.companies, records, chunk_size=chunk_size,
+                                   created_by=str(current_user.id), on_chunk=on_chunk)
+    except (ValueError, csv.Error) as e:
+        # Chunks before the bad input are already stored
+        app.logger.warning(f"Company import stopped: {e}")
+        return jsonify({'success': False, 'message': f'Invalid import file: {e}', 'chunk_reports': chunks}), 400
+    except Exception as e:
+        app.logger.error(f"Error importing companies: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'message': 'Failed to import companies', 'chunk_reports': chunks}), 500
+    finally:
+        company_directory.refresh()
+        invalidate_cached_company()
+
+    app.logger.info(f"Company import finished: {summary}")
+    if summary['inserted']:
+        try:
+            user_identity = getattr(current_user, 'email', getattr(current_user, 'username', 'Unknown User'))
+            send_alert_email(
+                subject='Database Update: Companies Imported',
+                body=f"{user_identity} imported {summary['inserted']} companies ({summary['duplicates']} duplicates "
+                     f"skipped) on {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC"
+            )
+        except Exception as email_error:
+            app.logger.error(f"Error sending notification email: {str(email_error)}")
+    return jsonify({'success': True, **summary, 'chunk_reports': chunks})
+
 @app.route('/api/add_machine', methods=['POST'])
 @login_required
 def api_add_machine():
@@ -2670,6 +3112,7 @@ def api_add_machine():
             with open(machines_file, 'w', encoding='utf-8') as f:
                 json.dump(machines_data, f, ensure_ascii=False, indent=2)
 
+        machines_cache.clear()
         return jsonify({'success': True, 'message': 'Machine added successfully.', 'id': machine_id})
     except Exception as e:
         app.logger.error(f"Error adding machine: {e}")
@@ -2692,32 +3135,23 @@ def api_request_password_reset():
         if doc and doc.get('email', '').lower() == email:
             user = doc
     else:
-        for u in users.values():
-            if u.email.lower() == email:
-                user = u
-                break
+        user = find_json_user(email, email_only=True)
 
     if not user:
         # Don't reveal if email exists for security
         return jsonify({'success': True, 'message': 'If an account with that email exists, a password reset OTP has been sent.'})
 
     # Generate OTP
-    otp = ''.join(random.choices('0123456789', k=6))
-    otp_expiry = datetime.utcnow() + timedelta(minutes=10)
-
-    # Store OTP in user's record
     if MONGO_AVAILABLE and USE_MONGO:
-        users_col.update_one(
-            {'_id': user['_id']},
-            {'$set': {
-                'reset_token': otp,
-                'reset_token_expiry': otp_expiry
-            }}
-        )
+        # Stored in otp_tokens, where the TTL index reaps it after expiry
+        otp = issue_otp(email, PURPOSE_PASSWORD_RESET, ttl_minutes=10)
     else:
-        user.reset_token = otp
-        user.reset_token_expiry = otp_expiry
-        save_users()
+        otp = ''.join(random.choices('0123456789', k=6))
+        otp_expiry = datetime.utcnow() + timedelta(minutes=10)
+        json_user_store.update(user.id, {
+            'reset_token': otp,
+            'reset_token_expiry': otp_expiry.isoformat()
+        })
 
     # Send email with OTP
     try:
@@ -2759,16 +3193,18 @@ def api_verify_reset_otp():
         if not all([email, otp]):
             return jsonify({'error': 'Email and OTP are required'}), 400
 
-        user = None
         if MONGO_AVAILABLE and USE_MONGO:
-            doc = mu_find_user_by_email_or_username(email)
-            if doc and doc.get('email', '').lower() == email:
-                user = doc
-        else:
-            for u in users.values():
-                if u.email.lower() == email:
-                    user = u
-                    break
+            # Codes are only issued for existing accounts, so no user lookup is needed
+            outcome = verify_otp(email, PURPOSE_PASSWORD_RESET, otp)
+            if outcome == OTP_MISSING:
+                return jsonify({'error': 'No OTP requested. Please request a new OTP.'}), 400
+            if outcome == OTP_EXPIRED:
+                return jsonify({'error': 'OTP has expired'}), 400
+            if outcome != OTP_OK:
+                return jsonify({'error': 'Invalid OTP'}), 400
+            return jsonify({'success': True, 'message': 'OTP verified successfully'})
+
+        user = find_json_user(email, email_only=True)
 
         if not user:
             return jsonify({'error': 'No account found with that email'}), 404
@@ -2790,6 +3226,13 @@ def api_verify_reset_otp():
         traceback.print_exc()
         return jsonify({'error': 'Internal server error'}), 500
 
+def password_busy_response():
+    """503 for auth requests turned away by the password hashing pool."""
+    return jsonify({
+        'error': 'Server busy',
+        'message': 'Too many sign-in requests right now. Please try again in a moment.'
+    }), 503, {'Retry-After': '1'}
+
 @app.route('/api/auth/reset-password', methods=['POST'])
 def api_reset_password():
     try:
@@ -2803,67 +3246,58 @@ def api_reset_password():
             
         print(f"Resetting password for email: {email}")
             
-        # Find user by email
-        user = None
-        if MONGO_AVAILABLE and USE_MONGO:
-            print("Looking up user in MongoDB...")
-            doc = mu_find_user_by_email_or_username(email)
-            if doc and doc.get('email', '').lower() == email:
-                user = doc
-                print(f"User found in MongoDB: {user['email']} (ID: {user['_id']})")
-        else:
-            # Fallback to JSON storage
-            for u in users.values():
-                if u.email.lower() == email:
-                    user = u
-                    break
-                
-        if not user:
-            print(f"No user found with email: {email}")
-            return jsonify({'error': 'No account found with that email'}), 404
-            
-        # Verify OTP
-        stored_otp = user.get('reset_token') if isinstance(user, dict) else user.reset_token
-        stored_expiry = user.get('reset_token_expiry') if isinstance(user, dict) else user.reset_token_expiry
-        
-        print(f"Verifying OTP - Stored: {stored_otp}, Provided: {otp}")
-        
-        if not stored_otp or stored_otp != otp:
-            print("Invalid OTP")
-            return jsonify({'error': 'Invalid OTP'}), 400
-            
-        if stored_expiry and stored_expiry < datetime.utcnow():
-            print("OTP expired")
-            return jsonify({'error': 'OTP has expired'}), 400
-            
-        # Update password
         if MONGO_AVAILABLE and USE_MONGO:
-            print(f"Updating password for user {user['_id']}")
-            # Create a new User instance to use its password hashing
-            temp_user = User(
-                id=str(user['_id']),
-                email=user['email'],
-                username=user['username'],
-                password_hash=user.get('password_hash', '')
-            )
-            temp_user.set_password(new_password)
-            
-            # Update the user in MongoDB
-            users_col.update_one(
-                {'_id': user['_id']},
-                {'$set': {
-                    'password_hash': temp_user.password_hash,
-                    'reset_token': None,
-                    'reset_token_expiry': None
-                }}
+            # Cheap check first, so bad codes never reach the hashing pool
+            outcome = verify_otp(email, PURPOSE_PASSWORD_RESET, otp)
+            if outcome == OTP_EXPIRED:
+                return jsonify({'error': 'OTP has expired'}), 400
+            if outcome != OTP_OK:
+                return jsonify({'error': 'Invalid OTP'}), 400
+
+            # Hash before consuming: if the pool is busy the client retries with the same code
+            password_hash = hash_password(new_password)
+
+            # Consume the code so it cannot be replayed (or used by a concurrent reset)
+            outcome = verify_otp(email, PURPOSE_PASSWORD_RESET, otp, consume=True)
+            if outcome == OTP_EXPIRED:
+                return jsonify({'error': 'OTP has expired'}), 400
+            if outcome != OTP_OK:
+                return jsonify({'error': 'Invalid OTP'}), 400
+
+            doc = users_col.find_one_and_update(
+                {'email': email},
+                {
+                    '$set': {'password_hash': password_hash, 'updated_at': datetime.utcnow()},
+                    # Reset codes used to live on the user document
+                    '$unset': {'reset_token': '', 'reset_token_expiry': ''}
+                },
+                projection={'_id': 1}
             )
+            if not doc:
+                return jsonify({'error': 'No account found with that email'}), 404
+            invalidate_cached_user(doc['_id'])
             print("Password updated successfully in MongoDB")
         else:
             # Fallback to JSON storage
+            user = find_json_user(email, email_only=True)
+            if not user:
+                print(f"No user found with email: {email}")
+                return jsonify({'error': 'No account found with that email'}), 404
+
+            if not user.reset_token or user.reset_token != otp:
+                print("Invalid OTP")
+                return jsonify({'error': 'Invalid OTP'}), 400
+
+            if user.reset_token_expiry and user.reset_token_expiry < datetime.utcnow():
+                print("OTP expired")
+                return jsonify({'error': 'OTP has expired'}), 400
+
             user.set_password(new_password)
-            user.reset_token = None
-            user.reset_token_expiry = None
-            save_users()
+            json_user_store.update(user.id, {
+                'password_hash': user.password_hash,
+                'reset_token': None,
+                'reset_token_expiry': None
+            })
         
         return jsonify({
             'success': True,
@@ -2871,6 +3305,8 @@ def api_reset_password():
             'redirectTo': '/login'  # Redirect to login page after successful reset
         })
         
+    except PasswordHashBusy:
+        return password_busy_response()
     except Exception as e:
         print(f"Password reset error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -2932,153 +3368,9 @@ def quotation_preview():
         
         session['selected_company'] = selected_company
 
-    # Ensure all items have required fields and calculate subtotal
-    subtotal = 0
-    for item in cart.get('products', []):
-        # Ensure all required fields exist with defaults
-        item.setdefault('type', '')
-        item.setdefault('quantity', 1)
-        item.setdefault('discount_percent', 0)
-        item.setdefault('gst_percent', 18)  # Default GST for mpack
-        item.setdefault('unit_price', 0)
-        item.setdefault('base_price', 0)
-        item.setdefault('bar_price', 0)
-        
-        if item['type'] == 'mpack':
-            # Calculate mpack total matching cart template's approach
-            price = float(item['unit_price'])
-            quantity = int(item['quantity'])
-            discount_percent = float(item['discount_percent'])
-            gst_percent = float(item['gst_percent'])
-            
-            subtotal = price * quantity
-            discount_amount = (subtotal * discount_percent / 100) if discount_percent else 0
-            price_after_discount = subtotal - discount_amount
-            gst_amount = (price_after_discount * gst_percent / 100) if gst_percent else 0
-            final_total = price_after_discount + gst_amount
-            
-            # Store calculations in the item
-            item['calculations'] = {
-                'unit_price': round(price, 2),
-                'quantity': quantity,
-                'subtotal': round(subtotal, 2),
-                'discount_percent': discount_percent,
-                'discount_amount': round(discount_amount, 2),
-                'price_after_discount': round(price_after_discount, 2),
-                'gst_percent': gst_percent,
-                'gst_amount': round(gst_amount, 2),
-                'final_total': round(final_total, 2)
-            }
-            item_subtotal = final_total
-            
-        elif item['type'] == 'blanket':
-            # Calculate blanket total matching cart template's approach
-            base_price = float(item.get('base_price', 0))
-            bar_price = float(item.get('bar_price', 0))
-            quantity = int(item.get('quantity', 1))
-            discount_percent = float(item.get('discount_percent', 0))
-            gst_percent = float(item.get('gst_percent', 18))
-            
-            # Calculate unit price as base + bar price
-            unit_price = base_price + bar_price
-            
-            # Calculate subtotal (unit price * quantity)
-            subtotal = unit_price * quantity
-            
-            # Calculate discount amount
-            discount_amount = (subtotal * discount_percent / 100) if discount_percent else 0
-            
-            # Apply discount to get discounted subtotal
-            discounted_subtotal = subtotal - discount_amount
-            
-            # Calculate GST on discounted amount
-            gst_amount = (discounted_subtotal * gst_percent / 100)
-            
-            # Final total after discount and GST
-            final_total = discounted_subtotal + gst_amount
-            
-            # Store calculations in the item
-            item['calculations'] = {
-                'base_price': round(base_price, 2),
-                'bar_price': round(bar_price, 2),
-                'unit_price': round(unit_price, 2),
-                'quantity': quantity,
-                'subtotal': round(subtotal, 2),
-                'discount_percent': discount_percent,
-                'discount_amount': round(discount_amount, 2),
-                'discounted_subtotal': round(subtotal - discount_amount, 2),
-                'gst_percent': gst_percent,
-                'gst_amount': round(gst_amount, 2),
-                'final_total': round(final_total, 2)
-            }
-            item_subtotal = final_total
-            
-        else:
-            # Handle other product types
-            price = float(item.get('unit_price', 0))
-            quantity = int(item.get('quantity', 1))
-            discount_percent = float(item.get('discount_percent', 0))
-            gst_percent = float(item.get('gst_percent', 12))
-            
-            subtotal = price * quantity
-            discount_amount = (subtotal * discount_percent / 100) if discount_percent else 0
-            discounted_subtotal = subtotal - discount_amount
-            gst_amount = (discounted_subtotal * gst_percent / 100) if gst_percent else 0
-            final_total = discounted_subtotal + gst_amount
-            
-            item['calculations'] = {
-                'unit_price': round(price, 2),
-                'quantity': quantity,
-                'subtotal': round(subtotal, 2),
-                'discount_percent': discount_percent,
-                'discount_amount': round(discount_amount, 2),
-                'gst_percent': gst_percent,
-                'gst_amount': round(gst_amount, 2),
-                'final_total': round(final_total, 2)
-            }
-            item_subtotal = final_total
-        
-        subtotal += item_subtotal
-    
-    # Calculate final totals with appropriate tax rates and discounts
-    subtotal_blankets = 0
-    subtotal_mpacks = 0
-    discount_blankets = 0
-    discount_mpacks = 0
-    
-    for item in cart.get('products', []):
-        item_calc = item.get('calculations', {})
-        item_subtotal = item_calc.get('subtotal', 0)
-        item_discount = item_calc.get('discount_amount', 0)
-        
-        if item.get('type') == 'blanket':
-            subtotal_blankets += item_subtotal
-            discount_blankets += item_discount
-        else:  # Assume mpacks for other types
-            subtotal_mpacks += item_subtotal
-            discount_mpacks += item_discount
-    
-    # Calculate amounts after discount
-    subtotal_after_discount_blankets = max(0, subtotal_blankets - discount_blankets)
-    subtotal_after_discount_mpacks = max(0, subtotal_mpacks - discount_mpacks)
-    
-    # Calculate GST for each category (on discounted amount)
-    gst_blankets = subtotal_after_discount_blankets * 0.18  # 18% GST for blankets
-    gst_mpacks = subtotal_after_discount_mpacks * 0.12      # 12% GST for mpacks
-    
-    # Calculate final totals
-    subtotal_before_discount = subtotal_blankets + subtotal_mpacks
-    total_discount = discount_blankets + discount_mpacks
-    subtotal_after_discount = subtotal_after_discount_blankets + subtotal_after_discount_mpacks
-    total_gst = gst_blankets + gst_mpacks
-    total = subtotal_after_discount + total_gst
-    
-    # Round to 2 decimal places for display
-    subtotal_before_discount = round(subtotal_before_discount, 2)
-    total_discount = round(total_discount, 2)
-    subtotal_after_discount = round(subtotal_after_discount, 2)
-    total = round(total, 2)
-    total_gst = round(total_gst, 2)
+    # Per-line and per-GST-class figures come from the pricing engine
+    totals = cart['totals']
+    subtotal_after_discount = totals['subtotal_after_discount']
 
     # Ensure session is saved before rendering the template
     session.modified = True
@@ -3094,27 +3386,11 @@ def quotation_preview():
         'company_email': customer_email,
         'now': current_datetime,  # Add current datetime object for the template
         'calculations': {
-            'subtotal_before_discount': subtotal_before_discount,
-            'total_discount': total_discount,
+            'subtotal_before_discount': totals['subtotal_before_discount'],
+            'total_discount': totals['total_discount'],
             'subtotal_after_discount': subtotal_after_discount,
-            'total': total,
-            'gst_breakdown': {
-                'blankets': {
-                    'subtotal': round(subtotal_blankets, 2),
-                    'discount': round(discount_blankets, 2),
-                    'subtotal_after_discount': round(subtotal_after_discount_blankets, 2),
-                    'gst': round(gst_blankets, 2),
-                    'rate': 18
-                },
-                'mpacks': {
-                    'subtotal': round(subtotal_mpacks, 2),
-                    'discount': round(discount_mpacks, 2),
-                    'subtotal_after_discount': round(subtotal_after_discount_mpacks, 2),
-                    'gst': round(gst_mpacks, 2),
-                    'rate': 12
-                },
-                'total_gst': round(total_gst, 2)
-            }
+            'total': totals['total'],
+            'gst_breakdown': cart['gst_breakdown']
         },
         'cart_total': subtotal_after_discount  # cart_total is the subtotal after discount but before taxes
     }
@@ -3154,8 +3430,9 @@ def send_quotation():
         
         # First try to get from user's company_id if available
         if hasattr(current_user, 'company_id') and current_user.company_id:
-            customer_name = get_company_name_by_id(current_user.company_id)
-            customer_email = get_company_email_by_id(current_user.company_id)
+            company = get_company(current_user.company_id) or {}
+            customer_name = company.get('name', '')
+            customer_email = company.get('email', '')
         
         # If not found in user's company_id, try session
         if customer_name == 'Not specified' or not customer_email:
@@ -3200,6 +3477,7 @@ def send_quotation():
                             'company_id': current_user.company_id if hasattr(current_user, 'company_id') else None
                         }}
                     )
+                    invalidate_cached_user(current_user.id)
                 except Exception as e:
                     app.logger.error(f"Error updating user's company info: {str(e)}")
             
@@ -3240,7 +3518,6 @@ def send_quotation():
             <tbody>
         """
         
-        subtotal = 0
         for idx, p in enumerate(products, start=1):
             machine = p.get('machine', '')
             prod_type = p.get('type', '')
@@ -3256,66 +3533,6 @@ def send_quotation():
             
             qty = p.get('quantity', 1)
             
-            # Calculate total based on product type
-            if prod_type == 'mpack':
-                # Always recalculate MPack totals to ensure fresh values after quantity changes
-                unit_price = float(p.get('unit_price', 0))
-                discount_percent = float(p.get('discount_percent', 0))
-                gst_percent = float(p.get('gst_percent', 12))  # 12% GST for MPack
-
-                subtotal_val = unit_price * qty
-                discount_amount = (subtotal_val * discount_percent / 100) if discount_percent else 0
-                taxable_amount = subtotal_val - discount_amount
-                gst_amount = taxable_amount * gst_percent / 100
-                total_val = taxable_amount + gst_amount
-                
-                # Store discount percent for email template
-                p['discount_percent_display'] = discount_percent
-                
-                # Add discount percent to calculations for display
-                p['calculations'] = p.get('calculations', {})
-                p['calculations']['discount_percent'] = discount_percent
-
-                # Update (or create) calculations dict so subsequent routes remain consistent
-                p['calculations'] = {
-                    'unit_price': round(unit_price, 2),
-                    'quantity': qty,
-                    'discount_percent': discount_percent,
-                    'discount_amount': round(discount_amount, 2),
-                    'taxable_amount': round(taxable_amount, 2),
-                    'gst_percent': gst_percent,
-                    'gst_amount': round(gst_amount, 2),
-                    'final_total': round(total_val, 2)
-                }
-                
-            elif prod_type == 'blanket':
-                # Always recalculate Blanket totals as well
-                base_price = float(p.get('base_price', 0))
-                bar_price = float(p.get('bar_price', 0))
-                unit_price = base_price + bar_price
-                discount_percent = float(p.get('discount_percent', 0))
-                gst_percent = float(p.get('gst_percent', 18))
-
-                subtotal_val = unit_price * qty
-                discount_amount = subtotal_val * discount_percent / 100 if discount_percent else 0
-                taxable_amount = subtotal_val - discount_amount
-                gst_amount = taxable_amount * gst_percent / 100
-                total_val = taxable_amount + gst_amount
-
-                # Sync calculations back to product
-                p['calculations'] = {
-                    'unit_price': round(unit_price, 2),
-                    'quantity': qty,
-                    'discount_percent': discount_percent,
-                    'discount_amount': round(discount_amount, 2),
-                    'taxable_amount': round(taxable_amount, 2),
-                    'gst_percent': gst_percent,
-                    'gst_amount': round(gst_amount, 2),
-                    'final_total': round(total_val, 2)
-                }
-            
-            subtotal += total_val
-            
             rows_html += f"""
                 <tr>
                     <td style='padding: 8px; border: 1px solid #ddd;'>{idx}</td>
@@ -3355,12 +3572,10 @@ def send_quotation():
             discount_text.append(f"{max(mpack_discounts):.1f}% ")
         discount_text = ", ".join(discount_text)
         
-        # Calculate total discount amount
-        total_discount = sum(
-            p.get('calculations', {}).get('discount_amount', 0) 
-            for p in products 
-            if p.get('calculations', {}).get('discount_amount', 0) > 0
-        )
+        # Cart totals and per-class GST were computed by get_user_cart()
+        totals = cart['totals']
+        gst_breakdown = cart['gst_breakdown']
+        total_discount = totals['total_discount']
         
         # Determine if we should show the discount row
         show_discount = bool(blanket_discounts or mpack_discounts)
@@ -3459,7 +3674,7 @@ def send_quotation():
                                 <tbody>
                                     <tr>
                                         <td style='padding: 8px; text-align: right; width: 70%;'>Subtotal (Pre-Discount):</td>
-                                        <td style='padding: 8px; text-align: right; width: 30%;'>₹{sum((p.get('unit_price', p.get('base_price', 0))) * p.get('quantity', 1) for p in products):,.2f}</td>
+                                        <td style='padding: 8px; text-align: right; width: 30%;'>₹{totals['subtotal_before_discount']:,.2f}</td>
                                     </tr>
                                     {f'''
                                     <tr style="display: {'table-row' if show_discount else 'none'};">
@@ -3469,26 +3684,26 @@ def send_quotation():
                                     ''' if True else ''}
                                     <tr style='border-top: 1px solid #dee2e6;'>
                                         <td style='padding: 8px; text-align: right; font-weight: bold;'>Total (Pre-GST):</td>
-                                        <td style='padding: 8px; text-align: right; font-weight: bold;'>₹{sum(p.get("calculations", {}).get("taxable_amount", p.get("calculations", {}).get("subtotal", 0)) for p in products):,.2f}</td>
+                                        <td style='padding: 8px; text-align: right; font-weight: bold;'>₹{totals['subtotal_after_discount']:,.2f}</td>
                                     </tr>
                                 
                                     {f'''
                                     <tr>
                                         <td style='padding: 8px; text-align: right;'>GST (9.0% CGST + 9.0% SGST):</td>
-                                        <td style='padding: 8px; text-align: right;'>₹{sum(p.get("calculations", {}).get("gst_amount", 0) for p in products if p.get("type") == "blanket"):,.2f}</td>
+                                        <td style='padding: 8px; text-align: right;'>₹{gst_breakdown['blankets']['gst']:,.2f}</td>
                                     </tr>
                                     ''' if any(p.get("type") == "blanket" for p in products) else ''}
                                     
                                     {f'''
                                     <tr>
                                         <td style='padding: 8px; text-align: right;'>GST (12.0%):</td>
-                                        <td style='padding: 8px; text-align: right;'>₹{sum(p.get("calculations", {}).get("gst_amount", 0) for p in products if p.get("type") == "mpack"):,.2f}</td>
+                                        <td style='padding: 8px; text-align: right;'>₹{gst_breakdown['mpacks']['gst']:,.2f}</td>
                                     </tr>
                                     ''' if any(p.get("type") == "mpack" for p in products) else ''}
                                     
                                     <tr style='border-top: 1px solid #dee2e6;'>
                                         <td style='padding: 8px; text-align: right; font-weight: bold;'>Total:</td>
-                                        <td style='padding: 8px; text-align: right; font-weight: bold;'>₹{sum(p.get("calculations", {}).get("final_total", 0) for p in products):,.2f}</td>
+                                        <td style='padding: 8px; text-align: right; font-weight: bold;'>₹{totals['total']:,.2f}</td>
                                     </tr>
                                 </tbody>
                             </table>
@@ -3509,8 +3724,8 @@ def send_quotation():
         </div>
         """
 
-        # Total is same as subtotal since amounts already include any taxes
-        total = subtotal
+        # Total already includes GST
+        total = totals['total']
         
 
         
@@ -3583,12 +3798,17 @@ def api_request_otp():
         if not email:
             return jsonify({'error': 'Email is required'}), 400
             
-        # Generate OTP
-        otp = str(random.randint(100000, 999999))
-        
-        # Store OTP in user session with proper expiry format
-        session['otp'] = otp
-        session['otp_expiry'] = (datetime.now() + timedelta(minutes=5)).isoformat()
+        if MONGO_AVAILABLE and USE_MONGO:
+            # One live code per email in otp_tokens; the TTL index reaps it
+            otp = issue_otp(email, PURPOSE_REGISTER, ttl_minutes=5)
+            session['otp_email'] = email.strip().lower()
+        else:
+            # Generate OTP
+            otp = str(random.randint(100000, 999999))
+            
+            # Store OTP in user session with proper expiry format
+            session['otp'] = otp
+            session['otp_expiry'] = (datetime.now() + timedelta(minutes=5)).isoformat()
         
         # Send OTP to email
         if email_config_valid:
@@ -3627,6 +3847,21 @@ def api_verify_otp():
         if not otp:
             return jsonify({'error': 'OTP is required'}), 400
             
+        if MONGO_AVAILABLE and USE_MONGO:
+            email = data.get('email') or session.get('otp_email')
+            if not email:
+                return jsonify({'error': 'No OTP requested. Please request OTP first.'}), 400
+            outcome = verify_otp(email, PURPOSE_REGISTER, str(otp), consume=True)
+            if outcome == OTP_EXPIRED:
+                return jsonify({'error': 'OTP has expired. Please request a new OTP.'}), 400
+            if outcome != OTP_OK:
+                return jsonify({'error': 'Invalid OTP'}), 401
+            session.pop('otp_email', None)
+            return jsonify({
+                'success': True,
+                'message': 'OTP verified successfully'
+            })
+            
         # Get stored OTP from session
         stored_otp = session.get('otp')
         otp_expiry = session.get('otp_expiry')
@@ -3678,41 +3913,13 @@ def api_register_complete():
 
         if MONGO_AVAILABLE and USE_MONGO:
             try:
-                # Check for existing user
-                existing_user = mu_find_user_by_email_or_username(email) or mu_find_user_by_email_or_username(username)
-                if existing_user:
+                # One insert; the unique indexes reject existing emails/usernames
+                try:
+                    doc = mu_create_user(email, username, password)
+                except ValueError:
                     print(f'Registration failed: User already exists with email/username: {email}/{username}')
                     return jsonify({'error': 'Email or username already exists'}), 400
-                
-                # Create user in MongoDB
-                print('Creating new user in MongoDB...')
-                print(f'User details - Email: {email}, Username: {username}')
-                
-                # Debug: Check if we can access the users collection
-                print(f'Users collection exists: {users_col is not None}')
-                if users_col is not None:
-                    print(f'Current users in DB: {users_col.count_documents({})}')
-                
-                # Create user and retrieve document
-                user_id = mu_create_user(email, username, password)
-                print(f'User created with ID: {user_id}')
-                
-                # Try to retrieve user document using both UUID and ObjectId formats
-                doc = mu_find_user_by_id(user_id)
-                if not doc:
-                    try:
-                        from bson import ObjectId
-                        doc = mu_find_user_by_id(ObjectId(user_id))
-                    except Exception as e:
-                        print(f"Error retrieving user document: {str(e)}")
-                        traceback.print_exc()
-                        return jsonify({'error': 'Failed to create user in database'}), 500
-                
-                print(f'Retrieved user document: {doc is not None}')
-                
-                if not doc:
-                    traceback.print_exc()
-                    return jsonify({'error': 'Failed to create user in database'}), 500
+                print(f'User created with ID: {doc["_id"]}')
                 
                 new_user = User(
                     id=str(doc['_id']),
@@ -3723,6 +3930,8 @@ def api_register_complete():
                     otp_verified=doc.get('otp_verified', False)
                 )
                 
+            except PasswordHashBusy:
+                return password_busy_response()
             except Exception as e:
                 print(f"❌ MongoDB Error: {str(e)}")
                 traceback.print_exc()
@@ -3730,18 +3939,15 @@ def api_register_complete():
         else:
             # Fallback to JSON storage
             print('Using JSON storage fallback')
-            users = load_users()
-            
             # Check for existing user
-            if any(u.email == email or u.username == username for u in users.values()):
+            if json_user_store.find_by_email(email) or json_user_store.find_by_username(username):
                 return jsonify({'error': 'Email or username already exists'}), 400
                 
             user_id = str(uuid.uuid4())
             new_user = User(user_id, email, username, password)
             new_user.set_password(password)
-            users[user_id] = new_user
             
-            if not save_users():
+            if not save_users({user_id: new_user}):
                 return jsonify({'error': 'Failed to save user data'}), 500
 
         # Auto-login the newly registered user
@@ -3759,6 +3965,8 @@ def api_register_complete():
             }
         })
         
+    except PasswordHashBusy:
+        return password_busy_response()
     except Exception as e:
         print(f"Registration error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -3880,6 +4088,8 @@ def api_login():
                 
                 return response
                 
+            except PasswordHashBusy:
+                return password_busy_response()
             except Exception as e:
                 print(f'MongoDB login error: {str(e)}')
                 import traceback
@@ -3888,47 +4098,20 @@ def api_login():
 
         # ---------------- JSON fallback path -----------------
         print('Falling back to JSON user storage')
-        global users
-        users = load_users()
-        
-        # Check if user exists in our loaded users
-        user = None
-        for user_id, u in users.items():
-            if u.email == identifier or u.username == identifier:
-                user = u
-                break
-                
-        if not user:
-            # If user not found in loaded users, try to load from file directly
-            try:
-                with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                    all_users = json.load(f)
-                
-                for user_id, user_data in all_users.items():
-                    if user_data.get('email') == identifier or user_data.get('username') == identifier:
-                        # Create User object from file data
-                        user = User(
-                            id=user_id,
-                            email=user_data['email'],
-                            username=user_data['username'],
-                            password_hash=user_data['password_hash'],
-                            is_verified=user_data.get('is_verified', False),
-                            otp_verified=user_data.get('otp_verified', False)
-                        )
-                        # Add to our users dictionary
-                        users[user_id] = user
-                        break
-            except Exception as e:
-                print(f"Error loading user from file: {str(e)}")
-                return jsonify({'error': 'Internal server error'}), 500
+        user = find_json_user(identifier)
                 
         if not user:
             print(f'User not found in JSON storage for identifier: {identifier}')
             return jsonify({'error': 'Invalid email/username or password'}), 401
             
-        if not user.check_password(password):
+        ok, new_hash = verify_and_rehash(user.password_hash, password)
+        if not ok:
             print('Password verification failed for JSON user')
             return jsonify({'error': 'Invalid email/username or password'}), 401
+        if new_hash:
+            # Hash made with older cost parameters; store the upgraded one
+            json_user_store.update(user.id, {'password_hash': new_hash})
+            user.password_hash = new_hash
             
         login_user(user)
         print(f'User {user.username} logged in successfully (JSON storage)')
@@ -3944,6 +4127,8 @@ def api_login():
             }
         })
         
+    except PasswordHashBusy:
+        return password_busy_response()
     except Exception as e:
         print(f"Unexpected login error: {str(e)}")
         import traceback
@@ -4045,8 +4230,9 @@ def mpacks():
     # If company_id is provided in the URL
     if company_id:
         # Try to get company info by ID
-        company_name = get_company_name_by_id(company_id)
-        company_email = get_company_email_by_id(company_id)
+        company = get_company(company_id) or {}
+        company_name = company.get('name', '')
+        company_email = company.get('email', '')
         
         # Update session with the selected company
         session['selected_company'] = {
@@ -4107,8 +4293,9 @@ def blankets():
     # If company_id is provided in the URL
     if company_id:
         # Try to get company info by ID
-        company_name = get_company_name_by_id(company_id)
-        company_email = get_company_email_by_id(company_id)
+        company = get_company(company_id) or {}
+        company_name = company.get('name', '')
+        company_email = company.get('email', '')
         
         # Update session with the selected company
         session['selected_company'] = {
@@ -4165,75 +4352,95 @@ def blankets():
 def reset_password_page():
     return render_template('reset_password.html')
 
-# Helper functions to get company name and email by ID
-def get_company_name_by_id(company_id):
-    """Get company name by ID.
-    Priority: MongoDB -> JSON fallback."""
-    try:
-        # Try MongoDB first
-        if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None:
-            try:
-                doc = mongo_db.companies.find_one({'_id': ObjectId(company_id)})
-            except Exception:
-                doc = mongo_db.companies.find_one({'_id': company_id})
-            if doc:
-                normalized = {k.lower().replace(' ', ''): v for k, v in doc.items()}
-                for key in ['name', 'companyname', 'company_name']:
-                    if key in normalized and normalized[key]:
-                        return normalized[key]
-        # Skip JSON fallback when MongoDB is enabled
-        if not (MONGO_AVAILABLE and USE_MONGO and mongo_db is not None):
-            # Fallback to JSON file lookup
-            file_path = os.path.join(app.root_path, 'static', 'data', 'company_emails.json')
-            with open(file_path, 'r') as f:
-                companies = json.load(f)
-                # Convert company_id to int if it's a string
-                try:
-                    idx = int(company_id) - 1
-                    if 0 <= idx < len(companies):
-                        return companies[idx].get('Company Name', '')
-                except (ValueError, TypeError):
-                    # If company_id is not a number, try to find by exact match in ID field
-                    for company in companies:
-                        if str(company.get('id', '')).lower() == str(company_id).lower():
-                            return company.get('Company Name', '')
+# Company name and email by id, for the company_required, cart and quotation paths
+company_cache = register_cache(TTLCache(
+    maxsize=int(os.getenv('COMPANY_CACHE_SIZE', 2048)),
+    ttl=float(os.getenv('COMPANY_CACHE_TTL', 600)),
+    name='companies'
+))
+
+# Legacy documents spell the fields differently; keys are lowercased with spaces removed
+_COMPANY_NAME_KEYS = ('name', 'companyname', 'company_name')
+_COMPANY_EMAIL_KEYS = ('email', 'emailid', 'email_id')
+_COMPANY_PROJECTION = {'Company Name': 1, 'EmailID': 1, 'name': 1, 'email': 1,
+                       'company_name': 1, 'email_id': 1}
+_company_emails_file = None  # (mtime_ns, companies) for JSON mode
+
+
+def invalidate_cached_company(company_id=None):
+    """Drop one company (or all of them) from the get_company cache after a write."""
+    if company_id is None:
+        company_cache.clear()
+    else:
+        company_cache.invalidate(str(company_id))
 
-    except Exception as e:
-        app.logger.error(f"Error getting company name: {e}")
+
+# Writes from other processes reach us as directory refreshes
+company_directory.on_refresh(lambda snapshot: invalidate_cached_company())
+
+
+def _first_field(doc, keys):
+    normalized = {k.lower().replace(' ', ''): v for k, v in doc.items()}
+    for key in keys:
+        if normalized.get(key):
+            return str(normalized[key])
     return ''
 
-def get_company_email_by_id(company_id):
-    """Get company email by ID.
-    Priority: MongoDB -> JSON fallback."""
+
+def _find_json_company(company_id):
+    """Look a company up in company_emails.json, re-reading it only when it changes."""
+    global _company_emails_file
+    file_path = os.path.join(app.root_path, 'static', 'data', 'company_emails.json')
+    mtime = os.stat(file_path).st_mtime_ns
+    if _company_emails_file is None or _company_emails_file[0] != mtime:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            _company_emails_file = (mtime, json.load(f) or [])
+    companies = _company_emails_file[1]
+    try:
+        # Numeric ids are 1-based positions in the file
+        idx = int(company_id) - 1
+        return companies[idx] if 0 <= idx < len(companies) else None
+    except (ValueError, TypeError):
+        for company in companies:
+            if str(company.get('id', '')).lower() == str(company_id).lower():
+                return company
+    return None
+
+
+def get_company(company_id):
+    """Return {'id', 'name', 'email'} for a company id, or None if it is unknown.
+
+    Results are cached; MongoDB is asked once, with the ObjectId and string
+    forms of the id in the same query and only the name/email fields projected.
+    """
+    if not company_id:
+        return None
+    key = str(company_id)
+    company = company_cache.get(key)
+    if company is not None:
+        return company
     try:
         if MONGO_AVAILABLE and USE_MONGO and mongo_db is not None:
-            try:
-                doc = mongo_db.companies.find_one({'_id': ObjectId(company_id)})
-            except Exception:
-                doc = mongo_db.companies.find_one({'_id': company_id})
-            if doc:
-                normalized = {k.lower().replace(' ', ''): v for k, v in doc.items()}
-                for key in ['email', 'emailid', 'email_id', 'emailid']:
-                    if key in normalized and normalized[key]:
-                        return normalized[key]
-        # Skip JSON fallback when MongoDB is enabled
-        if not (MONGO_AVAILABLE and USE_MONGO and mongo_db is not None):
-            file_path = os.path.join(app.root_path, 'static', 'data', 'company_emails.json')
-            with open(file_path, 'r') as f:
-                companies = json.load(f)
-                # Convert company_id to int if it's a string
-                try:
-                    idx = int(company_id) - 1
-                    if 0 <= idx < len(companies):
-                        return companies[idx].get('EmailID', '')
-                except (ValueError, TypeError):
-                    # If company_id is not a number, try to find by exact match in ID field
-                    for company in companies:
-                        if str(company.get('id', '')).lower() == str(company_id).lower():
-                            return company.get('EmailID', '')
+            ids = [key]
+            if ObjectId.is_valid(key):
+                ids.insert(0, ObjectId(key))
+            doc = mongo_db.companies.find_one({'_id': {'$in': ids}}, _COMPANY_PROJECTION)
+        else:
+            doc = _find_json_company(key)
+    except FileNotFoundError:
+        return None
     except Exception as e:
-        app.logger.error(f"Error getting company email: {e}")
-        return ''
+        app.logger.error(f"Error getting company {key}: {e}")
+        return None
+    if not doc:
+        return None
+    company = {
+        'id': key,
+        'name': _first_field(doc, _COMPANY_NAME_KEYS),
+        'email': _first_field(doc, _COMPANY_EMAIL_KEYS),
+    }
+    company_cache.set(key, company)
+    return company
 
 # Error handling
 @app.errorhandler(404)
@@ -4247,10 +4454,3 @@ if __name__ == '__main__':
         serve(app, host="0.0.0.0", port=port)
     else:
         app.run(host='0.0.0.0', port=port, debug=True)
-
-# Initialize users dictionary after all function definitions
-if USE_MONGO:
-    users = {}
-else:
-    users = load_users()
-    print(f"Loaded {len(users)} users from file")
@@ -0,0 +1,100 @@
+"""
+Benchmark worker boot time against the size of the users collection.
+
+Seeds a scratch database with growing numbers of users and, at each size,
+times `import app` in a fresh interpreter pointed at that database (which is
+what every gunicorn worker does before it can serve). Boot time must stay
+under --budget seconds at every size and must not grow with the user count;
+the script exits non-zero if either check fails.
+
+    MONGO_URI=mongodb+srv://... python benchmarks/bench_startup.py --users 0,10000,100000
+
+The scratch database (BENCH_DB_NAME, default "bench_startup") is dropped at
+the end.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+BOOT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+def seed_to(col, count, batch_size=10000):
+    """Top the collection up to ``count`` users."""
+    start = col.estimated_document_count()
+    for first in range(start, count, batch_size):
+        col.insert_many([
+            {
+                "email": f"user{i}@example.com",
+                "username": f"User{i}",
+                "username_lower": f"user{i}",
+                "password_hash": "x",
+            }
+            for i in range(first, min(first + batch_size, count))
+        ], ordered=False)
+
+
+def boot_seconds(db_name):
+    env = dict(os.environ, DB_NAME=db_name, USE_MONGO="true")
+    result = subprocess.run(
+        [sys.executable, "-c", BOOT_SNIPPET],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", default="0,10000,100000",
+                        help="comma-separated collection sizes to boot against")
+    parser.add_argument("--runs", type=int, default=3, help="boots per size (median is reported)")
+    parser.add_argument("--budget", type=float, default=5.0, help="maximum boot time in seconds")
+    parser.add_argument("--growth", type=float, default=1.5,
+                        help="maximum ratio between the slowest and fastest size")
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv("MONGO_URI")
+    if not mongo_uri:
+        print("❌ Error: MONGO_URI environment variable not set")
+        sys.exit(1)
+
+    sizes = sorted(int(n) for n in args.users.split(","))
+    client = MongoClient(mongo_uri)
+    db_name = os.getenv("BENCH_DB_NAME", "bench_startup")
+    client.drop_database(db_name)
+    col = client[db_name]["users"]
+
+    medians = {}
+    try:
+        for size in sizes:
+            seed_to(col, size)
+            medians[size] = statistics.median(boot_seconds(db_name) for _ in range(args.runs))
+            print(f"{size:>9} users: boot {medians[size]:.2f} s")
+    finally:
+        client.drop_database(db_name)
+
+    failed = False
+    slowest = max(medians.values())
+    if slowest > args.budget:
+        print(f"❌ Boot took {slowest:.2f} s, over the {args.budget:.2f} s budget")
+        failed = True
+    fastest = min(medians.values())
+    if fastest > 0 and slowest / fastest > args.growth:
+        print(f"❌ Boot time grows with user count ({slowest / fastest:.2f}x)")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("✅ Boot time is within budget and independent of user count")
+
+
+if __name__ == "__main__":
+    main()
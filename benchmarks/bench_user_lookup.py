@@ -0,0 +1,121 @@
+"""
+Benchmark user lookup: anchored case-insensitive regex vs indexed equality.
+
+Seeds a scratch database with N users (default 100,000) carrying the same
+indexes as mongo_users.init_mongo_connection, then times random lookups with
+the old regex query and the normalized equality query used now. Prints
+latency percentiles and the winning plan stage of each query.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/bench_user_lookup.py --users 100000
+
+The scratch database (BENCH_DB_NAME, default "bench_user_lookup") is dropped
+at the end.
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mongo_users import normalize_identifier  # noqa: E402
+
+load_dotenv()
+
+
+def regex_query(ident):
+    ident = ident.strip()
+    return {"$or": [
+        {"email": {"$regex": f"^{re.escape(ident)}$", "$options": "i"}},
+        {"username": {"$regex": f"^{re.escape(ident)}$", "$options": "i"}},
+    ]}
+
+
+def equality_query(ident):
+    key = normalize_identifier(ident)
+    return {"$or": [{"email": key}, {"username_lower": key}]}
+
+
+def seed(col, count, batch_size=10000):
+    col.create_index("email", unique=True)
+    col.create_index("username", unique=True)
+    col.create_index("username_lower", unique=True)
+    for start in range(0, count, batch_size):
+        col.insert_many([
+            {
+                "email": f"user{i}@example.com",
+                "username": f"User{i}",
+                "username_lower": f"user{i}",
+                "password_hash": "x",
+            }
+            for i in range(start, min(start + batch_size, count))
+        ], ordered=False)
+
+
+def winning_stages(plan):
+    """Flatten the stage names of a winning plan, e.g. ['FETCH', 'OR', 'IXSCAN', ...]."""
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += winning_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += winning_stages(child)
+    return [s for s in stages if s]
+
+
+def time_lookups(col, build_query, identifiers):
+    samples = []
+    for ident in identifiers:
+        start = time.perf_counter()
+        col.find_one(build_query(ident))
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[int(len(samples) * 0.95) - 1],
+        "mean": statistics.fmean(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv("MONGO_URI")
+    if not mongo_uri:
+        print("❌ Error: MONGO_URI environment variable not set")
+        sys.exit(1)
+
+    client = MongoClient(mongo_uri)
+    db_name = os.getenv("BENCH_DB_NAME", "bench_user_lookup")
+    client.drop_database(db_name)
+    col = client[db_name]["users"]
+
+    try:
+        print(f"Seeding {args.users} users into {db_name}.users ...")
+        seed(col, args.users)
+
+        # Mix of email and username lookups in arbitrary case
+        identifiers = []
+        for _ in range(args.lookups):
+            i = random.randrange(args.users)
+            identifiers.append(random.choice([f"User{i}@Example.com", f"USER{i}", f"user{i}"]))
+
+        for name, build in (("regex", regex_query), ("equality", equality_query)):
+            plan = col.find(build(identifiers[0])).explain()["queryPlanner"]["winningPlan"]
+            stats = time_lookups(col, build, identifiers)
+            print(f"{name:>9}: p50 {stats['p50']:.2f} ms  p95 {stats['p95']:.2f} ms  "
+                  f"mean {stats['mean']:.2f} ms  plan {'/'.join(winning_stages(plan))}")
+    finally:
+        client.drop_database(db_name)
+
+
+if __name__ == "__main__":
+    main()
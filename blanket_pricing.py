@@ -0,0 +1,103 @@
+"""Precomputed blanket price matrix.
+
+The blanket catalog (``blankets.json`` rates and ``bar.json`` bar rates) is
+small and fixed, so it is folded once at startup into dense coefficient
+arrays.  Pricing a blanket of any size is then two multiplies and an add:
+
+    base_price = length * width * coefficient[product, length unit, basis]
+    unit_price = base_price + bar_rate[bar]
+
+where each coefficient already includes the squared length-unit conversion
+(mm, m or in) and the per-square-metre or per-square-yard rate.
+"""
+import json
+import math
+import os
+from array import array
+from typing import Any, Dict, Optional
+
+# Metres per length unit accepted by the blanket form
+LENGTH_UNITS = {'mm': 0.001, 'm': 1.0, 'in': 0.0254}
+UNIT_INDEX = {unit: i for i, unit in enumerate(LENGTH_UNITS)}
+
+# Square metres per square yard
+SQ_M_PER_SQ_YARD = 0.83612736
+
+# Rate bases: the catalog carries both a metric and an imperial rate
+RATE_BASES = ('sqm', 'sqyd')
+
+
+class BlanketPriceMatrix:
+    """Dense product x length-unit x rate-basis coefficients plus bar rates."""
+
+    def __init__(self, products, bars):
+        self.product_ids = {}
+        self.product_names = {}
+        self.products = []
+        n_cells = len(LENGTH_UNITS) * len(RATE_BASES)
+        self.coefficients = array('d', [math.nan] * (len(products) * n_cells))
+        for row, product in enumerate(products):
+            self.products.append({'id': product.get('id'), 'name': product.get('name', '')})
+            self.product_ids[str(product.get('id'))] = row
+            self.product_names[str(product.get('name', '')).strip().lower()] = row
+
+            rate_sqm = product.get('ratePerSqMt') or product.get('base_rate')
+            rate_sqyd = product.get('ratePerSqYard')
+            for u, metres in enumerate(LENGTH_UNITS.values()):
+                sq_m = metres * metres
+                base = (row * len(LENGTH_UNITS) + u) * len(RATE_BASES)
+                if rate_sqm is not None:
+                    self.coefficients[base] = float(rate_sqm) * sq_m
+                if rate_sqyd is not None:
+                    self.coefficients[base + 1] = float(rate_sqyd) * sq_m / SQ_M_PER_SQ_YARD
+
+        self.bar_index = {}
+        self.bar_rates = array('d')
+        for bar in bars:
+            rate = bar.get('barRate')
+            self.bar_index[str(bar.get('bar', '')).strip().lower()] = len(self.bar_rates)
+            self.bar_rates.append(math.nan if rate is None else float(rate))
+
+    @classmethod
+    def from_catalog(cls, catalog_dir: str) -> 'BlanketPriceMatrix':
+        """Build the matrix from ``blankets.json`` and ``bar.json`` in ``catalog_dir``."""
+        with open(os.path.join(catalog_dir, 'blankets.json'), 'r', encoding='utf-8') as f:
+            products = json.load(f).get('products', [])
+        with open(os.path.join(catalog_dir, 'bar.json'), 'r', encoding='utf-8') as f:
+            bars = json.load(f).get('bars', [])
+        return cls(products, bars)
+
+    def _row(self, product_id=None, name=None) -> Optional[int]:
+        if product_id is not None:
+            return self.product_ids.get(str(product_id))
+        if name:
+            return self.product_names.get(str(name).strip().lower())
+        return None
+
+    def bar_rate(self, bar_type) -> Optional[float]:
+        """Per-piece bar rate, or None for unknown / unpriced bars."""
+        idx = self.bar_index.get(str(bar_type or '').strip().lower())
+        if idx is None or math.isnan(self.bar_rates[idx]):
+            return None
+        return self.bar_rates[idx]
+
+    def quote(self, length, width, unit='mm', product_id=None, name=None,
+              bar_type=None, basis='sqm') -> Optional[Dict[str, Any]]:
+        """Price one blanket; returns None if the product, unit or rate is unknown."""
+        row = self._row(product_id, name)
+        if row is None or unit not in LENGTH_UNITS or basis not in RATE_BASES:
+            return None
+        cell = (row * len(LENGTH_UNITS) + UNIT_INDEX[unit]) * len(RATE_BASES)
+        coefficient = self.coefficients[cell + RATE_BASES.index(basis)]
+        if math.isnan(coefficient):
+            return None
+
+        base_price = float(length) * float(width) * coefficient
+        bar_price = self.bar_rate(bar_type) if bar_type else 0.0
+        return {
+            'product': self.products[row],
+            'base_price': round(base_price, 2),
+            'bar_price': bar_price,
+            'unit_price': round(base_price + (bar_price or 0.0), 2),
+            'basis': basis,
+        }
@@ -0,0 +1,182 @@
+"""Process-local snapshot of the company directory.
+
+The company list is read on almost every page (dropdowns, typeahead), but it
+changes only when someone adds or edits a company.  ``CompanyDirectory`` keeps
+one immutable snapshot per process: the mapped company list sorted by
+(name, id), an id index and the list pre-serialized to JSON bytes.  A refresh builds a complete new
+snapshot and swaps it in with a single assignment, so readers never see a
+half-built directory and never wait on the database.
+
+Refreshes are driven by ``watch`` (a blocking callable that invokes its
+callback whenever the source changes, e.g. over a MongoDB change stream) when
+it is available, and otherwise by polling ``signature`` (a cheap change token
+such as ``max(updated_at)``) every ``poll_interval`` seconds.  Writers in this
+process can call :meth:`refresh` directly to see their change immediately.
+Threads that find no snapshot yet (right after boot) share a single load
+through ``single_flight`` rather than each reloading in turn.
+"""
+import bisect
+import gzip
+import hashlib
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def sort_key(company: Dict[str, Any]) -> Tuple[str, str]:
+    """Directory order: by name, ties broken by id so pagination cursors are stable."""
+    return (str(company.get('name') or ''), str(company.get('id')))
+
+
+class CompanySnapshot:
+    """One immutable version of the directory."""
+
+    __slots__ = ('companies', 'keys', 'by_id', 'json_bytes', 'etag', 'loaded_at', '_gzip_bytes')
+
+    def __init__(self, companies: List[Dict[str, Any]], serialize: Callable[[List[Dict[str, Any]]], bytes]):
+        # Loaders already return name order, which makes this sort linear
+        self.companies = sorted(companies, key=sort_key)
+        self.keys = [sort_key(c) for c in self.companies]
+        self.by_id = {str(c.get('id')): c for c in self.companies}
+        self.json_bytes = serialize(self.companies)
+        self.etag = 'companies-%s' % hashlib.sha1(self.json_bytes).hexdigest()[:16]
+        self.loaded_at = time.time()
+        self._gzip_bytes = None
+
+    def page(self, after: Optional[Tuple[str, str]], limit: int) -> List[Dict[str, Any]]:
+        """Up to ``limit`` companies following the ``sort_key`` ``after`` (None: from the start)."""
+        start = bisect.bisect_right(self.keys, tuple(after)) if after is not None else 0
+        return self.companies[start:start + limit]
+
+    def gzip_bytes(self) -> bytes:
+        """``json_bytes`` gzip-compressed, computed on first use."""
+        if self._gzip_bytes is None:
+            self._gzip_bytes = gzip.compress(self.json_bytes, 6)
+        return self._gzip_bytes
+
+
+class CompanyDirectory:
+    """Company list served from memory and refreshed when the source changes."""
+
+    def __init__(self, load: Callable[[], List[Dict[str, Any]]],
+                 serialize: Callable[[List[Dict[str, Any]]], bytes],
+                 signature: Optional[Callable[[], Any]] = None,
+                 watch: Optional[Callable[[Callable[[], Any]], None]] = None,
+                 poll_interval: float = 30.0, single_flight=None):
+        self._load = load
+        self._serialize = serialize
+        self._signature = signature
+        self._watch = watch
+        self.poll_interval = poll_interval
+        self._single_flight = single_flight
+        self._snapshot: Optional[CompanySnapshot] = None
+        self._last_signature = None
+        self._refresh_lock = threading.Lock()
+        self._started = False
+        self._listeners: List[Callable[[CompanySnapshot], None]] = []
+        self.refreshes = 0
+        self.failures = 0
+
+    # -- Reads ---------------------------------------------------------------
+
+    def snapshot(self) -> CompanySnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self._single_flight.do('company_directory', self.refresh) \
+                if self._single_flight is not None else self.refresh()
+        self._ensure_started()
+        return snapshot
+
+    def companies(self) -> List[Dict[str, Any]]:
+        return self.snapshot().companies
+
+    def get(self, company_id: Any) -> Optional[Dict[str, Any]]:
+        return self.snapshot().by_id.get(str(company_id))
+
+    # -- Refresh -------------------------------------------------------------
+
+    def on_refresh(self, listener: Callable[[CompanySnapshot], None]) -> Callable[[CompanySnapshot], None]:
+        """Call ``listener`` with every new snapshot (e.g. to rebuild a search index).
+
+        Listeners run under the refresh lock, one snapshot at a time and in
+        order; they must not call :meth:`refresh` themselves.
+        """
+        with self._refresh_lock:
+            self._listeners.append(listener)
+            if self._snapshot is not None:
+                listener(self._snapshot)
+        return listener
+
+    def refresh(self) -> CompanySnapshot:
+        """Reload from the source and swap the new snapshot in.
+
+        If the load fails the previous snapshot stays in place (and is
+        returned) and the signature is not recorded, so the next poll tries
+        again.  With no previous snapshot the error propagates.
+        """
+        with self._refresh_lock:
+            signature = self._read_signature()
+            try:
+                snapshot = CompanySnapshot(self._load(), self._serialize)
+            except Exception as e:
+                self.failures += 1
+                if self._snapshot is None:
+                    raise
+                print(f"Company directory refresh failed, keeping the previous snapshot: {e}")
+                return self._snapshot
+            self._snapshot = snapshot
+            self._last_signature = signature
+            self.refreshes += 1
+            # Still under the lock, so overlapping refreshes reach listeners
+            # in the order their snapshots were installed
+            for listener in self._listeners:
+                try:
+                    listener(snapshot)
+                except Exception as e:
+                    print(f"Company directory listener failed: {e}")
+        return snapshot
+
+    def _read_signature(self):
+        if self._signature is None:
+            return None
+        try:
+            return self._signature()
+        except Exception as e:
+            print(f"Could not read company directory signature: {e}")
+            return None
+
+    def _ensure_started(self) -> None:
+        # Started lazily so each forked worker gets its own thread and connection use
+        if self._started or (self._watch is None and self._signature is None):
+            return
+        with self._refresh_lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, name='company-directory', daemon=True).start()
+
+    def _run(self) -> None:
+        if self._watch is not None:
+            try:
+                while True:
+                    self._watch(self.refresh)
+            except Exception as e:
+                print(f"Company change stream unavailable ({e}); polling every {self.poll_interval}s")
+        while self._signature is not None:
+            time.sleep(self.poll_interval)
+            signature = self._read_signature()
+            if signature is not None and signature != self._last_signature:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Company directory refresh failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            'companies': len(snapshot.companies) if snapshot else 0,
+            'bytes': len(snapshot.json_bytes) if snapshot else 0,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'age_seconds': round(time.time() - snapshot.loaded_at, 1) if snapshot else None,
+        }
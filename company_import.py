@@ -0,0 +1,321 @@
+"""
+Bulk import of companies from CSV, JSON or JSON Lines.
+
+Records are read as a stream and written in chunks with unordered
+``insert_many``.  Each company gets ``name_key`` and ``email_key`` fields:
+SHA-1 digests of its normalized name (case-folded, whitespace collapsed) and
+lowercased email.  Unique indexes on those keys do the duplicate detection, so
+a chunk is one round trip however many of its rows already exist, and rows
+that collide (with stored companies or with each other) are counted as
+duplicates instead of failing the import.
+
+    python company_import.py customers.csv --chunk-size 2000
+
+The same import backs ``POST /api/companies/import``.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import unicodedata
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DEFAULT_CHUNK_SIZE = 1000
+DUPLICATE_KEY = 11000
+
+# Column spellings accepted for each field, compared lowercased without spaces/underscores
+NAME_COLUMNS = ('companyname', 'name', 'company')
+EMAIL_COLUMNS = ('emailid', 'email', 'companyemail')
+
+
+def normalize_company_name(name: Any) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', str(name or '')).casefold().split())
+
+
+def normalize_company_email(email: Any) -> str:
+    return str(email or '').strip().lower()
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def company_keys(name: Any, email: Any) -> Dict[str, str]:
+    """``name_key``/``email_key`` for a company; a blank email gets no key."""
+    keys = {}
+    name = normalize_company_name(name)
+    if name:
+        keys['name_key'] = _digest(name)
+    email = normalize_company_email(email)
+    if email:
+        keys['email_key'] = _digest(email)
+    return keys
+
+
+def ensure_company_key_indexes(col) -> None:
+    """Unique indexes on the normalized keys.
+
+    Partial, so companies written before the keys existed (and companies
+    without an email) do not all collide on a missing value.
+    """
+    for field in ('name_key', 'email_key'):
+        col.create_index(field, unique=True, name=f'companies_{field}',
+                         partialFilterExpression={field: {'$type': 'string'}})
+
+
+def backfill_company_keys(col, batch_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, int]:
+    """Add keys to companies stored without them.
+
+    Companies whose keys collide with another company's, or whose name or
+    email normalizes to nothing, are left unkeyed and marked
+    ``key_backfill_failed`` (counted as ``conflicts``/``blank``) so later runs
+    skip them instead of retrying every time.  Unset the flag after cleaning
+    them up to have them keyed on the next run.
+    """
+    updated = conflicts = blank = 0
+    ops: List[UpdateOne] = []
+    op_ids: List[Any] = []
+
+    def flush():
+        nonlocal updated, conflicts
+        if not ops:
+            return
+        failed = set()
+        try:
+            updated += col.bulk_write(ops, ordered=False).modified_count
+        except BulkWriteError as e:
+            updated += e.details.get('nModified', 0)
+            for err in e.details.get('writeErrors', []):
+                if err.get('code') == DUPLICATE_KEY:
+                    failed.add(op_ids[err['index']])
+            conflicts += len(failed)
+        if failed:
+            col.update_many({'_id': {'$in': list(failed)}}, {'$set': {'key_backfill_failed': True}})
+        ops.clear()
+        op_ids.clear()
+
+    missing = {
+        'key_backfill_failed': {'$exists': False},
+        # A blank email never gets an email_key, so only ask for one when there is an email
+        '$or': [{'name_key': {'$exists': False}},
+                {'email_key': {'$exists': False}, 'EmailID': {'$nin': ['', None]}}],
+    }
+    for doc in col.find(missing, {'Company Name': 1, 'EmailID': 1, 'name_key': 1, 'email_key': 1}):
+        keys = company_keys(doc.get('Company Name'), doc.get('EmailID'))
+        # One update per key, so a clash on one key still stores the other
+        for field, value in keys.items():
+            if field not in doc:
+                ops.append(UpdateOne({'_id': doc['_id'], field: {'$exists': False}}, {'$set': {field: value}}))
+                op_ids.append(doc['_id'])
+        if 'name_key' not in keys or (doc.get('EmailID') and 'email_key' not in keys):
+            # Name (or a non-empty email) that normalizes to nothing
+            blank += 1
+            col.update_one({'_id': doc['_id']}, {'$set': {'key_backfill_failed': True}})
+        if len(ops) >= batch_size:
+            flush()
+    flush()
+    return {'updated': updated, 'conflicts': conflicts, 'blank': blank}
+
+
+# -- Readers -----------------------------------------------------------------
+
+def _column(record: Dict[str, Any], names) -> Any:
+    for key, value in record.items():
+        if str(key).lower().replace(' ', '').replace('_', '') in names:
+            return value
+    return None
+
+
+def read_csv(stream: TextIO) -> Iterator[Dict[str, Any]]:
+    yield from csv.DictReader(stream)
+
+
+def read_json(stream: TextIO, buffer_size: int = 1 << 16) -> Iterator[Dict[str, Any]]:
+    """Objects from a JSON array or JSON Lines, decoded one at a time.
+
+    Only a buffer's worth of input is held in memory.  A ``{"companies": [...]}``
+    document is also accepted, but is necessarily parsed whole.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    while True:
+        # Separators between top-level objects: whitespace, commas, array brackets, a BOM
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,[]\ufeff':
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                return
+            buffer, pos = stream.read(buffer_size), 0
+            eof = not buffer
+            continue
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError(f"Invalid JSON near: {buffer[pos:pos + 80]!r}")
+            # The object runs past the buffer; read more and decode it again
+            chunk = stream.read(buffer_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        pos = end
+        if isinstance(value, dict) and isinstance(value.get('companies'), list):
+            yield from value['companies']
+        elif isinstance(value, dict):
+            yield value
+        else:
+            raise ValueError("Expected JSON objects describing companies")
+
+
+def read_records(stream: TextIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    """Records from ``stream``; ``fmt`` is 'csv', 'json' or 'jsonl'."""
+    if fmt == 'csv':
+        return read_csv(stream)
+    if fmt in ('json', 'jsonl', 'ndjson'):
+        return read_json(stream)
+    raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def detect_format(filename: str, default: str = 'json') -> str:
+    ext = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return ext if ext in ('csv', 'json', 'jsonl', 'ndjson') else default
+
+
+def _chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# -- Import ------------------------------------------------------------------
+
+def company_document(record: Dict[str, Any], created_by: Optional[str], now: datetime) -> Optional[Dict[str, Any]]:
+    """Company document for an input record, or None if it has no name."""
+    name = ' '.join(str(_column(record, NAME_COLUMNS) or '').split())
+    if not name:
+        return None
+    email = normalize_company_email(_column(record, EMAIL_COLUMNS))
+    doc = {
+        'Company Name': name,
+        'EmailID': email,
+        'created_at': now,
+        'updated_at': now,
+        'created_by': created_by,
+        **company_keys(name, email),
+    }
+    # Keep ids from mongoexport dumps so references to them stay valid
+    oid = record.get('_id')
+    oid = oid.get('$oid') if isinstance(oid, dict) else oid
+    if oid and ObjectId.is_valid(str(oid)):
+        doc['_id'] = ObjectId(str(oid))
+    return doc
+
+
+def import_companies(col, records: Iterable[Dict[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     created_by: Optional[str] = None,
+                     on_chunk: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Insert ``records`` into ``col`` in unordered chunks, skipping duplicates.
+
+    ``on_chunk`` receives a report per chunk (rows read, inserted, duplicates,
+    invalid, seconds and rows per second).  Returns the totals.  Expects
+    :func:`ensure_company_key_indexes` to have been run on ``col``.
+    """
+    # Give legacy companies keys first, or their duplicates would slip through
+    backfill = backfill_company_keys(col)
+    totals = {'chunks': 0, 'read': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0, 'errors': 0}
+    started = time.perf_counter()
+    for number, chunk in enumerate(_chunks(records, chunk_size), 1):
+        chunk_started = time.perf_counter()
+        now = datetime.utcnow()
+        docs = []
+        invalid = 0
+        for record in chunk:
+            doc = company_document(record, created_by, now) if isinstance(record, dict) else None
+            if doc is None:
+                invalid += 1
+            else:
+                docs.append(doc)
+        inserted = duplicates = errors = 0
+        if docs:
+            try:
+                inserted = len(col.insert_many(docs, ordered=False).inserted_ids)
+            except BulkWriteError as e:
+                inserted = e.details.get('nInserted', 0)
+                for err in e.details.get('writeErrors', []):
+                    if err.get('code') == DUPLICATE_KEY:
+                        duplicates += 1
+                    else:
+                        errors += 1
+        seconds = time.perf_counter() - chunk_started
+        report = {
+            'chunk': number, 'read': len(chunk), 'inserted': inserted, 'duplicates': duplicates,
+            'invalid': invalid, 'errors': errors, 'seconds': round(seconds, 3),
+            'rows_per_second': round(len(chunk) / seconds) if seconds else None,
+        }
+        totals['chunks'] = number
+        for key in ('read', 'inserted', 'duplicates', 'invalid', 'errors'):
+            totals[key] += report[key]
+        if on_chunk:
+            on_chunk(report)
+    seconds = time.perf_counter() - started
+    return {
+        **totals,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(totals['read'] / seconds) if seconds else None,
+        'backfill': backfill,
+    }
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Bulk import companies from CSV, JSON or JSON Lines.")
+    parser.add_argument('path', help="file to import ('-' for stdin)")
+    parser.add_argument('--format', choices=('csv', 'json', 'jsonl'),
+                        help="input format (default: from the file extension)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="rows per insert_many")
+    parser.add_argument('--created-by', help="user id recorded on the imported companies")
+    args = parser.parse_args()
+
+    load_dotenv()
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        print("❌ Error: MONGO_URI environment variable not set")
+        sys.exit(1)
+    col = MongoClient(mongo_uri)[os.getenv('DB_NAME', 'comp')]['companies']
+    ensure_company_key_indexes(col)
+
+    fmt = args.format or detect_format(args.path)
+    stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig') if args.path == '-' \
+        else open(args.path, 'r', encoding='utf-8-sig', newline='')
+    with stream:
+        summary = import_companies(
+            col, read_records(stream, fmt), chunk_size=args.chunk_size, created_by=args.created_by,
+            on_chunk=lambda r: print(f"chunk {r['chunk']:>5}: {r['read']} read, {r['inserted']} inserted, "
+                                     f"{r['duplicates']} duplicates, {r['invalid']} invalid "
+                                     f"({r['rows_per_second']} rows/s)")
+        )
+    print(f"✅ Imported {summary['inserted']} of {summary['read']} companies in {summary['seconds']} s "
+          f"({summary['duplicates']} duplicates, {summary['invalid']} invalid, {summary['errors']} errors)")
+    if summary['backfill']['conflicts']:
+        print(f"⚠️ {summary['backfill']['conflicts']} existing companies share a name or email with another "
+              f"company and were left without keys")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""In-memory typeahead index over company names and emails.
+
+Three kinds of postings are kept per company:
+
+* name prefixes -- prefixes of the whole normalized name, for "starts with";
+* word prefixes -- every prefix of each word in the name and email, so
+  "grap hou" finds "GRAPHICS HOUSE" and "gmail" finds by email domain;
+* trigrams of the normalized name and email, so substrings and small typos
+  ("grahpics") still find candidates.
+
+Prefixes are indexed up to ``MAX_PREFIX`` characters; longer query words are
+looked up by that prefix and then checked against the full words.  A query
+fills its top ``k`` tier by tier (name prefix, then all-words prefix, then
+trigram overlap).  Within a tier companies are ranked by a static key (shorter
+names first), and the ordered posting lists are cached per prefix, so
+typeahead queries stop as soon as ``k`` results are found instead of scoring
+every match.
+
+The index follows the company directory through :meth:`sync`, which only
+touches companies that were added, removed or changed.
+"""
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+MAX_PREFIX = 12
+# Trigrams shared by more than this share of companies carry no signal
+COMMON_TRIGRAM_SHARE = 0.1
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text: Any) -> str:
+    return ' '.join(_WORD.findall(str(text or '').lower()))
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CompanySearchIndex:
+    """Prefix and trigram postings keyed by company id."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._names: Dict[str, str] = {}
+        self._words: Dict[str, Tuple[str, ...]] = {}
+        self._rank: Dict[str, Tuple] = {}
+        self._keys: Dict[str, Dict[str, Set[str]]] = {}
+        self._postings: Dict[str, Dict[str, Set[str]]] = {
+            'name': defaultdict(set), 'word': defaultdict(set), 'gram': defaultdict(set)
+        }
+        self._ordered_cache: Dict[Tuple[str, str], List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    # -- Maintenance ---------------------------------------------------------
+
+    @staticmethod
+    def _index_keys(name: str, email: str) -> Dict[str, Set[str]]:
+        text = f'{name} {email}'.strip()
+        return {
+            'name': {name[:n] for n in range(1, min(len(name), MAX_PREFIX) + 1)},
+            'word': {word[:n] for word in text.split() for n in range(1, min(len(word), MAX_PREFIX) + 1)},
+            'gram': trigrams(text),
+        }
+
+    def _add(self, company_id: str, company: Dict[str, Any]) -> None:
+        name = normalize(company.get('name'))
+        email = normalize(company.get('email'))
+        keys = self._index_keys(name, email)
+        for kind, kind_keys in keys.items():
+            postings = self._postings[kind]
+            for key in kind_keys:
+                postings[key].add(company_id)
+                self._ordered_cache.pop((kind, key), None)
+        self._docs[company_id] = company
+        self._names[company_id] = name
+        self._words[company_id] = tuple(f'{name} {email}'.split())
+        self._rank[company_id] = (len(name), name, company_id)
+        self._keys[company_id] = keys
+
+    def _remove(self, company_id: str) -> None:
+        keys = self._keys.pop(company_id, {})
+        for kind, kind_keys in keys.items():
+            postings = self._postings[kind]
+            for key in kind_keys:
+                ids = postings.get(key)
+                if ids is not None:
+                    ids.discard(company_id)
+                    if not ids:
+                        del postings[key]
+                self._ordered_cache.pop((kind, key), None)
+        self._docs.pop(company_id, None)
+        self._names.pop(company_id, None)
+        self._words.pop(company_id, None)
+        self._rank.pop(company_id, None)
+
+    def sync(self, companies: Iterable[Dict[str, Any]]) -> None:
+        """Bring the index in line with ``companies``, re-indexing only differences."""
+        current = {str(c.get('id')): c for c in companies}
+        with self._lock:
+            for company_id in [i for i in self._docs if i not in current]:
+                self._remove(company_id)
+            for company_id, company in current.items():
+                indexed = self._docs.get(company_id)
+                if indexed is not None and indexed.get('name') == company.get('name') \
+                        and indexed.get('email') == company.get('email'):
+                    self._docs[company_id] = company
+                    continue
+                self._remove(company_id)
+                self._add(company_id, company)
+
+    # -- Queries -------------------------------------------------------------
+
+    def _ordered(self, kind: str, key: str) -> List[str]:
+        """Ids posted under ``key``, best static rank first (cached until it changes)."""
+        ordered = self._ordered_cache.get((kind, key))
+        if ordered is None:
+            ordered = sorted(self._postings[kind].get(key, ()), key=self._rank.__getitem__)
+            self._ordered_cache[(kind, key)] = ordered
+        return ordered
+
+    def search(self, query: str, k: int = 10) -> List[Dict[str, Any]]:
+        """Best ``k`` companies for ``query``, best match first."""
+        text = normalize(query)
+        if not text or k <= 0:
+            return []
+        results: List[str] = []
+        seen: Set[str] = set()
+
+        def take(ids: Iterable[str], accept: Callable[[str], bool]) -> bool:
+            for company_id in ids:
+                if company_id not in seen and accept(company_id):
+                    seen.add(company_id)
+                    results.append(company_id)
+                    if len(results) >= k:
+                        return True
+            return False
+
+        with self._lock:
+            # 1. The name starts with the query
+            done = take(self._ordered('name', text[:MAX_PREFIX]),
+                        lambda company_id: self._names[company_id].startswith(text))
+
+            # 2. Every query word prefixes some word; walk the rarest word's list
+            words = text.split()
+            word_sets = [self._postings['word'].get(word[:MAX_PREFIX]) for word in words]
+            # Words longer than the indexed prefixes are checked in full
+            long_words = [word for word in words if len(word) > MAX_PREFIX]
+
+            def has_words(company_id: str) -> bool:
+                indexed = self._words[company_id]
+                return all(any(w.startswith(word) for w in indexed) for word in long_words)
+
+            if not done and all(word_sets):
+                driver = min(range(len(words)), key=lambda i: len(word_sets[i]))
+                others = [ids for i, ids in enumerate(word_sets) if i != driver]
+                done = take(self._ordered('word', words[driver][:MAX_PREFIX]),
+                            lambda company_id: all(company_id in ids for ids in others)
+                            and has_words(company_id))
+
+            # 3. Trigram overlap for substrings and typos
+            if not done:
+                limit = max(1000, int(len(self._docs) * COMMON_TRIGRAM_SHARE))
+                grams = [g for g in trigrams(text) if 0 < len(self._postings['gram'].get(g, ())) <= limit]
+                counts: Dict[str, int] = defaultdict(int)
+                for gram in grams:
+                    for company_id in self._postings['gram'][gram]:
+                        counts[company_id] += 1
+                needed = max(1, (len(grams) + 1) // 2)
+                matches = [company_id for company_id, n in counts.items() if n >= needed]
+                matches.sort(key=lambda company_id: (-counts[company_id], self._rank[company_id]))
+                take(matches, lambda company_id: True)
+
+            return [self._docs[company_id] for company_id in results]
@@ -0,0 +1,230 @@
+"""Local JSON user store for deployments without MongoDB.
+
+Users live in a snapshot file (``users.json``: ``{user_id: record}``) plus an
+append-only journal next to it (``users.json.journal``), one JSON line per
+change.  Writes only append to the journal; once it holds
+``compact_every`` entries the snapshot is rewritten and the journal is
+swapped for an empty one.
+
+Every read first stats both files.  If another process rewrote the snapshot
+the store reloads it; if the journal grew only the new lines are applied.
+Records are indexed in memory by id, lowercased email and lowercased
+username, so lookups do not scan or re-parse anything.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+
+class JsonUserStore:
+    """Users keyed by id with email/username indexes, persisted as snapshot + journal."""
+
+    def __init__(self, path: str, compact_every: int = 500):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._by_email: Dict[str, str] = {}
+        self._by_username: Dict[str, str] = {}
+        self._snapshot_sig: Optional[Tuple] = None
+        self._journal_ino = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    # -- File sync -----------------------------------------------------------
+
+    @staticmethod
+    def _signature(path: str) -> Optional[Tuple]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    @contextmanager
+    def _file_lock(self):
+        """Serialise journal appends and compaction across processes."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sync(self) -> None:
+        signature = self._signature(self.path)
+        if signature != self._snapshot_sig:
+            self._load_snapshot(signature)
+        journal = self._signature(self.journal_path)
+        journal_ino, journal_size = (journal[0], journal[2]) if journal else (None, 0)
+        if journal_ino != self._journal_ino or journal_size < self._journal_offset:
+            # Compaction swaps in a fresh journal; re-read the snapshot it produced
+            if self._journal_offset:
+                self._load_snapshot(self._signature(self.path))
+            self._journal_ino = journal_ino
+        if journal_size > self._journal_offset:
+            self._replay_journal()
+
+    def _load_snapshot(self, signature: Optional[Tuple]) -> None:
+        records = {}
+        if signature is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                records = json.loads(content) if content.strip() else {}
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Error reading users file {self.path}: {e}")
+        self._users = {}
+        self._by_email = {}
+        self._by_username = {}
+        for user_id, record in records.items():
+            if isinstance(record, dict):
+                self._index(str(user_id), record)
+        self._snapshot_sig = signature
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def _replay_journal(self) -> None:
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._journal_offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break  # Partially written line; pick it up next time
+                self._journal_offset += len(raw)
+                try:
+                    self._apply(json.loads(raw))
+                except (ValueError, KeyError) as e:
+                    print(f"Skipping bad users journal entry: {e}")
+                self._journal_entries += 1
+
+    # -- Indexes -------------------------------------------------------------
+
+    def _index(self, user_id: str, record: Dict[str, Any]) -> None:
+        self._unindex(user_id)
+        self._users[user_id] = record
+        if record.get('email'):
+            self._by_email[str(record['email']).strip().lower()] = user_id
+        if record.get('username'):
+            self._by_username[str(record['username']).strip().lower()] = user_id
+
+    def _unindex(self, user_id: str) -> None:
+        old = self._users.pop(user_id, None)
+        if not old:
+            return
+        email = str(old.get('email') or '').strip().lower()
+        if self._by_email.get(email) == user_id:
+            del self._by_email[email]
+        username = str(old.get('username') or '').strip().lower()
+        if self._by_username.get(username) == user_id:
+            del self._by_username[username]
+
+    def _apply(self, entry: Dict[str, Any]) -> None:
+        if entry['op'] == 'put':
+            self._index(str(entry['id']), entry['user'])
+        elif entry['op'] == 'delete':
+            self._unindex(str(entry['id']))
+
+    # -- Reads ---------------------------------------------------------------
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._sync()
+            record = self._users.get(str(user_id))
+            return dict(record) if record is not None else None
+
+    def find_by_email(self, email: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        return self._find('_by_email', email)
+
+    def find_by_username(self, username: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        return self._find('_by_username', username)
+
+    def find_by_identifier(self, identifier: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Match an email or a username, case-insensitively."""
+        return self.find_by_email(identifier) or self.find_by_username(identifier)
+
+    def _find(self, index: str, value: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            self._sync()  # May rebuild the indexes, so look them up afterwards
+            user_id = getattr(self, index).get((value or '').strip().lower())
+            if user_id is None:
+                return None
+            return user_id, dict(self._users[user_id])
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            self._sync()
+            return {user_id: dict(record) for user_id, record in self._users.items()}
+
+    # -- Writes --------------------------------------------------------------
+
+    def put(self, user_id: str, record: Dict[str, Any]) -> None:
+        """Store the full record for ``user_id``; a no-op if nothing changed."""
+        user_id = str(user_id)
+        with self._lock:
+            self._sync()
+            if self._users.get(user_id) == record:
+                return
+            self._append({'op': 'put', 'id': user_id, 'user': record})
+
+    def update(self, user_id: str, changes: Dict[str, Any]) -> bool:
+        """Merge ``changes`` into an existing record; False if there is none."""
+        user_id = str(user_id)
+        with self._lock:
+            self._sync()
+            if user_id not in self._users:
+                return False
+            self.put(user_id, {**self._users[user_id], **changes})
+            return True
+
+    def delete(self, user_id: str) -> None:
+        with self._lock:
+            self._sync()
+            if str(user_id) in self._users:
+                self._append({'op': 'delete', 'id': str(user_id)})
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        line = (json.dumps(entry, default=str) + '\n').encode('utf-8')
+        with self._file_lock():
+            # Catch up with appends made by other processes before ours lands
+            self._sync()
+            with open(self.journal_path, 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._replay_journal()
+            if self._journal_entries >= self.compact_every:
+                self._compact()
+
+    def compact(self) -> None:
+        with self._lock, self._file_lock():
+            self._sync()
+            self._compact()
+
+    def _compact(self) -> None:
+        """Fold the journal into a new snapshot.  Caller holds both locks."""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._users, f, separators=(',', ':'), default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        # Replace rather than truncate so other processes notice the new inode
+        with open(self.journal_path + '.tmp', 'wb'):
+            pass
+        os.replace(self.journal_path + '.tmp', self.journal_path)
+        self._snapshot_sig = self._signature(self.path)
+        self._journal_ino = self._signature(self.journal_path)[0]
+        self._journal_offset = 0
+        self._journal_entries = 0
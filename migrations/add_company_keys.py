@@ -0,0 +1,58 @@
+"""
+Migration script to backfill `name_key` and `email_key` on existing companies.
+
+Adding a company is a single insert that relies on the unique indexes on
+these normalized keys to reject duplicates, so companies stored before the
+keys existed need them too. Run it once after deploying the keyed duplicate
+checks; it is safe to run again.
+"""
+import os
+import sys
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from company_import import backfill_company_keys, ensure_company_key_indexes  # noqa: E402
+
+# Load environment variables
+load_dotenv()
+
+
+def run_migration():
+    """Ensure the key indexes exist, then give every company its keys."""
+    print("Starting migration: Adding name_key/email_key to companies...")
+
+    # Get MongoDB connection details from environment
+    mongo_uri = os.getenv('MONGO_URI')
+    db_name = os.getenv('DB_NAME', 'comp')
+
+    if not mongo_uri:
+        print("❌ Error: MONGO_URI environment variable not set")
+        sys.exit(1)
+
+    try:
+        # Connect to MongoDB
+        client = MongoClient(mongo_uri, tls=True, tlsAllowInvalidCertificates=False)
+        companies_col = client[db_name]['companies']
+
+        print(f"Found {companies_col.estimated_document_count()} total companies in database")
+
+        # Indexes first, so companies that clash are caught instead of both keyed
+        ensure_company_key_indexes(companies_col)
+        result = backfill_company_keys(companies_col)
+
+        print(f"✅ Migration complete. Added keys to {result['updated']} companies.")
+        if result['conflicts'] or result['blank']:
+            print(f"⚠️ {result['conflicts']} companies share a normalized name or email with another company "
+                  f"and {result['blank']} have a blank name or email, so they were not fully keyed. Find them "
+                  f"with {{'key_backfill_failed': true}}, merge or rename them manually, then unset the flag "
+                  f"and run this script again.")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,98 @@
+"""
+Migration script to backfill the normalized user lookup fields.
+
+User lookups are exact matches on `email` (stored lowercase) and
+`username_lower`, so every user document must carry both in normalized form.
+This lowercases any mixed-case emails, fills in or repairs `username_lower`,
+and makes sure the unique indexes exist. Run it once after deploying the
+indexed lookup changes; it is safe to run again.
+"""
+import os
+import sys
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+BATCH_SIZE = 1000
+
+
+def normalized_changes(user):
+    """Return the $set needed to normalize one user document (may be empty)."""
+    changes = {}
+    email = user.get('email')
+    if isinstance(email, str) and email != email.strip().lower():
+        changes['email'] = email.strip().lower()
+    username = user.get('username')
+    if isinstance(username, str) and user.get('username_lower') != username.strip().lower():
+        changes['username_lower'] = username.strip().lower()
+    return changes
+
+
+def run_migration():
+    """Normalize email/username_lower on all users and ensure the lookup indexes."""
+    print("Starting migration: Normalizing user lookup fields...")
+
+    # Get MongoDB connection details from environment
+    mongo_uri = os.getenv('MONGO_URI')
+    db_name = os.getenv('DB_NAME', 'comp')
+
+    if not mongo_uri:
+        print("❌ Error: MONGO_URI environment variable not set")
+        sys.exit(1)
+
+    try:
+        # Connect to MongoDB
+        client = MongoClient(mongo_uri, tls=True, tlsAllowInvalidCertificates=False)
+        db = client[db_name]
+        users_col = db['users']
+
+        print(f"Found {users_col.estimated_document_count()} total users in database")
+
+        updated = 0
+        conflicts = []
+        batch = []
+
+        def flush():
+            nonlocal updated
+            if not batch:
+                return
+            try:
+                result = users_col.bulk_write(batch, ordered=False)
+                updated += result.modified_count
+            except BulkWriteError as e:
+                updated += e.details.get('nModified', 0)
+                # Two accounts that differ only by case cannot both be normalized
+                for error in e.details.get('writeErrors', []):
+                    conflicts.append(error.get('op', {}).get('q', {}).get('_id'))
+            batch.clear()
+
+        cursor = users_col.find({}, {'email': 1, 'username': 1, 'username_lower': 1})
+        for user in cursor:
+            changes = normalized_changes(user)
+            if changes:
+                batch.append(UpdateOne({'_id': user['_id']}, {'$set': changes}))
+            if len(batch) >= BATCH_SIZE:
+                flush()
+                print(f"Updated {updated} users...")
+        flush()
+
+        # Lookups rely on these being unique indexes
+        users_col.create_index("email", unique=True)
+        users_col.create_index("username_lower", unique=True)
+
+        print(f"✅ Migration complete. Normalized {updated} users.")
+        if conflicts:
+            print(f"⚠️ {len(conflicts)} users could not be normalized because another account "
+                  f"already uses the lowercased value. Resolve these manually: {conflicts}")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == "__main__":
+    run_migration()
@@ -3,15 +3,18 @@
 This module provides functions to interact with the MongoDB users collection.
 It expects the MongoDB client and collection to be passed in from app.py.
 """
-import re
 import traceback
 from datetime import datetime
-from typing import Optional, Dict, Any
-from werkzeug.security import generate_password_hash, check_password_hash
+from typing import Any, Callable, Dict, List, Optional
+from pymongo.errors import DuplicateKeyError
+from password_hashing import hash_password, verify_and_rehash
 
 # These will be set by app.py
 users_col = None
 
+# Called with the user id after update_user writes, so callers can drop caches
+_change_listeners: List[Callable[[str], None]] = []
+
 def init_mongo_connection(client, db):
     """Initialize the MongoDB connection from app.py
     
@@ -87,55 +90,78 @@ def find_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
     return None
 
 
-def find_user_by_email_or_username(identifier: str) -> Optional[Dict[str, Any]]:
+# Fields Flask-Login needs to rebuild the session user; no password hash
+SESSION_USER_FIELDS = {"email": 1, "username": 1, "is_verified": 1, "otp_verified": 1, "company_id": 1}
+
+
+def find_session_user(user_id: str) -> Optional[Dict[str, Any]]:
+    """Load the minimal projection of a logged-in user in a single query.
+
+    Session ids are normally the stringified ObjectId, but older sessions may
+    carry a string ``_id`` or an email/username; those fall back to the
+    identifier lookup.
+    """
     if users_col is None:
         raise RuntimeError("MongoDB users_col is not initialized. Call init_mongo_connection first.")
-    ident = identifier.strip()
-    # For email, use case-insensitive match with regex
-    # For username, use case-insensitive match
-    return users_col.find_one({
-        "$or": [
-            {"email": {"$regex": f"^{re.escape(ident)}$", "$options": "i"}},
-            {"username": {"$regex": f"^{re.escape(ident)}$", "$options": "i"}}
-        ]
-    })
 
+    from bson import ObjectId
+
+    candidates = [user_id]
+    if ObjectId.is_valid(user_id):
+        candidates.insert(0, ObjectId(user_id))
+    user = users_col.find_one({"_id": {"$in": candidates}}, SESSION_USER_FIELDS)
+    if user is None and not ObjectId.is_valid(user_id):
+        user = find_user_by_email_or_username(user_id)
+        if user:
+            user = {k: user.get(k) for k in ("_id", *SESSION_USER_FIELDS) if k in user}
+    if user:
+        user['_id'] = str(user['_id'])
+    return user
+
+
+def normalize_identifier(value: str) -> str:
+    """Lookup key for an email or username: stripped and lowercased.
 
-def email_or_username_exists(email: str, username: str) -> bool:
+    Emails are stored lowercased and usernames carry a ``username_lower``
+    copy, so lookups are exact matches on the unique indexes.
+    """
+    return (value or "").strip().lower()
+
+
+def find_user_by_email_or_username(identifier: str) -> Optional[Dict[str, Any]]:
     if users_col is None:
         raise RuntimeError("MongoDB users_col is not initialized. Call init_mongo_connection first.")
-    # Use case-insensitive search for both email and username
-    return users_col.count_documents({
+    key = normalize_identifier(identifier)
+    # Equality on the indexed normalized fields (case-insensitive by construction)
+    return users_col.find_one({
         "$or": [
-            {"email": {"$regex": f"^{re.escape(email.strip())}$", "$options": "i"}},
-            {"username": {"$regex": f"^{re.escape(username.strip())}$", "$options": "i"}}
+            {"email": key},
+            {"username_lower": key}
         ]
-    }) > 0
+    })
 
 # ---------------------------------------------------------------------------
 # Modification helpers
 # ---------------------------------------------------------------------------
 
-def create_user(email, username, password, **kwargs):
-    """Create a new user in MongoDB"""
+def create_user(email, username, password, **kwargs) -> Dict[str, Any]:
+    """Create a new user in MongoDB and return the inserted document.
+
+    A single insert_one: the unique indexes on email, username and
+    username_lower reject duplicates, which surface as ValueError.
+    """
     if users_col is None:
         error_msg = "MongoDB users_col is not initialized. Call init_mongo_connection first."
         print(f" {error_msg}")
         raise RuntimeError(error_msg)
     
     # Normalize email to lowercase
-    email = email.strip().lower()
+    email = normalize_identifier(email)
     # Preserve username case for display but store original case
     username = username.strip()
     
-    print(f" Creating user: {email} ({username})")
-    
-    # Check if user already exists (case-insensitive check)
-    if email_or_username_exists(email, username):
-        raise ValueError("Email or username already exists")
-    
     # Hash the password (case-sensitive)
-    password_hash = generate_password_hash(password)
+    password_hash = hash_password(password)
     
     now = datetime.utcnow()
     user_doc = {
@@ -153,63 +179,55 @@ def create_user(email, username, password, **kwargs):
     # Add any additional fields
     user_doc.update(kwargs)
     
-    print(f"Attempting to insert user into MongoDB collection: {users_col.name}")
-    print(f"Database: {users_col.database.name}")
-    print(f"User document to insert: {user_doc}")
-    
-    # Insert the user
     try:
-        result = users_col.insert_one(user_doc)
-        user_id = str(result.inserted_id)
-        print(f" User created successfully with ID: {user_id}")
-        
-        # Verify the user was created
-        created_user = find_user_by_id(user_id)
-        if not created_user:
-            print("❌ Failed to verify user creation in database")
-            raise Exception("Failed to verify user creation in database")
-            
-        print(f" Verified user creation: {created_user}")
-        return user_id
-        
+        # insert_one fills in user_doc['_id']
+        users_col.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise ValueError("Email or username already exists")
     except Exception as e:
-        print(f"❌ Error inserting user into MongoDB: {str(e)}")
-        print(f"User document that failed: {user_doc}")
-        # Check if the user was actually created despite the error
-        try:
-            existing = find_user_by_email_or_username(email)
-            if existing:
-                print(f" Found existing user after error: {existing}")
-                return str(existing.get('_id'))
-        except Exception as check_error:
-            print(f" Error checking for existing user: {str(check_error)}")
+        print(f"❌ Error inserting user {email} into MongoDB: {str(e)}")
         traceback.print_exc()
         raise
+    print(f" User created successfully with ID: {user_doc['_id']}")
+    return user_doc
 
 def update_user(user_id: str, changes: Dict[str, Any]):
+    # Keep the normalized lookup fields in step with the display values
+    if "email" in changes:
+        changes["email"] = normalize_identifier(changes["email"])
+    if "username" in changes:
+        changes["username_lower"] = normalize_identifier(changes["username"])
     changes["updated_at"] = datetime.utcnow()
     users_col.update_one({"_id": user_id}, {"$set": changes})
+    for listener in _change_listeners:
+        listener(str(user_id))
+
+
+def on_user_changed(listener: Callable[[str], None]) -> Callable[[str], None]:
+    """Register ``listener`` to be called with the user id after update_user."""
+    _change_listeners.append(listener)
+    return listener
 
 # ---------------------------------------------------------------------------
 # Auth helpers
 # ---------------------------------------------------------------------------
 
 def verify_password(user_doc: Dict[str, Any], password: str) -> bool:
-    print("\n=== Password Verification Debug ===")
-    print(f"User document keys: {list(user_doc.keys())}")
-    
-    if "password_hash" not in user_doc:
+    """Check ``password`` against the stored hash, upgrading it if outdated.
+
+    Hashing runs on the bounded pool in password_hashing, so this may raise
+    ``PasswordHashBusy`` when that pool is saturated.
+    """
+    stored_hash = user_doc.get("password_hash")
+    if not stored_hash:
         print("❌ Error: 'password_hash' key not found in user document")
         return False
-        
-    stored_hash = user_doc["password_hash"]
-    print(f"Stored hash: {stored_hash}")
-    print(f"Provided password: {password}")
-    
-    try:
-        result = check_password_hash(stored_hash, password)
-        print(f"Password check result: {result}")
-        return result
-    except Exception as e:
-        print(f"❌ Error during password verification: {str(e)}")
-        return False
+
+    ok, new_hash = verify_and_rehash(stored_hash, password)
+    if new_hash and "_id" in user_doc:
+        try:
+            update_user(user_doc["_id"], {"password_hash": new_hash})
+            user_doc["password_hash"] = new_hash
+        except Exception as e:
+            print(f"⚠️ Could not store upgraded password hash: {str(e)}")
+    return ok
@@ -0,0 +1,93 @@
+"""One-time codes for registration and password reset, stored in MongoDB.
+
+Each (email, purpose) pair has at most one live code in the ``otp_tokens``
+collection; issuing a new code replaces the old one.  A TTL index on
+``expires_at`` lets the server delete expired codes, so nothing has to be
+cleaned up by hand and the ``users`` documents are never touched.  Codes are
+stored as SHA-256 digests.
+"""
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+
+PURPOSE_REGISTER = 'register'
+PURPOSE_PASSWORD_RESET = 'password_reset'
+
+# Outcomes of verify_otp
+OTP_OK = 'ok'
+OTP_INVALID = 'invalid'
+OTP_EXPIRED = 'expired'
+OTP_MISSING = 'missing'
+
+# Set by init_otp_tokens
+otp_col = None
+
+
+def init_otp_tokens(db):
+    """Bind the ``otp_tokens`` collection and make sure its indexes exist."""
+    global otp_col
+    otp_col = db['otp_tokens']
+    try:
+        # The TTL monitor removes documents once expires_at has passed
+        otp_col.create_index("expires_at", expireAfterSeconds=0, name="otp_expiry_ttl")
+        otp_col.create_index([("email", 1), ("purpose", 1)], unique=True, name="otp_email_purpose")
+    except Exception as e:
+        print(f"⚠️ Could not create otp_tokens indexes (they may already exist): {str(e)}")
+    return otp_col
+
+
+def _digest(email: str, code: str) -> str:
+    return hashlib.sha256(f"{email}:{code}".encode('utf-8')).hexdigest()
+
+
+def _normalize(email: str) -> str:
+    return (email or '').strip().lower()
+
+
+def issue_otp(email: str, purpose: str, ttl_minutes: int, length: int = 6) -> str:
+    """Create (or replace) the code for ``email``/``purpose`` and return it."""
+    if otp_col is None:
+        raise RuntimeError("otp_tokens collection is not initialized. Call init_otp_tokens first.")
+    email = _normalize(email)
+    code = ''.join(secrets.choice('0123456789') for _ in range(length))
+    now = datetime.utcnow()
+    otp_col.update_one(
+        {'email': email, 'purpose': purpose},
+        {'$set': {
+            'code_hash': _digest(email, code),
+            'created_at': now,
+            'expires_at': now + timedelta(minutes=ttl_minutes),
+        }},
+        upsert=True
+    )
+    return code
+
+
+def verify_otp(email: str, purpose: str, code: str, consume: bool = False) -> str:
+    """Check ``code`` in a single indexed operation and return an ``OTP_*`` outcome.
+
+    With ``consume`` the code is deleted when it matches, so it cannot be
+    used twice.  A consumed-but-expired code reports ``OTP_EXPIRED``.
+    """
+    if otp_col is None:
+        raise RuntimeError("otp_tokens collection is not initialized. Call init_otp_tokens first.")
+    email = _normalize(email)
+    code_hash = _digest(email, (code or '').strip())
+    if consume:
+        doc = otp_col.find_one_and_delete(
+            {'email': email, 'purpose': purpose, 'code_hash': code_hash},
+            projection={'expires_at': 1}
+        )
+        if doc is None:
+            return OTP_INVALID
+    else:
+        doc = otp_col.find_one({'email': email, 'purpose': purpose}, {'code_hash': 1, 'expires_at': 1})
+        if doc is None:
+            return OTP_MISSING
+        if doc.get('code_hash') != code_hash:
+            return OTP_INVALID
+    # The TTL monitor runs about once a minute, so recently expired codes can linger
+    if doc['expires_at'] < datetime.utcnow():
+        return OTP_EXPIRED
+    return OTP_OK
+
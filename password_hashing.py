@@ -0,0 +1,119 @@
+"""Password hashing on a dedicated, bounded thread pool.
+
+PBKDF2/scrypt hashing holds a request worker for tens of milliseconds, so a
+burst of logins can starve everything else.  Hash and verify calls here run
+on their own small pool (``PASSWORD_HASH_WORKERS``) and admission is limited:
+once ``PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE`` jobs are in flight new
+calls fail fast with :class:`PasswordHashBusy` instead of queueing forever.
+``hashlib`` releases the GIL while deriving keys, so threads are enough.
+
+The hash cost is ``PASSWORD_HASH_METHOD`` (a werkzeug method string such as
+``pbkdf2:sha256:600000``).  :func:`verify_and_rehash` returns a fresh hash
+whenever a stored hash was made with a different method, so changing the
+cost upgrades accounts as they log in.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Dict, Optional, Tuple
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+def _canonical_method(method: str) -> str:
+    """Spell out werkzeug's defaults so the method matches stored hash prefixes."""
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        defaults = ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)]
+    elif name == 'scrypt':
+        defaults = ['32768', '8', '1']
+    else:
+        return method
+    return ':'.join([name] + args + defaults[len(args):])
+
+
+PASSWORD_HASH_METHOD = _canonical_method(os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 16))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 5))
+
+
+class PasswordHashBusy(Exception):
+    """Raised when the hashing pool is saturated; callers should answer 503."""
+
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+_stats_lock = threading.Lock()
+_stats = {'completed': 0, 'rejected': 0, 'timeouts': 0, 'rehashed': 0}
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        _count('rejected')
+        raise PasswordHashBusy('Password hashing queue is full')
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        result = future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeout:
+        _count('timeouts')
+        raise PasswordHashBusy('Password hashing timed out')
+    _count('completed')
+    return result
+
+
+def hash_password(password: str) -> str:
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def check_password(stored_hash: Optional[str], password: str) -> bool:
+    if not stored_hash:
+        return False
+    return _run(check_password_hash, stored_hash, password)
+
+
+def needs_rehash(stored_hash: Optional[str]) -> bool:
+    """True if ``stored_hash`` was not produced with ``PASSWORD_HASH_METHOD``."""
+    if not stored_hash or '$' not in stored_hash:
+        return False
+    return stored_hash.split('$', 1)[0] != PASSWORD_HASH_METHOD
+
+
+def verify_and_rehash(stored_hash: Optional[str], password: str) -> Tuple[bool, Optional[str]]:
+    """Check ``password`` and, if it matches an outdated hash, return a new one.
+
+    Returns ``(ok, new_hash)``; ``new_hash`` is None unless the caller should
+    store an upgraded hash.
+    """
+    if not check_password(stored_hash, password):
+        return False, None
+    if not needs_rehash(stored_hash):
+        return True, None
+    try:
+        new_hash = hash_password(password)
+    except PasswordHashBusy:
+        # The login itself succeeded; upgrade on a quieter attempt
+        return True, None
+    _count('rehashed')
+    return True, new_hash
+
+
+def stats() -> Dict[str, Any]:
+    with _stats_lock:
+        counters = dict(_stats)
+    counters.update({
+        'method': PASSWORD_HASH_METHOD.split(':')[0],
+        'workers': PASSWORD_HASH_WORKERS,
+        'queue': PASSWORD_HASH_QUEUE,
+    })
+    return counters
@@ -0,0 +1,267 @@
+"""Cart pricing engine.
+
+Every cart line is priced with the same formula:
+
+    unit price  = base_price + bar_price   (blankets)
+                = unit_price               (mpacks and other products)
+    subtotal    = unit price * quantity
+    discount    = subtotal * discount_percent / 100
+    GST         = (subtotal - discount) * gst_percent / 100
+    final total = subtotal - discount + GST
+
+The routes in app.py used to repeat this math inline with slightly different
+key names.  They now call :func:`price_products` / :func:`apply_pricing`, which
+evaluate a whole cart in one batched pass over column arrays and return the
+per-line results together with per-GST-class rollups.
+"""
+from array import array
+from typing import Any, Dict, Iterable, List
+
+# GST class used for the quotation breakdown, and its statutory rate.
+GST_CLASS_RATES = {'blankets': 18.0, 'mpacks': 12.0}
+
+# Default GST percentage applied when a line does not carry one.
+DEFAULT_GST_PERCENT = {'blanket': 18.0, 'mpack': 12.0}
+
+# Keys written by older versions of the inline calculations; they are
+# superseded by the canonical keys produced here and dropped on repricing.
+LEGACY_CALCULATION_KEYS = (
+    'final_price', 'basePrice', 'pricePerUnit', 'price_after_discount',
+    'final_unit_price', 'taxable_amount',
+)
+
+
+def gst_class(product_type: str) -> str:
+    """Return the GST breakdown bucket for a product type."""
+    return 'blankets' if product_type == 'blanket' else 'mpacks'
+
+
+def _float(value: Any, default: float = 0.0) -> float:
+    try:
+        return float(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        return default
+
+
+def _int(value: Any, default: int = 1) -> int:
+    try:
+        return int(float(value)) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        return default
+
+
+def line_columns(products: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Split cart lines into column arrays (one entry per line)."""
+    columns = {
+        'type': [],
+        'base_price': array('d'),
+        'bar_price': array('d'),
+        'quantity': array('d'),
+        'discount_percent': array('d'),
+        'gst_percent': array('d'),
+    }
+    for product in products:
+        product_type = product.get('type') or ''
+        if product_type == 'blanket':
+            base_price = _float(product.get('base_price')) or _float(product.get('unit_price'))
+            bar_price = _float(product.get('bar_price'))
+        else:
+            base_price = _float(product.get('unit_price'))
+            bar_price = 0.0
+        columns['type'].append(product_type)
+        columns['base_price'].append(base_price)
+        columns['bar_price'].append(bar_price)
+        columns['quantity'].append(_int(product.get('quantity')))
+        columns['discount_percent'].append(_float(product.get('discount_percent')))
+        columns['gst_percent'].append(
+            _float(product.get('gst_percent'), DEFAULT_GST_PERCENT.get(product_type, 12.0))
+        )
+    return columns
+
+
+def empty_rollup(class_name: str) -> Dict[str, float]:
+    return {
+        'subtotal': 0.0,
+        'discount': 0.0,
+        'subtotal_after_discount': 0.0,
+        'gst': 0.0,
+        'rate': GST_CLASS_RATES[class_name],
+        'line_count': 0,
+    }
+
+
+def price_columns(columns: Dict[str, Any]) -> Dict[str, Any]:
+    """Evaluate the pricing formula over column arrays.
+
+    Returns ``{'lines': [...], 'gst_breakdown': {...}, 'totals': {...}}`` where
+    each line is the canonical ``calculations`` dict for the matching input row.
+    """
+    unit = array('d', (b + r for b, r in zip(columns['base_price'], columns['bar_price'])))
+    subtotal = array('d', (u * q for u, q in zip(unit, columns['quantity'])))
+    discount = array('d', (s * d / 100 for s, d in zip(subtotal, columns['discount_percent'])))
+    taxable = array('d', (s - d for s, d in zip(subtotal, discount)))
+    gst = array('d', (t * g / 100 for t, g in zip(taxable, columns['gst_percent'])))
+
+    breakdown = {name: empty_rollup(name) for name in GST_CLASS_RATES}
+    lines = []
+    for i, product_type in enumerate(columns['type']):
+        line = {
+            'unit_price': round(unit[i], 2),
+            'quantity': int(columns['quantity'][i]),
+            'subtotal': round(subtotal[i], 2),
+            'discount_percent': columns['discount_percent'][i],
+            'discount_amount': round(discount[i], 2),
+            'discounted_subtotal': round(taxable[i], 2),
+            'gst_percent': columns['gst_percent'][i],
+            'gst_amount': round(gst[i], 2),
+            'final_total': round(taxable[i] + gst[i], 2),
+        }
+        if product_type == 'blanket':
+            line['base_price'] = round(columns['base_price'][i], 2)
+            line['bar_price'] = round(columns['bar_price'][i], 2)
+        lines.append(line)
+
+        rollup = breakdown[gst_class(product_type)]
+        rollup['subtotal'] += subtotal[i]
+        rollup['discount'] += discount[i]
+        rollup['subtotal_after_discount'] += taxable[i]
+        rollup['gst'] += gst[i]
+        rollup['line_count'] += 1
+
+    return {'lines': lines, **summarize(breakdown)}
+
+
+def summarize(breakdown: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    """Round per-class rollups and derive the cart-level totals from them."""
+    subtotal = sum(r['subtotal'] for r in breakdown.values())
+    discount = sum(r['discount'] for r in breakdown.values())
+    after_discount = sum(r['subtotal_after_discount'] for r in breakdown.values())
+    gst = sum(r['gst'] for r in breakdown.values())
+    line_count = sum(r['line_count'] for r in breakdown.values())
+
+    rounded = {}
+    for name, rollup in breakdown.items():
+        rounded[name] = {
+            key: (round(value, 2) if isinstance(value, float) else value)
+            for key, value in rollup.items()
+        }
+    rounded['total_gst'] = round(gst, 2)
+
+    return {
+        'gst_breakdown': rounded,
+        'totals': {
+            'subtotal_before_discount': round(subtotal, 2),
+            'total_discount': round(discount, 2),
+            'subtotal_after_discount': round(after_discount, 2),
+            'total_gst': round(gst, 2),
+            'total': round(after_discount + gst, 2),
+            'line_count': line_count,
+        },
+    }
+
+
+def price_products(products: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Price a list of cart lines without modifying them."""
+    return price_columns(line_columns(products))
+
+
+def apply_pricing(products: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Price ``products`` and write the results back onto each line.
+
+    Each product gets a canonical ``calculations`` dict (descriptive extras
+    such as ``areaSqM`` are preserved) and refreshed ``unit_price`` /
+    ``total_price`` fields.  Returns the same structure as
+    :func:`price_products`.
+    """
+    pricing = price_products(products)
+    for product, line in zip(products, pricing['lines']):
+        calculations = {
+            key: value for key, value in (product.get('calculations') or {}).items()
+            if key not in LEGACY_CALCULATION_KEYS
+        }
+        calculations.update(line)
+        product['calculations'] = calculations
+        product['unit_price'] = line['unit_price']
+        product['total_price'] = line['final_total']
+    return pricing
+
+
+# ---------------------------------------------------------------------------
+# Running cart aggregates
+# ---------------------------------------------------------------------------
+# Cart documents carry per-GST-class running totals so reads do not need to
+# walk the products.  Writes adjust them with the delta between the old and
+# new versions of the lines they touch.
+
+AGGREGATE_FIELDS = (
+    ('subtotal', 'subtotal'),
+    ('discount', 'discount_amount'),
+    ('subtotal_after_discount', 'discounted_subtotal'),
+    ('gst', 'gst_amount'),
+)
+
+
+def needs_pricing(product: Dict[str, Any]) -> bool:
+    """True for lines stored before the canonical calculations existed."""
+    return 'final_total' not in (product.get('calculations') or {})
+
+
+def empty_aggregates() -> Dict[str, Any]:
+    aggregates = {name: {field: 0.0 for field, _ in AGGREGATE_FIELDS} for name in GST_CLASS_RATES}
+    for name in GST_CLASS_RATES:
+        aggregates[name]['line_count'] = 0
+    aggregates['line_count'] = 0
+    return aggregates
+
+
+def aggregate_lines(products: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build the stored aggregates from already-priced lines."""
+    return apply_delta(empty_aggregates(), aggregates_delta(added=products))
+
+
+def apply_delta(aggregates: Dict[str, Any], delta: Dict[str, float]) -> Dict[str, Any]:
+    """Apply an :func:`aggregates_delta` to ``aggregates`` in place, as ``$inc`` would."""
+    for path, value in delta.items():
+        _, *keys = path.split('.')
+        target = aggregates
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = target.get(keys[-1], 0) + value
+    return aggregates
+
+
+def aggregates_delta(removed: Iterable[Dict[str, Any]] = (),
+                     added: Iterable[Dict[str, Any]] = ()) -> Dict[str, float]:
+    """Return ``{'totals.<class>.<field>': increment}`` for a line change.
+
+    ``removed`` are the priced lines as they were before the write and
+    ``added`` the priced lines after it; the result is suitable for a Mongo
+    ``$inc``.
+    """
+    delta: Dict[str, float] = {}
+
+    def bump(path, value):
+        delta[path] = delta.get(path, 0) + value
+
+    for sign, lines in ((-1, removed), (1, added)):
+        for line in lines:
+            calculations = line.get('calculations') or {}
+            prefix = f"totals.{gst_class(line.get('type'))}"
+            for field, key in AGGREGATE_FIELDS:
+                bump(f'{prefix}.{field}', sign * _float(calculations.get(key)))
+            bump(f'{prefix}.line_count', sign)
+            bump('totals.line_count', sign)
+    return {path: value for path, value in delta.items() if value}
+
+
+def summary_from_aggregates(aggregates: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn stored aggregates into the ``gst_breakdown`` / ``totals`` summary."""
+    breakdown = {}
+    for name in GST_CLASS_RATES:
+        stored = (aggregates or {}).get(name) or {}
+        rollup = empty_rollup(name)
+        for field, _ in AGGREGATE_FIELDS:
+            rollup[field] = _float(stored.get(field))
+        rollup['line_count'] = int(stored.get('line_count', 0))
+        breakdown[name] = rollup
+    return summarize(breakdown)
@@ -0,0 +1,76 @@
+"""Coalesce concurrent loads of the same key into one call.
+
+When a cached value expires, every thread that needs it misses at the same
+moment.  ``SingleFlight.do(key, load)`` lets the first caller run ``load``
+while the others wait for its result (or its exception), so the backend sees
+one query or file parse instead of one per thread.  Nothing is cached once the
+call finishes; pair it with a cache such as ``ttl_cache.TTLCache``.
+"""
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls per key and counts how many were shared."""
+
+    def __init__(self, name: str = 'single_flight'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._loads: Dict[str, int] = defaultdict(int)
+        self._deduplicated: Dict[str, int] = defaultdict(int)
+        self._errors: Dict[str, int] = defaultdict(int)
+
+    def do(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """Return ``load()``, sharing the call with any in flight for ``key``."""
+        label = str(key)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._loads[label] += 1
+            else:
+                self._deduplicated[label] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = load()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._errors[label] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'in_flight': len(self._calls),
+                'loads': sum(self._loads.values()),
+                'deduplicated': sum(self._deduplicated.values()),
+                'errors': sum(self._errors.values()),
+                'keys': {
+                    label: {'loads': self._loads[label], 'deduplicated': self._deduplicated.get(label, 0),
+                            'errors': self._errors.get(label, 0)}
+                    for label in self._loads
+                },
+            }
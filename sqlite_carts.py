@@ -0,0 +1,237 @@
+"""SQLite cart store for deployments without MongoDB.
+
+Each cart line is one row keyed by ``(user_id, line_id)`` and a small
+``carts`` row per user holds the cart version.  The database runs in WAL mode
+so several worker processes can read while one writes; every write happens in
+a ``BEGIN IMMEDIATE`` transaction, which serialises writers across processes.
+
+The class mirrors the per-user interface of ``MongoCartStore`` in app.py
+(``get_cart_with_totals``, ``add_line``, ``replace_line`` ...), so the cart
+routes do not care which backend is active.
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pricing import GST_CLASS_RATES, AGGREGATE_FIELDS, empty_aggregates, gst_class
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS carts (
+    user_id    TEXT PRIMARY KEY,
+    version    INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS cart_lines (
+    user_id     TEXT NOT NULL,
+    line_id     TEXT NOT NULL,
+    position    INTEGER NOT NULL,
+    fingerprint TEXT,
+    gst_class   TEXT NOT NULL,
+    subtotal    REAL NOT NULL DEFAULT 0,
+    discount    REAL NOT NULL DEFAULT 0,
+    taxable     REAL NOT NULL DEFAULT 0,
+    gst         REAL NOT NULL DEFAULT 0,
+    data        TEXT NOT NULL,
+    PRIMARY KEY (user_id, line_id)
+);
+CREATE INDEX IF NOT EXISTS cart_lines_position ON cart_lines (user_id, position);
+CREATE INDEX IF NOT EXISTS cart_lines_fingerprint ON cart_lines (user_id, fingerprint);
+"""
+
+
+class SqliteCartStore:
+    """Per-user cart lines in a local SQLite database."""
+
+    def __init__(self, path: str, timeout: float = 10.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; sqlite3 connections are not thread-safe
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @contextmanager
+    def _read(self):
+        # A deferred transaction: under WAL every SELECT inside it sees the
+        # same snapshot, so lines, totals and version cannot come from
+        # different writes
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    # -- Row helpers ---------------------------------------------------------
+
+    @staticmethod
+    def _line_values(line: Dict[str, Any]) -> Tuple:
+        calculations = line.get('calculations') or {}
+        return (
+            line.get('fingerprint'),
+            gst_class(line.get('type')),
+            float(calculations.get('subtotal') or 0),
+            float(calculations.get('discount_amount') or 0),
+            float(calculations.get('discounted_subtotal') or 0),
+            float(calculations.get('gst_amount') or 0),
+            json.dumps(line, default=str),
+        )
+
+    def _bump_version(self, conn, user_id: str) -> None:
+        conn.execute(
+            "INSERT INTO carts (user_id, version, updated_at) VALUES (?, 1, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at",
+            (user_id, datetime.utcnow().isoformat())
+        )
+
+    def _totals(self, conn, user_id: str) -> Dict[str, Any]:
+        aggregates = empty_aggregates()
+        rows = conn.execute(
+            "SELECT gst_class, COUNT(*), SUM(subtotal), SUM(discount), SUM(taxable), SUM(gst) "
+            "FROM cart_lines WHERE user_id = ? GROUP BY gst_class",
+            (user_id,)
+        ).fetchall()
+        for name, count, *sums in rows:
+            if name not in GST_CLASS_RATES:
+                continue
+            for (field, _), value in zip(AGGREGATE_FIELDS, sums):
+                aggregates[name][field] = value or 0.0
+            aggregates[name]['line_count'] = count
+            aggregates['line_count'] += count
+        aggregates['version'] = self._version(conn, user_id)
+        return aggregates
+
+    @staticmethod
+    def _version(conn, user_id: str) -> int:
+        row = conn.execute("SELECT version FROM carts WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _matches(self, conn, user_id: str, line: Dict[str, Any], expected_version: Optional[int]) -> bool:
+        """True if ``line`` is still stored exactly as the caller read it."""
+        if expected_version is not None and self._version(conn, user_id) != expected_version:
+            return False
+        row = conn.execute(
+            "SELECT data FROM cart_lines WHERE user_id = ? AND line_id = ?",
+            (user_id, line.get('id'))
+        ).fetchone()
+        return row is not None and json.loads(row[0]).get('calculations') == line.get('calculations')
+
+    # -- Whole-cart access ---------------------------------------------------
+
+    def get_cart_with_totals(self, user_id: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT data FROM cart_lines WHERE user_id = ? ORDER BY position",
+                (user_id,)
+            ).fetchall()
+            return [json.loads(data) for (data,) in rows], self._totals(conn, user_id)
+
+    def get_totals(self, user_id: str) -> Dict[str, Any]:
+        with self._read() as conn:
+            return self._totals(conn, user_id)
+
+    def get_line_count(self, user_id: str) -> int:
+        row = self._conn().execute("SELECT COUNT(*) FROM cart_lines WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0]
+
+    def save_cart(self, user_id: str, products: List[Dict[str, Any]],
+                  expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Replace the whole cart; returns None if ``expected_version`` is stale."""
+        with self._write() as conn:
+            if expected_version is not None and self._version(conn, user_id) != expected_version:
+                return None
+            conn.execute("DELETE FROM cart_lines WHERE user_id = ?", (user_id,))
+            conn.executemany(
+                "INSERT INTO cart_lines (user_id, line_id, position, fingerprint, gst_class, "
+                "subtotal, discount, taxable, gst, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(user_id, str(p.get('id')), i) + self._line_values(p) for i, p in enumerate(products)]
+            )
+            self._bump_version(conn, user_id)
+            return self._totals(conn, user_id)
+
+    def clear_cart(self, user_id: str) -> Dict[str, Any]:
+        return self.save_cart(user_id, [])
+
+    def forget(self, user_id: str) -> None:
+        """No read cache to drop; present for parity with MongoCartStore."""
+
+    # -- Per-line operations -------------------------------------------------
+
+    def find_duplicate(self, user_id: str, fingerprint: Optional[str]) -> int:
+        """Index of the first line with ``fingerprint``, or -1 if there is none."""
+        if fingerprint is None:
+            return -1
+        row = self._conn().execute(
+            "SELECT (SELECT COUNT(*) FROM cart_lines o WHERE o.user_id = l.user_id AND o.position < l.position) "
+            "FROM cart_lines l WHERE l.user_id = ? AND l.fingerprint = ? ORDER BY l.position LIMIT 1",
+            (user_id, fingerprint)
+        ).fetchone()
+        return -1 if row is None else row[0]
+
+    def get_line(self, user_id: str, item_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM cart_lines WHERE user_id = ? AND line_id = ?",
+            (user_id, str(item_id))
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def add_line(self, user_id: str, product: Dict[str, Any]) -> Dict[str, Any]:
+        with self._write() as conn:
+            conn.execute(
+                "INSERT INTO cart_lines (user_id, line_id, position, fingerprint, gst_class, "
+                "subtotal, discount, taxable, gst, data) "
+                "SELECT ?, ?, COALESCE(MAX(position), -1) + 1, ?, ?, ?, ?, ?, ?, ? "
+                "FROM cart_lines WHERE user_id = ?",
+                (user_id, str(product.get('id'))) + self._line_values(product) + (user_id,)
+            )
+            self._bump_version(conn, user_id)
+            return self._totals(conn, user_id)
+
+    def remove_line(self, user_id: str, line: Dict[str, Any],
+                    expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        with self._write() as conn:
+            if not self._matches(conn, user_id, line, expected_version):
+                return None
+            conn.execute(
+                "DELETE FROM cart_lines WHERE user_id = ? AND line_id = ?",
+                (user_id, str(line.get('id')))
+            )
+            self._bump_version(conn, user_id)
+            return self._totals(conn, user_id)
+
+    def replace_line(self, user_id: str, previous: Dict[str, Any], line: Dict[str, Any],
+                     expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        with self._write() as conn:
+            if not self._matches(conn, user_id, previous, expected_version):
+                return None
+            conn.execute(
+                "UPDATE cart_lines SET fingerprint = ?, gst_class = ?, subtotal = ?, discount = ?, "
+                "taxable = ?, gst = ?, data = ? WHERE user_id = ? AND line_id = ?",
+                self._line_values(line) + (user_id, str(previous.get('id')))
+            )
+            self._bump_version(conn, user_id)
+            return self._totals(conn, user_id)
@@ -108,6 +108,32 @@ function addToCart(item, event) {
     });
 }
 
+// Cart version last read from the server. Edits send it back and the server
+// answers 409 if the cart has changed since (e.g. in another tab), so a stale
+// page cannot overwrite newer edits.
+function getCartVersion() {
+    const container = document.querySelector('.cart-container');
+    if (!container || container.dataset.cartVersion === undefined) {
+        return null;
+    }
+    return parseInt(container.dataset.cartVersion);
+}
+
+function setCartVersion(version) {
+    const container = document.querySelector('.cart-container');
+    if (container && version !== undefined && version !== null) {
+        container.dataset.cartVersion = version;
+    }
+}
+
+// The cart changed in another tab: show the message and reload the fresh cart
+function handleCartConflict(response) {
+    return response.json().then(data => {
+        setTimeout(() => window.location.reload(), 1500);
+        throw new Error(data.message || 'Your cart was changed in another window');
+    });
+}
+
 // Function to get CSRF token from cookies
 function getCSRFToken() {
     const name = 'csrf_token=';
@@ -1457,10 +1483,14 @@ function updateCartItemDiscount(index, discountPercent, itemId) {
         body: JSON.stringify({
             index: parseInt(index),
             item_id: itemId,
-            discount_percent: parseFloat(discountPercent)
+            discount_percent: parseFloat(discountPercent),
+            version: getCartVersion()
         })
     })
     .then(response => {
+        if (response.status === 409) {
+            return handleCartConflict(response);
+        }
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
@@ -1468,6 +1498,7 @@ function updateCartItemDiscount(index, discountPercent, itemId) {
     })
     .then(data => {
         if (data.success) {
+            setCartVersion(data.version);
             // Update the UI with the new data from the server
             if (data.updated_item) {
                 updateItemDisplay(cartItem, data.updated_item);
@@ -1583,10 +1614,14 @@ function updateCartItemQuantity(index, newQuantity, type) {
             index: parseInt(index),
             item_id: itemId,
             quantity: parseInt(newQuantity),
-            type: cartItem ? cartItem.getAttribute('data-type') : null
+            type: cartItem ? cartItem.getAttribute('data-type') : null,
+            version: getCartVersion()
         })
     })
     .then(response => {
+        if (response.status === 409) {
+            return handleCartConflict(response);
+        }
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
@@ -1594,6 +1629,7 @@ function updateCartItemQuantity(index, newQuantity, type) {
     })
     .then(data => {
         if (data.success) {
+            setCartVersion(data.version);
             // Update the UI with the new data from the server
             if (data.updated_item) {
                 // Utilize helper to refresh all price-related fields including discount & GST
@@ -1960,9 +1996,12 @@ function removeFromCart(event, itemId, callback) {
             'Content-Type': 'application/json',
             'X-CSRFToken': csrfToken
         },
-        body: JSON.stringify({ item_id: itemId })
+        body: JSON.stringify({ item_id: itemId, version: getCartVersion() })
     })
     .then(response => {
+        if (response.status === 409) {
+            return handleCartConflict(response);
+        }
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
@@ -1970,6 +2009,7 @@ function removeFromCart(event, itemId, callback) {
     })
     .then(data => {
         if (data.success) {
+            setCartVersion(data.version);
             // Fade out the item
             if (itemElement) {
                 itemElement.style.opacity = '0.5';
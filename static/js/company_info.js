@@ -59,11 +59,12 @@
             if (companies.length) return companies;
             
             try {
-                const response = await fetch('/api/companies');
+                // First page only; searches go to the server index
+                const response = await fetch('/api/companies?limit=50&fields=id,name,email');
                 if (!response.ok) {
                     throw new Error(`HTTP error! status: ${response.status}`);
                 }
-                companies = await response.json();
+                companies = (await response.json()).companies || [];
                 return companies;
             } catch (error) {
                 console.error('Error loading companies:', error);
@@ -72,6 +73,29 @@
             }
         }
 
+        // Search the whole directory on the server
+        async function searchCompanies(term) {
+            if (term.length < 2) {
+                // Too short for the server; filter the first page instead
+                if (companies.length === 0) {
+                    await loadCompanies();
+                }
+                return companies.filter(company =>
+                    (company.name && company.name.toLowerCase().startsWith(term))
+                );
+            }
+            try {
+                const response = await fetch(`/api/companies/search?q=${encodeURIComponent(term)}&limit=20`);
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                return await response.json();
+            } catch (error) {
+                console.error('Error searching companies:', error);
+                return [];
+            }
+        }
+
         // Render search results
         function renderResults(companies) {
             if (!searchResults) return;
@@ -400,31 +424,8 @@
                 return;
             }
             
-            // If we don't have companies loaded yet, load them
-            if (companies.length === 0) {
-                await loadCompanies();
-            }
-            
-            // Filter companies
-            const filtered = companies.filter(company => 
-                (company.name && company.name.toLowerCase().includes(term)) || 
-                (company.email && company.email.toLowerCase().includes(term))
-            );
-            
-            // Sort by relevance (starts with first)
-            filtered.sort((a, b) => {
-                const aName = a.name ? a.name.toLowerCase() : '';
-                const bName = b.name ? b.name.toLowerCase() : '';
-                const aStarts = aName.startsWith(term) ? 0 : 1;
-                const bStarts = bName.startsWith(term) ? 0 : 1;
-                
-                if (aStarts !== bStarts) {
-                    return aStarts - bStarts;
-                }
-                
-                return aName.localeCompare(bName);
-            });
-            
+            // Already ranked by the server (name prefix first)
+            const filtered = await searchCompanies(term);
             renderResults(filtered);
         }));
 
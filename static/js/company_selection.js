@@ -34,7 +34,8 @@ document.addEventListener('DOMContentLoaded', async function() {
     async function loadCompanies() {
         showLoading();
         try {
-            const response = await fetch('/get_companies', {
+            // First page only; searches go to the server index
+            const response = await fetch('/get_companies?limit=50&fields=id,name,email', {
                 method: 'GET',
                 credentials: 'same-origin',
                 headers: {
@@ -47,7 +48,7 @@ document.addEventListener('DOMContentLoaded', async function() {
                 throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
             }
             
-            companiesData = await response.json();
+            companiesData = (await response.json()).companies || [];
             console.log('Loaded companies:', companiesData);
             
             if (companiesData.length === 0) {
@@ -88,23 +89,25 @@ document.addEventListener('DOMContentLoaded', async function() {
         showLoading();
         
         // Debounce search to avoid too many requests
-        searchTimeout = setTimeout(() => {
+        searchTimeout = setTimeout(async () => {
             try {
-                // Simple client-side filtering
-                const filteredCompanies = companiesData.filter(company => 
-                    company.name.toLowerCase().includes(searchTerm) || 
-                    company.email.toLowerCase().includes(searchTerm)
-                );
-                
-                // Sort by relevance (exact matches first, then partial matches)
-                filteredCompanies.sort((a, b) => {
-                    const aName = a.name.toLowerCase();
-                    const bName = b.name.toLowerCase();
-                    const aMatch = aName.startsWith(searchTerm) ? 0 : 1;
-                    const bMatch = bName.startsWith(searchTerm) ? 0 : 1;
-                    if (aMatch !== bMatch) return aMatch - bMatch;
-                    return aName.localeCompare(bName);
-                });
+                let filteredCompanies;
+                if (searchTerm.length < 2) {
+                    // Too short for the server; filter the first page instead
+                    filteredCompanies = companiesData.filter(company =>
+                        company.name.toLowerCase().startsWith(searchTerm)
+                    );
+                } else {
+                    // Ranked by the server (name prefix first)
+                    const response = await fetch(`/api/companies/search?q=${encodeURIComponent(searchTerm)}&limit=20`, {
+                        credentials: 'same-origin',
+                        headers: { 'Accept': 'application/json' }
+                    });
+                    if (!response.ok) {
+                        throw new Error(`HTTP error! status: ${response.status}`);
+                    }
+                    filteredCompanies = await response.json();
+                }
                 
                 // Display results
                 if (filteredCompanies.length > 0) {
@@ -0,0 +1,81 @@
+import json
+import os
+
+from json_users import JsonUserStore
+
+
+def record(email, username, **extra):
+    return {'email': email, 'username': username, 'password_hash': 'x', **extra}
+
+
+def test_journal_is_replayed_by_a_new_store(tmp_path):
+    path = str(tmp_path / 'users.json')
+    store = JsonUserStore(path)
+    store.put('1', record('a@x.com', 'Alice'))
+    store.put('2', record('b@x.com', 'Bob'))
+    store.update('1', {'is_verified': True})
+    store.delete('2')
+
+    assert not os.path.exists(path)  # only the journal has been written
+    reopened = JsonUserStore(path)
+    assert reopened.get('1')['is_verified'] is True
+    assert reopened.get('2') is None
+    assert reopened.find_by_identifier('ALICE')[0] == '1'
+    assert reopened.find_by_email('b@x.com') is None
+
+
+def test_unchanged_put_does_not_append(tmp_path):
+    store = JsonUserStore(str(tmp_path / 'users.json'))
+    store.put('1', record('a@x.com', 'Alice'))
+    size = os.path.getsize(store.journal_path)
+    store.put('1', record('a@x.com', 'Alice'))
+    assert os.path.getsize(store.journal_path) == size
+
+
+def test_appends_from_another_store_are_picked_up(tmp_path):
+    path = str(tmp_path / 'users.json')
+    reader = JsonUserStore(path)
+    assert reader.get('1') is None
+    JsonUserStore(path).put('1', record('a@x.com', 'Alice'))
+    assert reader.find_by_username('alice')[0] == '1'
+
+
+def test_partial_journal_line_is_skipped_until_complete(tmp_path):
+    path = str(tmp_path / 'users.json')
+    JsonUserStore(path).put('1', record('a@x.com', 'Alice'))
+    entry = json.dumps({'op': 'put', 'id': '2', 'user': record('b@x.com', 'Bob')})
+    with open(path + '.journal', 'a') as f:
+        f.write(entry[:20])
+    store = JsonUserStore(path)
+    assert store.get('1') is not None
+    assert store.get('2') is None
+    with open(path + '.journal', 'a') as f:
+        f.write(entry[20:] + '\n')
+    assert store.get('2')['username'] == 'Bob'
+
+
+def test_compaction_folds_journal_into_snapshot(tmp_path):
+    path = str(tmp_path / 'users.json')
+    store = JsonUserStore(path, compact_every=3)
+    other = JsonUserStore(path)
+    for i in range(4):
+        store.put(str(i), record(f'u{i}@x.com', f'user{i}'))
+
+    with open(path) as f:
+        snapshot = json.load(f)
+    assert sorted(snapshot) == ['0', '1', '2']
+    with open(store.journal_path) as f:
+        assert len(f.readlines()) == 1  # the put after compaction
+
+    # A store that read the old journal notices the swap and reloads
+    assert sorted(other.all()) == ['0', '1', '2', '3']
+    assert sorted(JsonUserStore(path).all()) == ['0', '1', '2', '3']
+
+
+def test_explicit_compact_empties_journal(tmp_path):
+    path = str(tmp_path / 'users.json')
+    store = JsonUserStore(path)
+    store.put('1', record('a@x.com', 'Alice'))
+    store.compact()
+    assert os.path.getsize(store.journal_path) == 0
+    assert JsonUserStore(path).get('1')['email'] == 'a@x.com'
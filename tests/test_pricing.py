@@ -0,0 +1,62 @@
+import copy
+
+import pytest
+
+from pricing import (aggregate_lines, aggregates_delta, apply_delta, apply_pricing, empty_aggregates,
+                     price_products, summary_from_aggregates)
+
+
+def priced(line):
+    apply_pricing([line])
+    return line
+
+
+LINES = [
+    priced({'id': 'a', 'type': 'mpack', 'unit_price': 150.5, 'quantity': 3, 'discount_percent': 10}),
+    priced({'id': 'b', 'type': 'blanket', 'base_price': 5000, 'bar_price': 160, 'quantity': 1,
+            'discount_percent': 5}),
+    priced({'id': 'c', 'type': 'mpack', 'unit_price': 42, 'quantity': 7, 'gst_percent': 18}),
+]
+
+
+def assert_totals_match(aggregates, products):
+    """Running aggregates summarize to what pricing the whole cart gives."""
+    expected = price_products(products)
+    summary = summary_from_aggregates(aggregates)
+    for key, value in expected['totals'].items():
+        # Aggregates add up per-line rounded amounts; allow a cent per line
+        assert summary['totals'][key] == pytest.approx(value, abs=0.01 * max(len(products), 1)), key
+    for name in ('blankets', 'mpacks'):
+        assert summary['gst_breakdown'][name]['line_count'] == expected['gst_breakdown'][name]['line_count']
+
+
+def test_aggregate_lines_matches_summarize():
+    assert_totals_match(aggregate_lines(LINES), LINES)
+
+
+def test_deltas_track_adds_edits_and_removes():
+    products = []
+    aggregates = empty_aggregates()
+    for line in copy.deepcopy(LINES):
+        apply_delta(aggregates, aggregates_delta(added=[line]))
+        products.append(line)
+    assert_totals_match(aggregates, products)
+
+    edited = priced(dict(copy.deepcopy(products[0]), quantity=5, discount_percent=0))
+    apply_delta(aggregates, aggregates_delta(removed=[products[0]], added=[edited]))
+    products[0] = edited
+    assert_totals_match(aggregates, products)
+
+    removed = products.pop(1)
+    apply_delta(aggregates, aggregates_delta(removed=[removed]))
+    assert_totals_match(aggregates, products)
+    assert aggregates['blankets']['line_count'] == 0
+
+
+def test_delta_of_unchanged_line_is_empty():
+    assert aggregates_delta(removed=[LINES[0]], added=[copy.deepcopy(LINES[0])]) == {}
+
+
+def test_empty_aggregates_summarize_to_zero():
+    assert summary_from_aggregates(empty_aggregates())['totals']['total'] == 0
+    assert summary_from_aggregates(None)['totals']['line_count'] == 0
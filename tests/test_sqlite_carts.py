@@ -0,0 +1,65 @@
+import pytest
+
+from pricing import apply_pricing
+from sqlite_carts import SqliteCartStore
+
+
+def make_line(line_id, quantity=1, unit_price=100.0):
+    line = {'id': line_id, 'type': 'mpack', 'unit_price': unit_price, 'quantity': quantity, 'gst_percent': 12}
+    apply_pricing([line])
+    return line
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteCartStore(str(tmp_path / 'carts.db'))
+
+
+def test_save_cart_bumps_version(store):
+    assert store.save_cart('u', [make_line('a')])['version'] == 1
+    assert store.save_cart('u', [make_line('a'), make_line('b')], expected_version=1)['version'] == 2
+
+
+def test_save_cart_with_stale_version_is_rejected(store):
+    store.save_cart('u', [make_line('a')])
+    store.add_line('u', make_line('b'))  # version 2
+    assert store.save_cart('u', [], expected_version=1) is None
+    products, aggregates = store.get_cart_with_totals('u')
+    assert [p['id'] for p in products] == ['a', 'b']
+    assert aggregates['version'] == 2
+
+
+def test_replace_line_with_stale_version_is_rejected(store):
+    store.save_cart('u', [make_line('a'), make_line('b')])
+    previous = store.get_line('u', 'a')
+    store.remove_line('u', store.get_line('u', 'b'))  # version 2
+    assert store.replace_line('u', previous, make_line('a', quantity=3), expected_version=1) is None
+    assert store.get_line('u', 'a')['quantity'] == 1
+
+    aggregates = store.replace_line('u', previous, make_line('a', quantity=3), expected_version=2)
+    assert aggregates['version'] == 3
+    assert store.get_line('u', 'a')['quantity'] == 3
+
+
+def test_replace_line_changed_since_read_is_rejected(store):
+    store.save_cart('u', [make_line('a')])
+    previous = store.get_line('u', 'a')
+    assert store.replace_line('u', previous, make_line('a', quantity=2)) is not None
+    # ``previous`` no longer matches the stored line
+    assert store.replace_line('u', previous, make_line('a', quantity=5)) is None
+    assert store.get_line('u', 'a')['quantity'] == 2
+
+
+def test_remove_line_with_stale_version_is_rejected(store):
+    store.save_cart('u', [make_line('a')])
+    line = store.get_line('u', 'a')
+    assert store.remove_line('u', line, expected_version=0) is None
+    assert store.remove_line('u', line, expected_version=1)['line_count'] == 0
+
+
+def test_totals_follow_lines(store):
+    store.save_cart('u', [make_line('a', quantity=2), make_line('b')])
+    _, aggregates = store.get_cart_with_totals('u')
+    assert aggregates['line_count'] == 2
+    assert aggregates['mpacks']['subtotal'] == pytest.approx(300.0)
+    assert aggregates['mpacks']['gst'] == pytest.approx(36.0)
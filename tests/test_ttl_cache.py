@@ -0,0 +1,58 @@
+import threading
+
+from ttl_cache import TTLCache
+
+
+def test_set_with_current_generation_is_stored():
+    cache = TTLCache(maxsize=4, ttl=60)
+    assert cache.set('k', 1, generation=cache.generation)
+    assert cache.get('k') == 1
+
+
+def test_clear_and_invalidate_bump_generation():
+    cache = TTLCache(maxsize=4, ttl=60)
+    start = cache.generation
+    cache.clear()
+    cache.invalidate('k')
+    assert cache.generation == start + 2
+
+
+def test_set_after_clear_with_stale_generation_is_dropped():
+    cache = TTLCache(maxsize=4, ttl=60)
+    generation = cache.generation
+    cache.clear()
+    assert not cache.set('k', 'stale', generation=generation)
+    assert cache.get('k') is None
+    # Without a generation the write is unconditional
+    assert cache.set('k', 'fresh')
+    assert cache.get('k') == 'fresh'
+
+
+def test_clear_during_load_keeps_stale_value_out():
+    cache = TTLCache(maxsize=4, ttl=60)
+    loading = threading.Event()
+    cleared = threading.Event()
+    stored = []
+
+    def load():
+        generation = cache.generation
+        loading.set()
+        cleared.wait(5)
+        stored.append(cache.set('machines', ['old'], generation=generation))
+
+    loader = threading.Thread(target=load)
+    loader.start()
+    assert loading.wait(5)
+    cache.clear()  # a write lands while the load is in flight
+    cleared.set()
+    loader.join(5)
+
+    assert stored == [False]
+    assert cache.peek('machines') is None
+
+
+def test_expired_entries_miss():
+    cache = TTLCache(maxsize=4, ttl=-1)
+    cache.set('k', 1)
+    assert cache.get('k') is None
+    assert cache.stats()['misses'] == 1